@@ -0,0 +1,72 @@
+"""
+Creation, signing and (de)serialization of blocks.
+
+Run with: nox -s benchmarks -- benchmarks/bench_block.py
+"""
+from ipv8.keyvault.crypto import default_eccrypto
+import pytest
+
+from bami.backbone.block import BamiBlock
+from bami.backbone.datastore.block_store import MemoryBlockStore
+from bami.backbone.datastore.chain_store import ChainFactory
+from bami.backbone.datastore.database import DBManager
+from bami.backbone.utils import encode_raw
+
+pytestmark = pytest.mark.benchmark(group="block")
+
+
+@pytest.fixture(scope="module")
+def key():
+    return default_eccrypto.generate_key(u"curve25519")
+
+
+@pytest.fixture(scope="module")
+def dbms(com_blocks):
+    dbms = DBManager(ChainFactory(), MemoryBlockStore())
+    for blk in com_blocks:
+        dbms.add_block(blk.pack(), blk)
+    yield dbms
+    dbms.close()
+
+
+@pytest.fixture(scope="module")
+def signed_block(key, dbms, com_blocks):
+    blk = BamiBlock.create(
+        b"test",
+        encode_raw({b"id": 42}),
+        dbms,
+        key.pub().key_to_bin(),
+        com_id=com_blocks[0].com_id,
+    )
+    blk.sign(key)
+    return blk
+
+
+def test_create(benchmark, key, dbms, com_blocks):
+    blk = benchmark(
+        BamiBlock.create,
+        b"test",
+        encode_raw({b"id": 42}),
+        dbms,
+        key.pub().key_to_bin(),
+        com_id=com_blocks[0].com_id,
+    )
+    assert blk.com_seq_num == len(com_blocks) + 1
+
+
+def test_sign(benchmark, key, signed_block):
+    benchmark(signed_block.sign, key)
+
+
+def test_pack(benchmark, signed_block):
+    benchmark(signed_block.pack)
+
+
+def test_unpack(benchmark, signed_block):
+    blob = signed_block.pack()
+    blk = benchmark(BamiBlock.unpack, blob, signed_block.serializer)
+    assert blk.hash == signed_block.hash
+
+
+def test_block_invariants_valid(benchmark, signed_block):
+    assert benchmark(signed_block.block_invariants_valid)
@@ -0,0 +1,102 @@
+"""
+Size and throughput of the block store layouts.
+
+Run with: nox -s benchmarks -- benchmarks/bench_block_store.py
+"""
+import pytest
+
+from bami.backbone.datastore.block_store import (
+    BaseBlockStore,
+    LMDBDirectBlockStore,
+    LMDBLockStore,
+    MemoryBlockStore,
+)
+from bami.backbone.datastore.chain_store import ChainFactory
+from bami.backbone.datastore.database import DBManager
+from bami.backbone.datastore.segment_store import SegmentLogBlockStore
+
+STORES = {
+    "lmdb": LMDBLockStore,
+    "lmdb_direct": LMDBDirectBlockStore,
+    "segment_log": SegmentLogBlockStore,
+    "memory": MemoryBlockStore,
+}
+
+
+def used_bytes(block_store: BaseBlockStore) -> int:
+    """Bytes of the store in use"""
+    if isinstance(block_store, SegmentLogBlockStore):
+        return block_store.used_bytes()
+    if isinstance(block_store, MemoryBlockStore):
+        return block_store.current_bytes
+    env = block_store.env
+    return (env.info()["last_pgno"] + 1) * env.stat()["psize"]
+
+
+def fill(store_name: str, block_dir: str, blocks) -> DBManager:
+    # Blob cache is disabled to measure the store itself
+    store_cls = STORES[store_name]
+    block_store = store_cls() if store_cls is MemoryBlockStore else store_cls(block_dir)
+    dbms = DBManager(ChainFactory(), block_store)
+    for blk in blocks:
+        dbms.add_block(blk.pack(), blk)
+    return dbms
+
+
+@pytest.fixture(params=sorted(STORES))
+def filled_dbms(request, tmpdir, com_blocks):
+    dbms = fill(request.param, str(tmpdir), com_blocks)
+    yield request.param, dbms
+    dbms.close()
+
+
+def add_info(benchmark, store_name: str, dbms: DBManager, num_blocks: int) -> None:
+    benchmark.extra_info["store"] = store_name
+    benchmark.extra_info["blocks"] = num_blocks
+    benchmark.extra_info["used_bytes"] = used_bytes(dbms.block_store)
+
+
+def test_read_blob_by_dot(benchmark, filled_dbms, com_blocks):
+    store_name, dbms = filled_dbms
+    dots = [(blk.com_id, blk.com_dot) for blk in com_blocks]
+
+    def read_all():
+        for chain_id, dot in dots:
+            dbms.get_block_blob_by_dot(chain_id, dot)
+
+    benchmark(read_all)
+    add_info(benchmark, store_name, dbms, len(com_blocks))
+
+
+def test_read_tx_by_dot(benchmark, filled_dbms, com_blocks):
+    store_name, dbms = filled_dbms
+    dots = [(blk.public_key, blk.pers_dot) for blk in com_blocks]
+
+    def read_all():
+        for chain_id, dot in dots:
+            dbms.get_tx_blob_by_dot(chain_id, dot)
+
+    benchmark(read_all)
+    add_info(benchmark, store_name, dbms, len(com_blocks))
+
+
+def test_seq_range_scan(benchmark, filled_dbms, com_blocks):
+    store_name, dbms = filled_dbms
+    com_id = com_blocks[0].com_id
+    blobs = benchmark(
+        dbms.block_store.get_block_blobs_by_seq_range, com_id, 1, len(com_blocks)
+    )
+    assert len(blobs) == len(com_blocks)
+    add_info(benchmark, store_name, dbms, len(com_blocks))
+
+
+@pytest.mark.parametrize("store_name", sorted(STORES))
+def test_write_blocks(benchmark, tmpdir, com_blocks, store_name):
+    rounds = iter(range(1000))
+
+    def setup():
+        return (store_name, str(tmpdir.mkdir(str(next(rounds)))), com_blocks), {}
+
+    dbms = benchmark.pedantic(fill, setup=setup, rounds=3)
+    add_info(benchmark, store_name, dbms, len(com_blocks))
+    dbms.close()
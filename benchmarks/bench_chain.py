@@ -0,0 +1,89 @@
+"""
+Insertion into the chain, reconciliation of frontiers and their serialization.
+
+Run with: nox -s benchmarks -- benchmarks/bench_chain.py
+"""
+import random
+from typing import List
+
+import pytest
+
+from bami.backbone.block import BamiBlock
+from bami.backbone.datastore.chain_store import Chain
+from bami.backbone.datastore.frontiers import Frontier
+from bami.backbone.utils import Links
+
+from tests.conftest import FakeBlock
+
+pytestmark = pytest.mark.benchmark(group="chain")
+
+# Lengths of the reconciled chains, at most BAMI_BENCH_BLOCKS
+CHAIN_LENGTHS = (100, 500, 2000)
+
+
+def fill_chain(blocks: List[BamiBlock]) -> Chain:
+    chain = Chain()
+    for blk in blocks:
+        chain.add_block(blk.links, blk.com_seq_num, blk.hash)
+    return chain
+
+
+@pytest.fixture(scope="module")
+def forked_blocks(com_blocks) -> List[BamiBlock]:
+    """Chain with a concurrent block every 10 sequence numbers"""
+    blocks = []
+    for i, blk in enumerate(com_blocks):
+        blocks.append(blk)
+        if i % 10 == 0:
+            blocks.append(FakeBlock(com_id=blk.com_id, links=blk.links))
+    return blocks
+
+
+@pytest.fixture(scope="module")
+def shuffled_blocks(com_blocks) -> List[BamiBlock]:
+    blocks = list(com_blocks)
+    random.Random(42).shuffle(blocks)
+    return blocks
+
+
+@pytest.mark.parametrize("order", ["linear", "forked", "out_of_order"])
+def test_add_block(benchmark, order, com_blocks, forked_blocks, shuffled_blocks):
+    blocks = {
+        "linear": com_blocks,
+        "forked": forked_blocks,
+        "out_of_order": shuffled_blocks,
+    }[order]
+    chain = benchmark(fill_chain, blocks)
+    assert max(chain.terminal)[0] == len(com_blocks)
+    benchmark.extra_info["blocks"] = len(blocks)
+
+
+@pytest.mark.parametrize("length", CHAIN_LENGTHS)
+def test_reconcile(benchmark, length, com_blocks):
+    if length > len(com_blocks):
+        pytest.skip("Chain is shorter than {}".format(length))
+    blocks = com_blocks[:length]
+    # Other side knows every other block: its frontier is full of holes
+    chain = fill_chain(blocks[::2])
+    frontier = fill_chain(blocks).frontier
+
+    diff = benchmark(chain.reconcile, frontier)
+    assert diff.missing
+    benchmark.extra_info["blocks"] = length
+
+
+@pytest.fixture(scope="module")
+def frontier(forked_blocks) -> Frontier:
+    # Every third block is missing: the frontier has holes and inconsistencies
+    blocks = [blk for i, blk in enumerate(forked_blocks) if i % 3]
+    return fill_chain(blocks).frontier
+
+
+def test_frontier_to_bytes(benchmark, frontier):
+    benchmark(frontier.to_bytes)
+
+
+def test_frontier_from_bytes(benchmark, frontier):
+    blob = frontier.to_bytes()
+    restored = benchmark(Frontier.from_bytes, blob)
+    assert Links(restored.terminal) == frontier.terminal
@@ -0,0 +1,56 @@
+"""
+Adding blocks to the database and serving the blocks of a frontier diff, on LMDB.
+
+Run with: nox -s benchmarks -- benchmarks/bench_database.py
+"""
+import pytest
+
+from bami.backbone.datastore.block_store import LMDBLockStore
+from bami.backbone.datastore.chain_store import ChainFactory
+from bami.backbone.datastore.database import DBManager
+from bami.backbone.datastore.frontiers import FrontierDiff
+from bami.backbone.utils import Ranges
+
+pytestmark = pytest.mark.benchmark(group="database")
+
+
+def fill(block_dir: str, blocks) -> DBManager:
+    dbms = DBManager(ChainFactory(), LMDBLockStore(block_dir))
+    for blk in blocks:
+        dbms.add_block(blk.pack(), blk)
+    return dbms
+
+
+def test_add_block(benchmark, tmpdir, com_blocks):
+    rounds = iter(range(1000))
+
+    def setup():
+        return (str(tmpdir.mkdir(str(next(rounds)))), com_blocks), {}
+
+    dbms = benchmark.pedantic(fill, setup=setup, rounds=3)
+    benchmark.extra_info["blocks"] = len(com_blocks)
+    dbms.close()
+
+
+@pytest.fixture(scope="module")
+def filled_dbms(tmpdir_factory, com_blocks):
+    dbms = fill(str(tmpdir_factory.mktemp("lmdb")), com_blocks)
+    yield dbms
+    dbms.close()
+
+
+@pytest.mark.parametrize("num_missing", [10, 100, 1000])
+def test_get_block_blobs_by_frontier_diff(
+    benchmark, filled_dbms, com_blocks, num_missing
+):
+    num_missing = min(num_missing, len(com_blocks))
+    com_id = com_blocks[0].com_id
+    # Peer misses the last blocks of the chain
+    start = len(com_blocks) - num_missing + 1
+    front_diff = FrontierDiff(Ranges(((start, len(com_blocks)),)), {})
+
+    blobs = benchmark(
+        filled_dbms.get_block_blobs_by_frontier_diff, com_id, front_diff, set()
+    )
+    assert len(blobs) == num_missing
+    benchmark.extra_info["blocks"] = num_missing
@@ -0,0 +1,164 @@
+"""
+Throughput of the payment state with many peers.
+
+Runs 1000 peers and 20000 transactions by default, scale up with BAMI_BENCH_PEERS and BAMI_BENCH_TXS
+(e.g. 10000 peers and 1000000 transactions).
+Run with: nox -s benchmarks -- benchmarks/bench_payment_state.py
+"""
+from decimal import Decimal
+import os
+from time import perf_counter
+from typing import List, Tuple
+
+import pytest
+
+from bami.backbone.utils import Dot, GENESIS_LINK, Links
+from bami.payment.database import PaymentState
+from bami.payment.utils import Amount, to_minor_units
+
+NUM_PEERS = int(os.environ.get("BAMI_BENCH_PEERS", 1000))
+NUM_TXS = int(os.environ.get("BAMI_BENCH_TXS", 20000))
+PRECISION = 10
+
+CHAIN_ID = b"community"
+
+# spender, receiver, seq_num of the spend, cumulative pairwise value
+SpendTx = Tuple[bytes, bytes, int, Amount]
+
+
+def make_peers(num_peers: int) -> List[bytes]:
+    return [i.to_bytes(8, "big") for i in range(num_peers)]
+
+
+def make_workload(peers: List[bytes], num_txs: int) -> List[SpendTx]:
+    num_peers = len(peers)
+    pair_values = dict()
+    txs = []
+    for i in range(num_txs):
+        spender = peers[i % num_peers]
+        # Every round the peer pays a different counter-party
+        receiver = peers[(i * 7 + i // num_peers + 1) % num_peers]
+        value = pair_values.get((spender, receiver), Decimal(0)) + 1
+        pair_values[(spender, receiver)] = value
+        txs.append((spender, receiver, i // num_peers + 1, value))
+    return txs
+
+
+@pytest.fixture(scope="module")
+def peers() -> List[bytes]:
+    return make_peers(NUM_PEERS)
+
+
+@pytest.fixture(scope="module")
+def workload(peers) -> List[SpendTx]:
+    return make_workload(peers, NUM_TXS)
+
+
+@pytest.fixture(scope="module")
+def minor_unit_workload(workload) -> List[SpendTx]:
+    return [
+        (spender, receiver, seq_num, to_minor_units(value, PRECISION))
+        for spender, receiver, seq_num, value in workload
+    ]
+
+
+def minted_state(
+    peers: List[bytes], num_txs: int, minor_units: bool = False
+) -> PaymentState:
+    """State in which every peer minted enough for the spends of the workload"""
+    state = PaymentState(PRECISION, minor_units=minor_units)
+    mint_value = to_minor_units(num_txs, PRECISION) if minor_units else Decimal(num_txs)
+    for peer in peers:
+        state.apply_mint(CHAIN_ID, Dot((0, peer)), GENESIS_LINK, peer, mint_value)
+    return state
+
+
+def apply_workload(
+    peers: List[bytes],
+    txs: List[SpendTx],
+    store_update: bool = False,
+    minor_units: bool = False,
+) -> PaymentState:
+    state = minted_state(peers, len(txs), minor_units)
+    apply_txs(state, txs, store_update)
+    return state
+
+
+def apply_txs(state: PaymentState, txs: List[SpendTx], store_update: bool) -> None:
+    for spender, receiver, seq_num, value in txs:
+        spend_dot = Dot((seq_num, spender))
+        state.apply_spend(
+            CHAIN_ID,
+            state.get_last_pairwise_links(spender, receiver),
+            GENESIS_LINK,
+            spend_dot,
+            spender,
+            receiver,
+            value,
+            store_update,
+        )
+        state.apply_confirm(
+            CHAIN_ID,
+            receiver,
+            Links((spend_dot,)),
+            Dot((seq_num, receiver)),
+            spender,
+            spend_dot,
+            value,
+            store_update,
+        )
+
+
+@pytest.fixture(scope="module")
+def applied_state(peers, workload) -> PaymentState:
+    return apply_workload(peers, workload)
+
+
+def add_info(benchmark) -> None:
+    benchmark.extra_info["peers"] = NUM_PEERS
+    benchmark.extra_info["txs"] = NUM_TXS
+
+
+@pytest.mark.parametrize("store_update", [False, True])
+def test_apply_transactions(benchmark, peers, workload, store_update):
+    """With store_update, a status snapshot with its hash is stored for every block"""
+    benchmark.pedantic(apply_workload, args=(peers, workload, store_update), rounds=1)
+    add_info(benchmark)
+
+
+def test_status_snapshots_independent_of_peers():
+    """A status stored for every block shares the unchanged part of the previous status.
+    The cost per transaction stays O(log peers): 16 times the peers is far from 16 times the time.
+    """
+
+    def time_per_tx(num_peers: int) -> float:
+        peers = make_peers(num_peers)
+        txs = make_workload(peers, 20000)
+        state = minted_state(peers, len(txs))
+        start = perf_counter()
+        apply_txs(state, txs, store_update=True)
+        return (perf_counter() - start) / len(txs)
+
+    assert time_per_tx(8000) < 2 * time_per_tx(500)
+
+
+def test_apply_minor_unit_transactions(benchmark, peers, minor_unit_workload):
+    """Same as test_apply_transactions[False] with integer amounts instead of Decimal"""
+    benchmark.pedantic(
+        apply_workload, args=(peers, minor_unit_workload, False, True), rounds=1
+    )
+    add_info(benchmark)
+
+
+def test_get_balance(benchmark, peers, applied_state):
+    def all_balances():
+        for peer in peers:
+            applied_state.get_balance(peer)
+
+    benchmark(all_balances)
+    add_info(benchmark)
+
+
+def test_last_peer_status(benchmark, applied_state):
+    benchmark(applied_state.get_last_peer_status, CHAIN_ID)
+    add_info(benchmark)
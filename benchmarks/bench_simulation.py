@@ -0,0 +1,50 @@
+"""
+Convergence of the block gossip in a simulated network, for several gossip settings.
+Time is virtual: the benchmark time is the cost of simulating, the convergence is in the extra info.
+
+Scale with BAMI_BENCH_NODES and BAMI_BENCH_SIM_BLOCKS.
+Run with: nox -s benchmarks -- benchmarks/bench_simulation.py
+"""
+import os
+
+import pytest
+
+from bami.simulation.network import NetworkModel
+from bami.simulation.simulation import default_settings, run_simulation, Simulation
+
+pytestmark = pytest.mark.benchmark(group="simulation")
+
+NUM_NODES = int(os.environ.get("BAMI_BENCH_NODES", 100))
+NUM_BLOCKS = int(os.environ.get("BAMI_BENCH_SIM_BLOCKS", 10))
+
+# Push gossip fanout, frontier gossip fanout, frontier gossip interval
+GOSSIP_SETTINGS = [(9, 6, 0.5), (3, 6, 0.5), (9, 3, 0.5), (9, 6, 0.2)]
+
+NETWORKS = {
+    "lan": dict(latency=0.001),
+    "wan": dict(latency=0.05, jitter=0.05, loss=0.01, bandwidth=10 ** 6),
+}
+
+
+@pytest.mark.parametrize("network", sorted(NETWORKS))
+@pytest.mark.parametrize("push_fanout,gossip_fanout,gossip_interval", GOSSIP_SETTINGS)
+def test_convergence(benchmark, network, push_fanout, gossip_fanout, gossip_interval):
+    settings = default_settings()
+    settings.push_gossip_fanout = push_fanout
+    settings.gossip_fanout = gossip_fanout
+    settings.gossip_interval = gossip_interval
+
+    def simulate():
+        model = NetworkModel(**NETWORKS[network])
+        sim = Simulation(NUM_NODES, model=model, settings=settings)
+        return run_simulation(sim.measure_convergence(NUM_BLOCKS))
+
+    report = benchmark.pedantic(simulate, rounds=1)
+    assert report.converged
+    benchmark.extra_info.update(
+        nodes=NUM_NODES,
+        blocks=report.num_blocks,
+        convergence_time=report.convergence_time,
+        messages_per_block=report.messages_per_block,
+        bytes_per_block=report.bytes_per_block,
+    )
@@ -0,0 +1,18 @@
+import os
+from typing import List
+
+from ipv8.keyvault.crypto import default_eccrypto
+import pytest
+
+from bami.backbone.block import BamiBlock
+
+from tests.conftest import create_block_batch
+
+# Number of blocks in the benchmarked chains
+NUM_BLOCKS = int(os.environ.get("BAMI_BENCH_BLOCKS", 2000))
+
+
+@pytest.fixture(scope="session")
+def com_blocks() -> List[BamiBlock]:
+    com_id = default_eccrypto.generate_key(u"curve25519").pub().key_to_bin()
+    return create_block_batch(com_id, NUM_BLOCKS)
@@ -137,3 +137,19 @@ def tests(session: Session) -> None:
         "pytest-xdist",
     )
     session.run("pytest", *args)
+
+
+@nox.session(python="3.7")
+def benchmarks(session: Session) -> None:
+    """Run the benchmarks. Results are saved as JSON in .benchmarks, per commit.
+
+    Compare with the previous run: nox -s benchmarks -- benchmarks --benchmark-compare
+    """
+    args = session.posargs or ["benchmarks"]
+    session.run("poetry", "install", "--no-dev", external=True)
+    install_with_constraints(
+        session, "pytest", "pytest-asyncio", "pytest-benchmark", "pytest-mock"
+    )
+    session.run(
+        "pytest", "-o", "python_files=bench_*.py", "--benchmark-autosave", *args
+    )
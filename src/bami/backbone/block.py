@@ -96,7 +96,7 @@ class BamiBlock(object):
             self.timestamp = int(time.time() * 1000)
             # Signature for the block
             self.signature = EMPTY_SIG
-            # debug stuff
+            # Time the block was decoded from a payload, start of the trace of a received block
             self.insert_time = None
         else:
             self.transaction = data[1] if isinstance(data[1], bytes) else bytes(data[1])
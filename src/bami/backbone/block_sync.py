@@ -1,4 +1,5 @@
 from abc import ABCMeta, abstractmethod
+from time import perf_counter
 from typing import Union, Iterable
 
 from ipv8.lazy_community import lazy_wrapper
@@ -8,7 +9,8 @@ from bami.backbone.community_routines import (
     CommunityRoutines,
     MessageStateMachine,
 )
-from bami.backbone.utils import Links, WITNESS_TYPE
+from bami.backbone.tracing import BlockStage
+from bami.backbone.utils import EMPTY_PK, Links, WITNESS_TYPE
 from bami.backbone.exceptions import InvalidBlockException
 from bami.backbone.payload import (
     RawBlockBroadcastPayload,
@@ -102,16 +104,23 @@ class BlockSyncMixin(MessageStateMachine, CommunityRoutines, metaclass=ABCMeta):
         Raises:
             InvalidBlockException - if block is not valid
         """
+        metrics = self.metrics
+        if metrics:
+            start = perf_counter()
         block = (
             BamiBlock.unpack(block, self.serializer) if type(block) is bytes else block
         )
         block_blob = block if type(block) is bytes else block.pack()
 
         if not block.block_invariants_valid():
+            if metrics:
+                metrics.counter("blocks_invalid_total", "Invalid blocks").inc()
             # React on invalid block
             raise InvalidBlockException("Block invalid", str(block), peer)
         else:
             if not self.persistence.has_block(block.hash):
+                if self.tracer and block.com_id != EMPTY_PK:
+                    self.trace_block_start(block, peer)
                 self.process_block_unordered(block, peer)
                 chain_id = block.com_id
                 prefix = block.com_prefix
@@ -131,6 +140,26 @@ class BlockSyncMixin(MessageStateMachine, CommunityRoutines, metaclass=ABCMeta):
                         block.com_dot,
                     )
                 self.persistence.add_block(block_blob, block)
+                if metrics:
+                    metrics.counter(
+                        "blocks_validated_total", "New blocks validated and persisted"
+                    ).inc()
+                    metrics.histogram(
+                        "validate_persist_seconds",
+                        "Time to validate, persist and deliver a new block",
+                    ).observe(perf_counter() - start)
+            elif metrics:
+                metrics.counter("blocks_duplicate_total", "Known blocks received").inc()
+
+    def trace_block_start(self, block: BamiBlock, peer: Peer = None) -> None:
+        chain_id = block.com_prefix + block.com_id
+        if peer == self.my_peer:
+            start, start_time = BlockStage.CREATED, block.timestamp / 1000
+        else:
+            # Received blocks are decoded from the payload just before the validation
+            start, start_time = BlockStage.RECEIVED, block.insert_time
+        self.tracer.start(chain_id, block.com_dot, start, start_time)
+        self.tracer.record(chain_id, block.com_dot, BlockStage.VERIFIED)
 
     def create_signed_block(
         self,
@@ -3,6 +3,7 @@ The Plexus backbone
 """
 from abc import ABCMeta, abstractmethod
 from asyncio import (
+    all_tasks,
     ensure_future,
     Future,
     iscoroutinefunction,
@@ -19,10 +20,20 @@ from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Type, U
 from bami.backbone.block import BamiBlock
 from bami.backbone.block_sync import BlockSyncMixin
 from bami.backbone.community_routines import MessageStateMachine
-from bami.backbone.datastore.block_store import LMDBLockStore
+from bami.backbone.datastore.block_store import (
+    BaseBlockStore,
+    LMDBDirectBlockStore,
+    LMDBLockStore,
+    MemoryBlockStore,
+)
 from bami.backbone.datastore.chain_store import ChainFactory
 from bami.backbone.datastore.database import BaseDB, ChainTopic, DBManager
 from bami.backbone.datastore.frontiers import Frontier
+from bami.backbone.datastore.migrations import (
+    migrate_dot_keys,
+    migrate_to_direct_layout,
+)
+from bami.backbone.datastore.segment_store import SegmentLogBlockStore
 from bami.backbone.exceptions import (
     DatabaseDesynchronizedException,
     InvalidTransactionFormatException,
@@ -31,15 +42,21 @@ from bami.backbone.exceptions import (
     UnknownChainException,
 )
 from bami.backbone.gossip import SubComGossipMixin
+from bami.backbone.loop_monitor import LoopMonitor
+from bami.backbone.metrics import MetricsRegistry
 from bami.backbone.payload import SubscriptionsPayload
-from bami.backbone.settings import BamiSettings
+from bami.backbone.profiling import HandlerProfiler
+from bami.backbone.recorder import PacketRecorder
+from bami.backbone.settings import BamiSettings, BlockStoreType
 from bami.backbone.sub_community import (
     BaseSubCommunity,
     BaseSubCommunityFactory,
     SubCommunityDiscoveryStrategy,
     SubCommunityMixin,
 )
+from bami.backbone.tracing import BlockStage, BlockTracer
 from bami.backbone.utils import (
+    CONFIRM_BATCH_TYPE,
     CONFIRM_TYPE,
     decode_raw,
     Dot,
@@ -121,6 +138,8 @@ class BamiCommunity(
             def interval():
                 return random.random()
 
+        if self.profiler:
+            task = self.profiler.wrap(task, "task")
         task = task if iscoroutinefunction(task) else coroutine(task)
         return self.register_task(
             name, ensure_future(self.flex_runner(delay, interval, task, *args))
@@ -156,16 +175,45 @@ class BamiCommunity(
 
         if not work_dir:
             work_dir = self.settings.work_directory
+        self.work_dir = work_dir
         if not db:
-            self._persistence = DBManager(ChainFactory(), LMDBLockStore(work_dir))
+            self._persistence = DBManager(
+                ChainFactory(self.settings.term_cache_size),
+                self.create_block_store(work_dir),
+                cache_size=self.settings.block_cache_size,
+            )
         else:
             self._persistence = db
+        if self.settings.block_tracing:
+            self.tracer = BlockTracer(self.settings.tracing_max_blocks)
+            self._persistence.tracer = self.tracer
+        if self.settings.metrics_enabled:
+            self.metrics = MetricsRegistry()
+            self._persistence.metrics = self.metrics
+        if self.settings.record_file:
+            self.recorder = PacketRecorder(self.settings.record_file)
+        if self.settings.handler_profiling or self.settings.loop_monitoring:
+            self.profiler = HandlerProfiler(
+                self.settings.profiling_slowest_calls,
+                self.settings.profiling_top_handlers,
+                self.settings.profiling_memory,
+            )
+        if self.settings.loop_monitoring:
+            self.loop_monitor = LoopMonitor(
+                self.profiler,
+                self.settings.loop_monitor_interval,
+                self.settings.loop_lag_threshold,
+                self.settings.loop_max_spikes,
+            )
         if not max_peers:
             max_peers = self.settings.main_max_peers
         self._ipv8 = ipv8
         super(BamiCommunity, self).__init__(
             my_peer, endpoint, network, max_peers, anonymize=anonymize
         )
+        if self.profiler:
+            # Handlers of the IPv8 community, the next ones are wrapped when added
+            self.profiler.wrap_handlers(self.decode_map)
 
         self._logger = logging.getLogger(self.__class__.__name__)
         # Create DB Manager
@@ -201,7 +249,138 @@ class BamiCommunity(
 
         self.add_message_handler(SubscriptionsPayload, self.received_peer_subs)
 
+        if self.tracer and self.settings.tracing_dump_interval:
+            self.register_task(
+                "dump_block_traces",
+                self.tracer.dump,
+                self.logger,
+                interval=self.settings.tracing_dump_interval,
+                delay=self.settings.tracing_dump_interval,
+            )
+        if self.metrics:
+            self.register_metrics()
+        if self.loop_monitor:
+            self.loop_monitor.start()
+            self.register_task(
+                "monitor_loop",
+                self.check_loop_lag,
+                interval=self.settings.loop_monitor_interval,
+            )
+        if self.settings.handler_profiling and self.settings.profiling_dump_interval:
+            self.register_task(
+                "dump_handler_profile",
+                self.profiler.dump,
+                self.logger,
+                interval=self.settings.profiling_dump_interval,
+                delay=self.settings.profiling_dump_interval,
+            )
+
+    def task_category(self, name: str) -> str:
+        """Category of a task for the loop monitor, without the chain it runs for"""
+        if name.startswith("gossip_sync_"):
+            return "gossip_sync"
+        # Anonymous tasks end with a counter
+        return name.split(" ", 1)[0]
+
+    def count_tasks(self) -> Dict[str, int]:
+        """Live tasks of the community by category, and all tasks of the loop"""
+        counts = dict()
+        for name, task in list(self._pending_tasks.items()):
+            if not task.done():
+                category = self.task_category(name)
+                counts[category] = counts.get(category, 0) + 1
+        counts["frontier_queue"] = sum(
+            not task.done() for task in self.processing_queue_tasks.values()
+        )
+        counts["loop"] = len(all_tasks())
+        return counts
+
+    def check_loop_lag(self) -> None:
+        spike = self.loop_monitor.check(self.count_tasks)
+        if spike:
+            self.loop_monitor.log_spike(self.logger, spike)
+
+    def register_metrics(self) -> None:
+        """Gauges of the queues and the caches, and the periodic metrics file"""
+        self.metrics.gauge(
+            "frontier_queue_depth",
+            "Frontiers waiting to be reconciled",
+            lambda: sum(q.qsize() for q in self.incoming_queues.values()),
+        )
+        if isinstance(self.persistence, DBManager):
+            self.metrics.gauge(
+                "chains", "Chains in memory", lambda: len(self.persistence.chains)
+            )
+            cache = self.persistence.blob_cache
+            self.metrics.gauge(
+                "blob_cache_hit_rate",
+                "Hit rate of the block blob cache",
+                lambda: cache.stats()["blob_hit_rate"],
+            )
+            self.metrics.gauge(
+                "blob_cache_bytes",
+                "Bytes of the block blob cache",
+                lambda: cache.current_bytes,
+            )
+            self.metrics.instrument_lmdb(self.persistence.block_store)
+            term_caches = getattr(self.persistence.chain_factory, "term_caches", None)
+            if term_caches:
+                self.metrics.gauge(
+                    "term_cache_entries",
+                    "Entries of the terminal cache shared by the chains",
+                    lambda: term_caches.stats()["entries"],
+                )
+                self.metrics.gauge(
+                    "term_cache_hit_rate",
+                    "Hit rate of the shared terminal cache",
+                    lambda: term_caches.stats()["hit_rate"],
+                )
+        if self.loop_monitor:
+            monitor = self.loop_monitor
+            self.metrics.gauge(
+                "loop_lag_max_seconds",
+                "Highest event loop lag",
+                lambda: monitor.lag.max,
+            )
+            self.metrics.gauge(
+                "loop_lag_spikes",
+                "Checks with a lag above the threshold",
+                lambda: monitor.num_spikes,
+            )
+            self.metrics.gauge(
+                "pending_tasks",
+                "Tasks of the community",
+                lambda: len(self._pending_tasks),
+            )
+        if self.settings.metrics_file:
+            self.register_task(
+                "write_metrics",
+                self.metrics.write_prometheus,
+                self.settings.metrics_file,
+                interval=self.settings.metrics_interval,
+                delay=self.settings.metrics_interval,
+            )
+
     # ----- Discovery start -----
+    def create_block_store(self, work_dir: str) -> BaseBlockStore:
+        """Create the block store of the type set in the settings. Migrates the existing LMDB stores."""
+        store_type = self.settings.block_store_type
+        if store_type == BlockStoreType.MEMORY:
+            return MemoryBlockStore(self.settings.memory_store_size)
+        if store_type == BlockStoreType.SEGMENT_LOG:
+            return SegmentLogBlockStore(
+                work_dir, segment_size=self.settings.segment_size
+            )
+        if store_type == BlockStoreType.LMDB_DIRECT:
+            block_store = LMDBDirectBlockStore(work_dir)
+            if block_store.needs_migration:
+                migrate_to_direct_layout(block_store)
+            return block_store
+        block_store = LMDBLockStore(work_dir)
+        if block_store.needs_migration:
+            migrate_dot_keys(block_store)
+        return block_store
+
     def start_discovery(
         self,
         target_peers: int = None,
@@ -247,6 +426,8 @@ class BamiCommunity(
         for dot in dots:
             block = self.get_block_by_dot(chain_id, dot)
             self.ordered_notifier.notify(chain_id, block)
+            if self.tracer:
+                self.tracer.record(chain_id, dot, BlockStage.DELIVERED)
 
     def subscribe_in_order_block(
         self, topic: Union[bytes, ChainTopic], callback: Callable[[BamiBlock], None]
@@ -317,6 +498,16 @@ class BamiCommunity(
 
     # ----- Community routines ------
 
+    def add_message_handler(self, msg_num: Any, callback: Callable) -> None:
+        if self.profiler:
+            callback = self.profiler.wrap(callback)
+        super().add_message_handler(msg_num, callback)
+
+    def on_packet(self, packet: Tuple[Any, bytes], warn_unknown: bool = True) -> None:
+        if self.recorder:
+            self.recorder.record_packet(*packet)
+        super().on_packet(packet, warn_unknown)
+
     async def unload(self):
         self.logger.debug("Unloading the Plexus Community.")
         self.shutting_down = True
@@ -329,6 +520,10 @@ class BamiCommunity(
 
         # Close the persistence layer
         self.persistence.close()
+        if self.recorder:
+            self.recorder.close()
+        if self.profiler:
+            self.profiler.close()
 
     @property
     def settings(self) -> BamiSettings:
@@ -560,20 +755,45 @@ class BamiCommunity(
         return decode_raw(witness_blob)
 
     # ------ Confirm and reject functions --------------
+    @staticmethod
+    def _reaction_tx(block: BamiBlock, extra_data: Dict = None) -> Tuple[bytes, Dict]:
+        chain_id = block.com_id if block.com_id != EMPTY_PK else block.public_key
+        dot = block.com_dot if block.com_id != EMPTY_PK else block.pers_dot
+        reaction_tx = {b"initiator": block.public_key, b"dot": dot}
+        if extra_data:
+            reaction_tx.update(extra_data)
+        return chain_id, reaction_tx
+
     def confirm(self, block: BamiBlock, extra_data: Dict = None) -> None:
         """Create confirm block linked to block. Link will be in the transaction with block dot.
            Add extra data to the transaction with a 'extra_data' dictionary.
         """
-        chain_id = block.com_id if block.com_id != EMPTY_PK else block.public_key
-        dot = block.com_dot if block.com_id != EMPTY_PK else block.pers_dot
-        confirm_tx = {b"initiator": block.public_key, b"dot": dot}
-        if extra_data:
-            confirm_tx.update(extra_data)
+        chain_id, confirm_tx = self._reaction_tx(block, extra_data)
         block = self.create_signed_block(
             block_type=CONFIRM_TYPE, transaction=encode_raw(confirm_tx), com_id=chain_id
         )
         self.share_in_community(block, chain_id)
 
+    def confirm_batch(
+        self, blocks: List[BamiBlock], extra_data: List[Dict] = None
+    ) -> None:
+        """Create one confirm block for many blocks of the same chain.
+        The transaction holds a confirm transaction for every block, in the order of the blocks.
+        """
+        confirm_txs = []
+        chain_id = None
+        for i, block in enumerate(blocks):
+            chain_id, confirm_tx = self._reaction_tx(
+                block, extra_data[i] if extra_data else None
+            )
+            confirm_txs.append(confirm_tx)
+        block = self.create_signed_block(
+            block_type=CONFIRM_BATCH_TYPE,
+            transaction=encode_raw({b"confirms": confirm_txs}),
+            com_id=chain_id,
+        )
+        self.share_in_community(block, chain_id)
+
     def verify_confirm_tx(self, claimer: bytes, confirm_tx: Dict) -> None:
         # 1. verify claim format
         if not confirm_tx.get(b"initiator") or not confirm_tx.get(b"dot"):
@@ -590,14 +810,28 @@ class BamiCommunity(
     def apply_confirm_tx(self, block: BamiBlock, confirm_tx: Dict) -> None:
         pass
 
+    def process_confirm_batch(self, block: BamiBlock) -> None:
+        batch_tx = decode_raw(block.transaction)
+        confirm_txs = batch_tx.get(b"confirms") if type(batch_tx) == dict else None
+        if not confirm_txs:
+            raise InvalidTransactionFormatException(
+                "Invalid claim batch", block.public_key, batch_tx
+            )
+        for confirm_tx in confirm_txs:
+            self.verify_confirm_tx(block.public_key, confirm_tx)
+        self.apply_confirm_batch_tx(block, confirm_txs)
+
+    def apply_confirm_batch_tx(
+        self, block: BamiBlock, confirm_txs: Iterable[Dict]
+    ) -> None:
+        """Apply all confirm transactions of the batch block. Override to apply them at once."""
+        for confirm_tx in confirm_txs:
+            self.apply_confirm_tx(block, confirm_tx)
+
     def reject(self, block: BamiBlock, extra_data: Dict = None) -> None:
         # change it to confirm
         # create claim block and share in the community
-        chain_id = block.com_id if block.com_id != EMPTY_PK else block.public_key
-        dot = block.com_dot if block.com_id != EMPTY_PK else block.pers_dot
-        reject_tx = {b"initiator": block.public_key, b"dot": dot}
-        if extra_data:
-            reject_tx.update(extra_data)
+        chain_id, reject_tx = self._reaction_tx(block, extra_data)
         block = self.create_signed_block(
             block_type=REJECT_TYPE, transaction=encode_raw(reject_tx), com_id=chain_id
         )
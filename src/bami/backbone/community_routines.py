@@ -1,14 +1,30 @@
 from abc import ABC, abstractmethod
-from typing import Callable, Type
+from typing import Callable, Optional, Type
 
 from bami.backbone.datastore.database import BaseDB
+from bami.backbone.loop_monitor import LoopMonitor
+from bami.backbone.metrics import MetricsRegistry
+from bami.backbone.profiling import HandlerProfiler
+from bami.backbone.recorder import PacketRecorder
 from bami.backbone.settings import BamiSettings
+from bami.backbone.tracing import BlockTracer
 from ipv8.keyvault.keys import Key
 from ipv8.messaging.payload import Payload
 from ipv8.peer import Peer
 
 
 class CommunityRoutines(ABC):
+    # Tracer of the block lifecycle, None if tracing is disabled
+    tracer: Optional[BlockTracer] = None
+    # Metrics of the node, None if metrics are disabled
+    metrics: Optional[MetricsRegistry] = None
+    # Recorder of the inbound packets, None if not recording
+    recorder: Optional[PacketRecorder] = None
+    # Profiler of the message handlers and the tasks, None if profiling is disabled
+    profiler: Optional[HandlerProfiler] = None
+    # Monitor of the event loop lag, None if monitoring is disabled
+    loop_monitor: Optional[LoopMonitor] = None
+
     @property
     def my_peer_key(self) -> Key:
         return self.my_peer.key
@@ -1,8 +1,18 @@
 from abc import ABC, abstractmethod
-from typing import Optional
+import bisect
+from collections import OrderedDict
+import struct
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 
 import lmdb
 
+from bami.backbone.datastore.cache import ENTRY_OVERHEAD
+from bami.backbone.utils import encode_raw, encode_seq_key, KEY_LEN, SEQ_NUM_LEN
+
+# Version of the dot keys layout: 1 - chain_id + msgpack(dot), 2 - chain_id | seq_num | short hash
+DOT_KEY_VERSION = 2
+DOT_KEY_VERSION_KEY = b"dot_key_version"
+
 
 class BaseBlockStore(ABC):
     """Store interface for block blobs"""
@@ -39,23 +49,112 @@ class BaseBlockStore(ABC):
     def get_tx_by_hash(self, block_hash: bytes) -> Optional[bytes]:
         pass
 
+    @abstractmethod
+    def get_dot_blocks_by_seq_range(
+        self, chain_id: bytes, start_seq: int, end_seq: int
+    ) -> Iterable[Tuple[bytes, bytes, bytes]]:
+        """Get (dot key, block hash, block blob) of all blocks of the chain with the sequence numbers
+        in [start_seq, end_seq], in the order of the dot keys"""
+        pass
+
+    def get_block_blobs_by_seq_range(
+        self, chain_id: bytes, start_seq: int, end_seq: int
+    ) -> Iterable[bytes]:
+        """Get blobs of all blocks of the chain with the sequence numbers in [start_seq, end_seq]"""
+        return [
+            blob
+            for _, _, blob in self.get_dot_blocks_by_seq_range(
+                chain_id, start_seq, end_seq
+            )
+        ]
+
     @abstractmethod
     def close(self) -> None:
         pass
 
+    def put_block(
+        self,
+        block_hash: bytes,
+        block_blob: bytes,
+        tx_blob: bytes,
+        extra: bytes,
+        dots: Iterable[bytes],
+    ) -> None:
+        """Store the block together with its transaction, extra and dots.
+        Stores can override this to write everything in one transaction.
+
+        Args:
+            block_hash: hash of the block
+            block_blob: packed block
+            tx_blob: transaction of the block
+            extra: extra information of the block
+            dots: dot keys of the block. The first one is the primary dot.
+        """
+        self.add_block(block_hash, block_blob)
+        self.add_tx(block_hash, tx_blob)
+        self.add_extra(block_hash, extra)
+        for dot in dots:
+            self.add_dot(dot, block_hash)
+
+    def put_blocks(
+        self, blocks: Iterable[Tuple[bytes, bytes, bytes, bytes, Iterable[bytes]]]
+    ) -> None:
+        """Store a batch of blocks. Each entry has the arguments of `put_block`."""
+        for block_entry in blocks:
+            self.put_block(*block_entry)
+
+    def get_block_by_dot(self, dot: bytes) -> Optional[bytes]:
+        block_hash = self.get_hash_by_dot(dot)
+        return self.get_block_by_hash(block_hash) if block_hash else None
+
+    def get_tx_by_dot(self, dot: bytes) -> Optional[bytes]:
+        block_hash = self.get_hash_by_dot(dot)
+        return self.get_tx_by_hash(block_hash) if block_hash else None
+
+    def get_extra_by_dot(self, dot: bytes) -> Optional[bytes]:
+        block_hash = self.get_hash_by_dot(dot)
+        return self.get_extra(block_hash) if block_hash else None
+
+    def has_block(self, block_hash: bytes) -> bool:
+        return self.get_block_by_hash(block_hash) is not None
+
 
 class LMDBLockStore(BaseBlockStore):
     """BlockStore implementation based on LMBD"""
 
     def __init__(self, block_dir: str) -> None:
         # Change the directory
-        self.env = lmdb.open(block_dir, subdir=True, max_dbs=5, map_async=True)
+        self.env = lmdb.open(block_dir, subdir=True, max_dbs=8, map_async=True)
         self.blocks = self.env.open_db(key=b"blocks")
         self.txs = self.env.open_db(key=b"txs")
         self.dots = self.env.open_db(key=b"dots")
         self.extra = self.env.open_db(key=b"extra")
+        self.meta = self.env.open_db(key=b"meta")
         # add sub dbs if required
 
+        if self.dot_key_version is None and not self.has_dots():
+            # Fresh store: use the latest layout
+            self.set_dot_key_version(DOT_KEY_VERSION)
+
+    @property
+    def dot_key_version(self) -> Optional[int]:
+        with self.env.begin() as txn:
+            val = txn.get(DOT_KEY_VERSION_KEY, db=self.meta)
+        return int(val) if val is not None else None
+
+    def set_dot_key_version(self, version: int) -> None:
+        with self.env.begin(write=True) as txn:
+            txn.put(DOT_KEY_VERSION_KEY, str(version).encode(), db=self.meta)
+
+    @property
+    def needs_migration(self) -> bool:
+        """True if the dot keys are stored in the legacy (msgpack) layout"""
+        return self.dot_key_version != DOT_KEY_VERSION
+
+    def has_dots(self) -> bool:
+        with self.env.begin() as txn:
+            return txn.stat(self.dots)["entries"] > 0
+
     def iterate_blocks(self):
         with self.env.begin() as txn:
             for k, v in txn.cursor(db=self.blocks):
@@ -88,6 +187,46 @@ class LMDBLockStore(BaseBlockStore):
             val = txn.get(dot, db=self.dots)
         return val
 
+    def put_block(
+        self,
+        block_hash: bytes,
+        block_blob: bytes,
+        tx_blob: bytes,
+        extra: bytes,
+        dots: Iterable[bytes],
+    ) -> None:
+        with self.env.begin(write=True) as txn:
+            txn.put(block_hash, block_blob, db=self.blocks)
+            txn.put(block_hash, tx_blob, db=self.txs)
+            txn.put(block_hash, extra, db=self.extra)
+            for dot in dots:
+                txn.put(dot, block_hash, db=self.dots)
+
+    def get_block_by_dot(self, dot: bytes) -> Optional[bytes]:
+        with self.env.begin() as txn:
+            block_hash = txn.get(dot, db=self.dots)
+            return txn.get(block_hash, db=self.blocks) if block_hash else None
+
+    def get_dot_blocks_by_seq_range(
+        self, chain_id: bytes, start_seq: int, end_seq: int
+    ) -> Iterable[Tuple[bytes, bytes, bytes]]:
+        """Single cursor scan over the dots of the chain. Relies on the order-preserving dot keys."""
+        seq_end = len(chain_id) + SEQ_NUM_LEN
+        blobs = []
+        with self.env.begin() as txn:
+            cursor = txn.cursor(db=self.dots)
+            if not cursor.set_range(encode_seq_key(chain_id, start_seq)):
+                return blobs
+            for dot_key, blk_hash in cursor:
+                if not dot_key.startswith(chain_id) or len(dot_key) <= seq_end:
+                    break
+                if int.from_bytes(dot_key[len(chain_id) : seq_end], "big") > end_seq:
+                    break
+                val = txn.get(blk_hash, db=self.blocks)
+                if val:
+                    blobs.append((dot_key, blk_hash, val))
+        return blobs
+
     def add_extra(self, block_hash: bytes, extra: bytes) -> None:
         with self.env.begin(write=True) as txn:
             txn.put(block_hash, extra, db=self.extra)
@@ -99,3 +238,349 @@ class LMDBLockStore(BaseBlockStore):
 
     def close(self) -> None:
         self.env.close()
+
+
+# Tags of the records in the direct layout
+REF_RECORD = b"\x00"
+BLOB_RECORD = b"\x01"
+
+_BLOB_LEN = struct.Struct(">I")
+
+
+def get_blob_spans(
+    block_blob: bytes, offset: int = 0
+) -> Tuple[Tuple[int, int], Tuple[int, int]]:
+    """Get the positions of the type and the transaction inside a packed block.
+    Both are the first, length-prefixed (varlenI) fields of the BlockPayload.
+
+    Args:
+        block_blob: buffer with the packed block
+        offset: position of the block in the buffer
+
+    Returns:
+        Tuple with (start, end) of the type and (start, end) of the transaction
+    """
+    type_start = offset + _BLOB_LEN.size
+    type_end = type_start + _BLOB_LEN.unpack_from(block_blob, offset)[0]
+    tx_start = type_end + _BLOB_LEN.size
+    tx_end = tx_start + _BLOB_LEN.unpack_from(block_blob, type_end)[0]
+    return (type_start, type_end), (tx_start, tx_end)
+
+
+def _blob_offset(record: bytes) -> int:
+    # BLOB_RECORD | hash length | hash | block blob
+    return 2 + record[1]
+
+
+class LMDBDirectBlockStore(BaseBlockStore):
+    """BlockStore based on LMDB with dots referencing the block blobs directly.
+
+    The primary dot of a block holds the blob, other dots of the block hold the key of the primary dot.
+    A read by dot is a single lookup for the primary dot. Transaction, type and extra are not stored separately:
+    they are sliced out of the blob.
+
+    Records of the dots db:
+     - BLOB_RECORD | hash length | hash | block blob
+     - REF_RECORD | primary dot key
+    The hashes db maps the block hash to the REF_RECORD of the primary dot.
+    Blocks without any dot yet are kept in the hashes db as BLOB_RECORD.
+    """
+
+    def __init__(self, block_dir: str) -> None:
+        self.env = lmdb.open(block_dir, subdir=True, max_dbs=8, map_async=True)
+        self.dots = self.env.open_db(key=b"direct_dots")
+        self.hashes = self.env.open_db(key=b"direct_hashes")
+
+    @property
+    def needs_migration(self) -> bool:
+        """True if the directory still holds blocks in the LMDBLockStore layout"""
+        with self.env.begin() as txn:
+            # Names of the sub dbs are keys in the main db
+            return txn.get(b"blocks") is not None
+
+    def _get_record(self, txn: lmdb.Transaction, key: bytes, db: Any) -> Optional[Any]:
+        record = txn.get(key, db=db)
+        if record is not None and record[:1] == REF_RECORD:
+            record = txn.get(record[1:], db=self.dots)
+        return record
+
+    def write_block(
+        self,
+        txn: lmdb.Transaction,
+        block_hash: bytes,
+        block_blob: bytes,
+        dots: Iterable[bytes],
+    ) -> None:
+        """Write the block and its dots within an open write transaction"""
+        record = BLOB_RECORD + bytes([len(block_hash)]) + block_hash + block_blob
+        txn.put(block_hash, record, db=self.hashes, overwrite=False)
+        for dot in dots:
+            self._write_dot(txn, dot, block_hash)
+
+    def _write_dot(self, txn: lmdb.Transaction, dot: bytes, block_hash: bytes) -> None:
+        ref = txn.get(block_hash, db=self.hashes)
+        if ref is None:
+            raise KeyError("Unknown block", block_hash)
+        if ref[:1] == BLOB_RECORD:
+            # The first dot of the block becomes the primary one
+            txn.put(dot, ref, db=self.dots)
+            txn.put(block_hash, REF_RECORD + dot, db=self.hashes)
+        elif ref[1:] != dot:
+            txn.put(dot, ref, db=self.dots)
+
+    def put_block(
+        self,
+        block_hash: bytes,
+        block_blob: bytes,
+        tx_blob: bytes,
+        extra: bytes,
+        dots: Iterable[bytes],
+    ) -> None:
+        with self.env.begin(write=True) as txn:
+            self.write_block(txn, block_hash, block_blob, dots)
+
+    def add_block(self, block_hash: bytes, block_blob: bytes) -> None:
+        with self.env.begin(write=True) as txn:
+            self.write_block(txn, block_hash, block_blob, ())
+
+    def add_tx(self, block_hash: bytes, tx_blob: bytes) -> None:
+        # Transaction is read from the block blob
+        pass
+
+    def add_extra(self, block_hash: bytes, extra: bytes) -> None:
+        # Type is read from the block blob
+        pass
+
+    def add_dot(self, dot: bytes, block_hash: bytes) -> None:
+        with self.env.begin(write=True) as txn:
+            self._write_dot(txn, dot, block_hash)
+
+    def has_block(self, block_hash: bytes) -> bool:
+        with self.env.begin() as txn:
+            return txn.get(block_hash, db=self.hashes) is not None
+
+    def get_block_by_hash(self, block_hash: bytes) -> Optional[bytes]:
+        with self.env.begin() as txn:
+            record = self._get_record(txn, block_hash, self.hashes)
+            return record[_blob_offset(record) :] if record else None
+
+    def get_block_by_dot(self, dot: bytes) -> Optional[bytes]:
+        with self.env.begin() as txn:
+            record = self._get_record(txn, dot, self.dots)
+            return record[_blob_offset(record) :] if record else None
+
+    def get_hash_by_dot(self, dot: bytes) -> Optional[bytes]:
+        with self.env.begin() as txn:
+            record = self._get_record(txn, dot, self.dots)
+            return record[2 : _blob_offset(record)] if record else None
+
+    def _get_tx(self, key: bytes, db: Any) -> Optional[bytes]:
+        with self.env.begin() as txn:
+            record = self._get_record(txn, key, db)
+            if not record:
+                return None
+            _, (tx_start, tx_end) = get_blob_spans(record, _blob_offset(record))
+            return record[tx_start:tx_end]
+
+    def _get_extra(self, key: bytes, db: Any) -> Optional[bytes]:
+        with self.env.begin() as txn:
+            record = self._get_record(txn, key, db)
+            if not record:
+                return None
+            (type_start, type_end), _ = get_blob_spans(record, _blob_offset(record))
+            return encode_raw({b"type": record[type_start:type_end]})
+
+    def get_tx_by_hash(self, block_hash: bytes) -> Optional[bytes]:
+        return self._get_tx(block_hash, self.hashes)
+
+    def get_tx_by_dot(self, dot: bytes) -> Optional[bytes]:
+        return self._get_tx(dot, self.dots)
+
+    def get_extra(self, block_hash: bytes) -> Optional[bytes]:
+        return self._get_extra(block_hash, self.hashes)
+
+    def get_extra_by_dot(self, dot: bytes) -> Optional[bytes]:
+        return self._get_extra(dot, self.dots)
+
+    def get_dot_blocks_by_seq_range(
+        self, chain_id: bytes, start_seq: int, end_seq: int
+    ) -> Iterable[Tuple[bytes, bytes, bytes]]:
+        seq_end = len(chain_id) + SEQ_NUM_LEN
+        blobs = []
+        with self.env.begin() as txn:
+            cursor = txn.cursor(db=self.dots)
+            if not cursor.set_range(encode_seq_key(chain_id, start_seq)):
+                return blobs
+            for dot_key, record in cursor:
+                if not dot_key.startswith(chain_id) or len(dot_key) <= seq_end:
+                    break
+                if int.from_bytes(dot_key[len(chain_id) : seq_end], "big") > end_seq:
+                    break
+                if record[:1] == REF_RECORD:
+                    record = txn.get(record[1:], db=self.dots)
+                offset = _blob_offset(record)
+                blobs.append((dot_key, record[2:offset], record[offset:]))
+        return blobs
+
+    def close(self) -> None:
+        self.env.close()
+
+
+class MemoryBlockStore(BaseBlockStore):
+    """BlockStore keeping everything in memory, for simulations and benchmarks.
+
+    Block hashes and chain ids are interned to integer ids. A dot key is kept as one integer (seq_num | short hash)
+    in the dict of its chain. Transaction and type are read from the block blob.
+    With a byte budget, the least recently used blocks are evicted together with their dots.
+    Eviction does not know which blocks the chains still reference: the budget is only for the stores
+    whose readers tolerate missing blocks, e.g. simulations that only serve the recent blocks.
+    """
+
+    def __init__(self, max_bytes: int = 0) -> None:
+        """
+        Args:
+            max_bytes: budget for the stored blocks in bytes. Zero for no limit, which the chains need
+             to find every block they reference.
+        """
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+
+        self._next_id = 0
+        self._block_ids: Dict[bytes, int] = dict()
+        self._hashes: Dict[int, bytes] = dict()
+        # Block id to blob, in the order of use
+        self._blobs: "OrderedDict[int, bytes]" = OrderedDict()
+        self._block_dots: Dict[int, List[Tuple[int, int]]] = dict()
+
+        self._chain_ids: Dict[bytes, int] = dict()
+        # Chain id to dict of dot to block id
+        self._dots: Dict[int, Dict[int, int]] = dict()
+        # Sorted dots of every chain for the range scans
+        self._sorted_dots: Dict[int, List[int]] = dict()
+
+    @staticmethod
+    def _split_dot(dot: bytes) -> Tuple[bytes, int]:
+        """Split the dot key into the chain id and the dot as one integer"""
+        chain_len = len(dot) - SEQ_NUM_LEN - KEY_LEN
+        if chain_len < 0:
+            raise ValueError("Not a dot key", dot)
+        return dot[:chain_len], int.from_bytes(dot[chain_len:], "big")
+
+    def _find_dot(self, dot: bytes) -> Optional[int]:
+        chain_id, dot_val = self._split_dot(dot)
+        chain_idx = self._chain_ids.get(chain_id)
+        if chain_idx is None:
+            return None
+        return self._dots[chain_idx].get(dot_val)
+
+    def _get_blob(self, block_id: Optional[int]) -> Optional[bytes]:
+        if block_id is None:
+            return None
+        blob = self._blobs.get(block_id)
+        if blob is not None and self.max_bytes:
+            self._blobs.move_to_end(block_id)
+        return blob
+
+    def _evict(self) -> None:
+        while self.current_bytes > self.max_bytes and len(self._blobs) > 1:
+            block_id, blob = self._blobs.popitem(last=False)
+            self.current_bytes -= len(blob) + ENTRY_OVERHEAD
+            for chain_idx, dot_val in self._block_dots.pop(block_id, ()):
+                del self._dots[chain_idx][dot_val]
+                sorted_dots = self._sorted_dots[chain_idx]
+                del sorted_dots[bisect.bisect_left(sorted_dots, dot_val)]
+            del self._block_ids[self._hashes.pop(block_id)]
+
+    def add_block(self, block_hash: bytes, block_blob: bytes) -> None:
+        if block_hash in self._block_ids:
+            return
+        block_id = self._next_id
+        self._next_id += 1
+        self._block_ids[block_hash] = block_id
+        self._hashes[block_id] = block_hash
+        self._blobs[block_id] = block_blob
+        self.current_bytes += len(block_blob) + ENTRY_OVERHEAD
+        if self.max_bytes:
+            self._evict()
+
+    def add_tx(self, block_hash: bytes, tx_blob: bytes) -> None:
+        # Transaction is read from the block blob
+        pass
+
+    def add_extra(self, block_hash: bytes, extra: bytes) -> None:
+        # Type is read from the block blob
+        pass
+
+    def add_dot(self, dot: bytes, block_hash: bytes) -> None:
+        block_id = self._block_ids.get(block_hash)
+        if block_id is None:
+            raise KeyError("Unknown block", block_hash)
+        chain_id, dot_val = self._split_dot(dot)
+        chain_idx = self._chain_ids.get(chain_id)
+        if chain_idx is None:
+            chain_idx = self._chain_ids[chain_id] = len(self._chain_ids)
+            self._dots[chain_idx] = dict()
+            self._sorted_dots[chain_idx] = []
+        dots = self._dots[chain_idx]
+        old_id = dots.get(dot_val)
+        if old_id == block_id:
+            return
+        if old_id is None:
+            # Dots mostly come in order: insertion is close to the end
+            bisect.insort(self._sorted_dots[chain_idx], dot_val)
+        else:
+            # The dot moves to the new block, eviction of the old one keeps it
+            self._block_dots[old_id].remove((chain_idx, dot_val))
+        dots[dot_val] = block_id
+        self._block_dots.setdefault(block_id, []).append((chain_idx, dot_val))
+
+    def has_block(self, block_hash: bytes) -> bool:
+        return self._block_ids.get(block_hash) is not None
+
+    def get_block_by_hash(self, block_hash: bytes) -> Optional[bytes]:
+        return self._get_blob(self._block_ids.get(block_hash))
+
+    def get_block_by_dot(self, dot: bytes) -> Optional[bytes]:
+        return self._get_blob(self._find_dot(dot))
+
+    def get_hash_by_dot(self, dot: bytes) -> Optional[bytes]:
+        block_id = self._find_dot(dot)
+        return self._hashes.get(block_id) if block_id is not None else None
+
+    def get_tx_by_hash(self, block_hash: bytes) -> Optional[bytes]:
+        blob = self.get_block_by_hash(block_hash)
+        if blob is None:
+            return None
+        _, (tx_start, tx_end) = get_blob_spans(blob)
+        return blob[tx_start:tx_end]
+
+    def get_extra(self, block_hash: bytes) -> Optional[bytes]:
+        blob = self.get_block_by_hash(block_hash)
+        if blob is None:
+            return None
+        (type_start, type_end), _ = get_blob_spans(blob)
+        return encode_raw({b"type": blob[type_start:type_end]})
+
+    def get_dot_blocks_by_seq_range(
+        self, chain_id: bytes, start_seq: int, end_seq: int
+    ) -> Iterable[Tuple[bytes, bytes, bytes]]:
+        chain_idx = self._chain_ids.get(chain_id)
+        if chain_idx is None:
+            return []
+        sorted_dots = self._sorted_dots[chain_idx]
+        shift = 8 * KEY_LEN
+        start = bisect.bisect_left(sorted_dots, start_seq << shift)
+        end = bisect.bisect_left(sorted_dots, (end_seq + 1) << shift)
+        dots = self._dots[chain_idx]
+        dot_len = SEQ_NUM_LEN + KEY_LEN
+        return [
+            (
+                chain_id + dot_val.to_bytes(dot_len, "big"),
+                self._hashes[dots[dot_val]],
+                self._get_blob(dots[dot_val]),
+            )
+            for dot_val in sorted_dots[start:end]
+        ]
+
+    def close(self) -> None:
+        pass
@@ -0,0 +1,186 @@
+from collections.abc import MutableMapping
+from typing import Any, Callable, Dict, Hashable, Iterable, Iterator, Optional
+
+import cachetools
+
+# Rough per-entry overhead of a cached bytes object and its key in the LRU
+ENTRY_OVERHEAD = 100
+
+
+def _entry_size(value: bytes) -> int:
+    return len(value) + ENTRY_OVERHEAD
+
+
+class BlobCache(object):
+    """Byte-budgeted LRU cache of hot block blobs, keyed by the block hashes.
+
+    Every blob is cached once, the dot keys of the block map to its hash. Cached hashes answer `has_block`
+    without the store. All entries share the same budget.
+    Blobs are immutable once written, so the cache never has to be invalidated.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        """
+        Args:
+            max_bytes: budget of the cache in bytes. Zero disables the cache.
+        """
+        self.max_bytes = max_bytes
+        self._cache = (
+            cachetools.LRUCache(max_bytes, getsizeof=_entry_size)
+            if max_bytes > 0
+            else None
+        )
+
+        self.blob_hits = 0
+        self.blob_misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._cache is not None
+
+    def _put(self, key: bytes, value: bytes) -> None:
+        if self._cache is not None and _entry_size(value) <= self.max_bytes:
+            self._cache[key] = value
+
+    def get_blob(self, dot_id: bytes) -> Optional[bytes]:
+        val = None
+        if self._cache is not None:
+            block_hash = self._cache.get(b"d" + dot_id)
+            if block_hash is not None:
+                # Empty for a block too large to cache
+                val = self._cache.get(b"h" + block_hash) or None
+        if val is None:
+            self.blob_misses += 1
+        else:
+            self.blob_hits += 1
+        return val
+
+    def put_blob(
+        self, block_hash: bytes, block_blob: bytes, dot_ids: Iterable[bytes]
+    ) -> None:
+        """Cache the blob under the block hash, and map the dot keys of the block to the hash"""
+        if self._cache is None:
+            return
+        if _entry_size(block_blob) > self.max_bytes:
+            # The hash is still known
+            self._put(b"h" + block_hash, b"")
+            return
+        self._put(b"h" + block_hash, block_blob)
+        for dot_id in dot_ids:
+            self._put(b"d" + dot_id, block_hash)
+
+    def has_hash(self, block_hash: bytes) -> bool:
+        return self._cache is not None and b"h" + block_hash in self._cache
+
+    @property
+    def current_bytes(self) -> int:
+        return self._cache.currsize if self._cache is not None else 0
+
+    def stats(self) -> Dict[str, float]:
+        """Hit/miss counters and hit rate of the cache"""
+        blob_total = self.blob_hits + self.blob_misses
+        return {
+            "max_bytes": self.max_bytes,
+            "current_bytes": self.current_bytes,
+            "entries": len(self._cache) if self._cache is not None else 0,
+            "blob_hits": self.blob_hits,
+            "blob_misses": self.blob_misses,
+            "blob_hit_rate": self.blob_hits / blob_total if blob_total else 0.0,
+        }
+
+
+class _EvictingLRUCache(cachetools.LRUCache):
+    """LRU cache that reports the evicted keys"""
+
+    def __init__(self, maxsize: int, on_evict: Callable[[Any], None]) -> None:
+        super().__init__(maxsize)
+        self.on_evict = on_evict
+
+    def popitem(self) -> Any:
+        key, value = super().popitem()
+        self.on_evict(key)
+        return key, value
+
+
+class TermCacheBudget(object):
+    """Terminal caches of all chains in one LRU cache with a shared number of entries.
+
+    The chains with the most recent lookups keep the most entries, and the least recently used entry
+    of any chain is evicted first. The aggregate footprint stays bounded however many chains are tracked.
+    """
+
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self._cache = _EvictingLRUCache(max_entries, self._evicted)
+        # Chain slot -> keys of its entries in the cache
+        self.chain_keys = dict()
+        self._next_slot = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _evicted(self, key: Any) -> None:
+        self.evictions += 1
+        self._remove_key(*key)
+
+    def _remove_key(self, slot: int, key: Hashable) -> None:
+        keys = self.chain_keys[slot]
+        keys.discard(key)
+        if not keys:
+            del self.chain_keys[slot]
+
+    def chain_cache(self) -> "ChainTermCache":
+        """Terminal cache of a new chain, backed by the shared budget"""
+        self._next_slot += 1
+        return ChainTermCache(self, self._next_slot)
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "max_entries": self.max_entries,
+            "entries": len(self._cache),
+            "chains": len(self.chain_keys),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+class ChainTermCache(MutableMapping):
+    """View of one chain on the shared terminal cache"""
+
+    # No attribute dict: the memory report of the chain counts its own entries only
+    __slots__ = ("budget", "slot")
+
+    def __init__(self, budget: TermCacheBudget, slot: int) -> None:
+        self.budget = budget
+        self.slot = slot
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        val = self.budget._cache.get((self.slot, key))
+        if val is None:
+            self.budget.misses += 1
+            return default
+        self.budget.hits += 1
+        return val
+
+    def __getitem__(self, key: Hashable) -> Any:
+        # Peek without refreshing the entry: reports read the cache too. Lookups go through `get`
+        return cachetools.Cache.__getitem__(self.budget._cache, (self.slot, key))
+
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        self.budget._cache[(self.slot, key)] = value
+        # Added after the insertion, the insertion may evict an entry of this chain
+        self.budget.chain_keys.setdefault(self.slot, set()).add(key)
+
+    def __delitem__(self, key: Hashable) -> None:
+        del self.budget._cache[(self.slot, key)]
+        self.budget._remove_key(self.slot, key)
+
+    def __len__(self) -> int:
+        return len(self.budget.chain_keys.get(self.slot, ()))
+
+    def __iter__(self) -> Iterator[Hashable]:
+        return iter(list(self.budget.chain_keys.get(self.slot, ())))
@@ -1,9 +1,11 @@
 from abc import ABC, abstractmethod
+from collections.abc import MutableMapping
 import threading
-from typing import Iterable, List, Optional, Set, Tuple
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 
 import cachetools
 
+from bami.backbone.datastore.cache import TermCacheBudget
 from bami.backbone.datastore.frontiers import Frontier, FrontierDiff
 from bami.backbone.utils import (
     Dot,
@@ -11,6 +13,7 @@ from bami.backbone.utils import (
     GENESIS_DOT,
     GENESIS_HASH,
     Links,
+    memory_usage,
     ranges,
     Ranges,
     shorten,
@@ -67,6 +70,36 @@ class BaseChain(ABC):
     def get_all_short_hash_by_seq_num(self, seq_num: int) -> Optional[Set[ShortKey]]:
         pass
 
+    def watch_dot(self, dot: Dot) -> None:
+        """Index the blocks building on the dot to answer `is_reachable` in O(1)"""
+        pass
+
+    def unwatch_dot(self, dot: Dot) -> None:
+        pass
+
+    def memory_report(self) -> Dict[str, Dict[str, int]]:
+        """Entries and estimated bytes of the in-memory structures of the chain"""
+        return {}
+
+    def is_reachable(self, target_dot: Dot, block_dot: Dot) -> bool:
+        """Check if the block builds on the target dot, i.e. target is reachable with the back links.
+        Default implementation walks the back links down to the sequence number of the target.
+        """
+        current = {block_dot}
+        visited = set()
+        while current:
+            next_dots = set()
+            for dot in current:
+                prev_links = self.get_prev_links(dot)
+                if not prev_links:
+                    continue
+                if target_dot in prev_links:
+                    return True
+                next_dots.update(d for d in prev_links if d[0] > target_dot[0])
+            visited.update(current)
+            current = next_dots - visited
+        return False
+
 
 class BaseChainFactory(ABC):
     @abstractmethod
@@ -75,11 +108,18 @@ class BaseChainFactory(ABC):
 
 
 class Chain(BaseChain):
-    def __init__(self, cache_num=10_000, max_extra_dots=5):
+    def __init__(
+        self,
+        cache_num=10_000,
+        max_extra_dots=5,
+        term_cache: Optional[MutableMapping] = None,
+    ):
         """DAG-Chain of one community based on in-memory dicts.
 
         Args:
             cache_num: to store and support terminal calculation. Default= 100`000
+            term_cache: cache shared with other chains, e.g. from a `TermCacheBudget`.
+             An own cache of cache_num entries if None.
         """
         # Internal chain store of short hashes
         self.versions = dict()
@@ -103,7 +143,16 @@ class Chain(BaseChain):
         self.max_extra_dots = max_extra_dots
 
         # Cache to speed up bfs on links
-        self.term_cache = cachetools.LRUCache(cache_num)
+        self.term_cache = (
+            term_cache if term_cache is not None else cachetools.LRUCache(cache_num)
+        )
+
+        # Reachability index: every watched dot gets a bit.
+        # Block dot -> bit mask of the watched dots the block builds on
+        self.reach_masks = dict()
+        self.watched_bits = dict()
+        self.free_bits = []
+        self.next_bit = 0
 
         self.lock = threading.Lock()
 
@@ -296,6 +345,71 @@ class Chain(BaseChain):
     def _update_back_pointers(self, block_dot: Dot, block_links: Links):
         self.back_pointers[block_dot] = block_links
 
+    def _own_mask(self, dot: Dot) -> int:
+        """Mask of the watched dots reachable from the blocks building on the dot"""
+        return self.reach_masks.get(dot, 0) | self.watched_bits.get(dot, 0)
+
+    def _propagate_mask(self, dot: Dot, mask: int) -> None:
+        """Add the mask to all blocks building on the dot"""
+        current = self.forward_pointers.get(dot, ())
+        while current:
+            next_dots = set()
+            for next_dot in current:
+                old_mask = self.reach_masks.get(next_dot, 0)
+                if old_mask | mask != old_mask:
+                    self.reach_masks[next_dot] = old_mask | mask
+                    next_dots.update(self.forward_pointers.get(next_dot, ()))
+            current = next_dots
+
+    def _update_reachability(self, block_dot: Dot, block_links: Links) -> None:
+        mask = 0
+        for dot in block_links:
+            mask |= self._own_mask(dot)
+        if mask:
+            self.reach_masks[block_dot] = self.reach_masks.get(block_dot, 0) | mask
+        own_mask = self._own_mask(block_dot)
+        if own_mask and block_dot in self.forward_pointers:
+            # Block filled a hole: blocks building on it are known already
+            self._propagate_mask(block_dot, own_mask)
+
+    def watch_dot(self, dot: Dot) -> None:
+        with self.lock:
+            if dot in self.watched_bits:
+                return
+            if self.free_bits:
+                bit = self.free_bits.pop()
+            else:
+                bit = self.next_bit
+                self.next_bit += 1
+            self.watched_bits[dot] = 1 << bit
+            self._propagate_mask(dot, 1 << bit)
+
+    def unwatch_dot(self, dot: Dot) -> None:
+        with self.lock:
+            bit_mask = self.watched_bits.pop(dot, None)
+            if bit_mask is None:
+                return
+            # Clear the bit so that it can be reused
+            current = self.forward_pointers.get(dot, ())
+            while current:
+                next_dots = set()
+                for next_dot in current:
+                    old_mask = self.reach_masks.get(next_dot, 0)
+                    if old_mask & bit_mask:
+                        if old_mask == bit_mask:
+                            del self.reach_masks[next_dot]
+                        else:
+                            self.reach_masks[next_dot] = old_mask ^ bit_mask
+                        next_dots.update(self.forward_pointers.get(next_dot, ()))
+                current = next_dots
+            self.free_bits.append(bit_mask.bit_length() - 1)
+
+    def is_reachable(self, target_dot: Dot, block_dot: Dot) -> bool:
+        bit_mask = self.watched_bits.get(target_dot)
+        if bit_mask is None:
+            return super().is_reachable(target_dot, block_dot)
+        return bool(self.reach_masks.get(block_dot, 0) & bit_mask)
+
     def _update_versions(self, block_seq_num: int, block_hash: ShortKey) -> None:
         if block_seq_num not in self.versions:
             self.versions[block_seq_num] = set()
@@ -314,6 +428,8 @@ class Chain(BaseChain):
             self._update_back_pointers(block_dot, block_links)
             # 2. Update forward pointers
             self._update_forward_pointers(block_links, block_dot)
+            # 2.1 Update reachability of the watched dots
+            self._update_reachability(block_dot, block_links)
             # 3. Update holes
             self._update_holes(block_seq_num)
             # 4. Update inconsistencies
@@ -338,6 +454,36 @@ class Chain(BaseChain):
         else:
             return []
 
+    def memory_report(self) -> Dict[str, Dict[str, int]]:
+        """Entries and estimated bytes of the in-memory structures of the chain.
+        Objects held by two structures, like the short hashes, are counted in both."""
+        with self.lock:
+            return {
+                "versions": memory_usage(
+                    sum(len(hashes) for hashes in self.versions.values()),
+                    self.versions,
+                ),
+                "forward_pointers": memory_usage(
+                    len(self.forward_pointers), self.forward_pointers
+                ),
+                "back_pointers": memory_usage(
+                    len(self.back_pointers), self.back_pointers
+                ),
+                "term_cache": memory_usage(len(self.term_cache), self.term_cache),
+                "holes": memory_usage(len(self.holes), self.holes),
+                "inconsistencies": memory_usage(
+                    len(self.inconsistencies) + len(self.inconsistent_blocks),
+                    self.inconsistencies,
+                    self.inconsistent_blocks,
+                ),
+                "reach_masks": memory_usage(
+                    len(self.reach_masks),
+                    self.reach_masks,
+                    self.watched_bits,
+                    self.free_bits,
+                ),
+            }
+
     @property
     def frontier(self) -> Frontier:
         with self.lock:
@@ -405,8 +551,20 @@ class Chain(BaseChain):
 
 
 class ChainFactory(BaseChainFactory):
+    def __init__(self, term_cache_size: int = 0) -> None:
+        """
+        Args:
+            term_cache_size: entries of the terminal cache shared by all chains.
+             0 for an own cache per chain.
+        """
+        self.term_caches = (
+            TermCacheBudget(term_cache_size) if term_cache_size > 0 else None
+        )
+
     def create_chain(self, **kwargs) -> BaseChain:
         """ Args:
             cache_num: specify the cache number used in the chain
         """
+        if self.term_caches and "term_cache" not in kwargs:
+            kwargs["term_cache"] = self.term_caches.chain_cache()
         return Chain(**kwargs)
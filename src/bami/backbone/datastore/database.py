@@ -4,26 +4,67 @@ This file contains everything related to persistence for TrustChain.
 from abc import ABC, abstractmethod
 from collections import defaultdict
 from enum import Enum
-from typing import Dict, Iterable, Optional, Set, Tuple
+from time import perf_counter
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TYPE_CHECKING,
+)
 
 from bami.backbone.datastore.block_store import BaseBlockStore
+from bami.backbone.datastore.cache import BlobCache
 from bami.backbone.datastore.chain_store import (
     BaseChain,
     BaseChainFactory,
     Frontier,
     FrontierDiff,
 )
+from bami.backbone.metrics import MetricsRegistry
+from bami.backbone.tracing import BlockStage, BlockTracer
 from bami.backbone.utils import (
     Dot,
     EMPTY_PK,
+    encode_dot_key,
     encode_raw,
-    expand_ranges,
     GENESIS_LINK,
     Links,
+    memory_usage,
     Notifier,
+    Ranges,
     ShortKey,
 )
 
+if TYPE_CHECKING:
+    from bami.backbone.block import BamiBlock
+
+
+def get_block_chain_ids(block: "BamiBlock") -> Tuple[bytes, bytes]:
+    """Get ids of the personal and the community chain of the block"""
+    pers = block.public_key
+    com = block.com_id
+
+    if pers == com:
+        pers = block.com_prefix + pers
+        com = block.com_prefix + com
+    else:
+        com = block.com_prefix + com
+    return pers, com
+
+
+def get_block_dot_keys(block: "BamiBlock") -> List[bytes]:
+    """Get the dot keys of the block in all its chains. The community dot comes first."""
+    pers, com = get_block_chain_ids(block)
+    dots = [encode_dot_key(pers, block.pers_dot)]
+    if com != EMPTY_PK and com != pers:
+        dots.insert(0, encode_dot_key(com, block.com_dot))
+    return dots
+
 
 class BaseDB(ABC, Notifier):
     @abstractmethod
@@ -31,7 +72,7 @@ class BaseDB(ABC, Notifier):
         pass
 
     @abstractmethod
-    def add_block(self, block_blob: bytes, block: "PlexusBlock") -> None:
+    def add_block(self, block_blob: bytes, block: "BamiBlock") -> None:
         pass
 
     @abstractmethod
@@ -113,10 +154,28 @@ class ChainTopic(Enum):
 
 
 class DBManager(BaseDB):
-    def __init__(self, chain_factory: BaseChainFactory, block_store: BaseBlockStore):
+    # Missing ranges at least this long are fetched with one block store scan
+    range_scan_threshold = 16
+
+    def __init__(
+        self,
+        chain_factory: BaseChainFactory,
+        block_store: BaseBlockStore,
+        cache_size: int = 0,
+    ):
+        """
+        Args:
+            chain_factory: factory to create chains
+            block_store: persistent store for block blobs
+            cache_size: byte budget of the hot blob cache in front of the block store. 0 disables it.
+        """
         super().__init__()
         self._chain_factory = chain_factory
         self._block_store = block_store
+        self.blob_cache = BlobCache(cache_size)
+        # Tracer of the block lifecycle and metrics, set by the community if enabled
+        self.tracer: Optional[BlockTracer] = None
+        self.metrics: Optional[MetricsRegistry] = None
 
         self.chains = dict()
         self.last_reconcile_seq_num = defaultdict(lambda: defaultdict(int))
@@ -144,15 +203,40 @@ class DBManager(BaseDB):
         return self.last_frontier[chain_id][peer_id]
 
     def _process_missing_seq_num(
-        self, chain: BaseChain, chain_id: bytes, missing_ranges: Set[int]
+        self, chain: BaseChain, chain_id: bytes, missing_ranges: Ranges
     ) -> Iterable[bytes]:
-        for b_i in missing_ranges:
-            # Return all blocks with a sequence number
-            for dot in chain.get_dots_by_seq_num(b_i):
-                val = self.get_block_blob_by_dot(chain_id, dot)
-                if not val:
-                    raise Exception("No block", chain_id, dot)
-                yield val
+        for start_seq, end_seq in missing_ranges:
+            scan = end_seq - start_seq + 1 >= self.range_scan_threshold
+            # Blobs of the range read from the block store with one scan
+            scanned = None
+            for b_i in range(start_seq, end_seq + 1):
+                # Return all blocks with a sequence number
+                for dot in chain.get_dots_by_seq_num(b_i):
+                    if not scan:
+                        val = self.get_block_blob_by_dot(chain_id, dot)
+                    else:
+                        # Large range: cached blobs first, the rest with one scan from the first miss
+                        dot_id = encode_dot_key(chain_id, dot)
+                        val = self.blob_cache.get_blob(dot_id)
+                        if val is None:
+                            if scanned is None:
+                                scanned = self._scan_block_blobs(chain_id, b_i, end_seq)
+                            val = scanned.get(dot_id)
+                    if not val:
+                        raise Exception("No block", chain_id, dot)
+                    yield val
+
+    def _scan_block_blobs(
+        self, chain_id: bytes, start_seq: int, end_seq: int
+    ) -> Dict[bytes, bytes]:
+        """Blobs of the chain in the range by dot key. The scanned blobs are cached."""
+        blobs = dict()
+        for dot_id, block_hash, blob in self.block_store.get_dot_blocks_by_seq_range(
+            chain_id, start_seq, end_seq
+        ):
+            blobs[dot_id] = blob
+            self.blob_cache.put_blob(block_hash, blob, (dot_id,))
+        return blobs
 
     def _find_first_conflicting_point(
         self, conf_dict: Dict, chain: BaseChain
@@ -222,9 +306,7 @@ class DBManager(BaseDB):
         if chain:
             # Processing missing holes
             blks = set(
-                self._process_missing_seq_num(
-                    chain, chain_id, expand_ranges(frontier_diff.missing)
-                )
+                self._process_missing_seq_num(chain, chain_id, frontier_diff.missing)
             )
             blks.update(
                 set(
@@ -239,6 +321,40 @@ class DBManager(BaseDB):
     def close(self) -> None:
         self.block_store.close()
 
+    def memory_report(self) -> Dict[str, Any]:
+        """Entries and estimated bytes of the in-memory structures.
+
+        Returns:
+            chains: report of every chain by chain id
+            chain_totals: sums of the chain reports per structure
+            and the reconcile points, the last frontiers of the peers and the blob cache
+        """
+        chains = {
+            chain_id: chain.memory_report() for chain_id, chain in self.chains.items()
+        }
+        totals = defaultdict(lambda: {"entries": 0, "bytes": 0})
+        for report in chains.values():
+            for structure, usage in report.items():
+                totals[structure]["entries"] += usage["entries"]
+                totals[structure]["bytes"] += usage["bytes"]
+        cache_stats = self.blob_cache.stats()
+        return {
+            "chains": chains,
+            "chain_totals": dict(totals),
+            "last_reconcile_seq_num": memory_usage(
+                sum(len(points) for points in self.last_reconcile_seq_num.values()),
+                self.last_reconcile_seq_num,
+            ),
+            "last_frontier": memory_usage(
+                sum(len(frontiers) for frontiers in self.last_frontier.values()),
+                self.last_frontier,
+            ),
+            "blob_cache": {
+                "entries": cache_stats["entries"],
+                "bytes": cache_stats["current_bytes"],
+            },
+        }
+
     @property
     def chain_factory(self) -> BaseChainFactory:
         return self._chain_factory
@@ -251,62 +367,101 @@ class DBManager(BaseDB):
         return self.chains.get(chain_id)
 
     def get_block_blob_by_dot(self, chain_id: bytes, block_dot: Dot) -> Optional[bytes]:
-        dot_id = chain_id + encode_raw(block_dot)
-        blk_hash = self.block_store.get_hash_by_dot(dot_id)
-        if blk_hash:
-            return self.block_store.get_block_by_hash(blk_hash)
-        else:
-            return None
+        dot_id = encode_dot_key(chain_id, block_dot)
+        blk_blob = self.blob_cache.get_blob(dot_id)
+        if blk_blob is None:
+            if not self.blob_cache.enabled:
+                return self.block_store.get_block_by_dot(dot_id)
+            block_hash = self.block_store.get_hash_by_dot(dot_id)
+            blk_blob = (
+                self.block_store.get_block_by_hash(block_hash) if block_hash else None
+            )
+            if blk_blob:
+                self.blob_cache.put_blob(block_hash, blk_blob, (dot_id,))
+        return blk_blob
 
     def get_tx_blob_by_dot(self, chain_id: bytes, block_dot: Dot) -> Optional[bytes]:
-        dot_id = chain_id + encode_raw(block_dot)
-        hash_val = self.block_store.get_hash_by_dot(dot_id)
-        if hash_val:
-            return self.block_store.get_tx_by_hash(hash_val)
-        else:
-            return None
+        return self.block_store.get_tx_by_dot(encode_dot_key(chain_id, block_dot))
 
     def get_extra_by_dot(self, chain_id: bytes, block_dot: Dot) -> Optional[bytes]:
-        dot_id = chain_id + encode_raw(block_dot)
-        hash_val = self.block_store.get_hash_by_dot(dot_id)
-        if hash_val:
-            return self.block_store.get_extra(hash_val)
-        else:
-            return None
+        return self.block_store.get_extra_by_dot(encode_dot_key(chain_id, block_dot))
 
     def has_block(self, block_hash: bytes) -> bool:
-        return self.block_store.get_block_by_hash(block_hash) is not None
+        return self.blob_cache.has_hash(block_hash) or self.block_store.has_block(
+            block_hash
+        )
 
-    def add_block(self, block_blob: bytes, block: "PlexusBlock") -> None:
+    def cache_stats(self) -> Dict[str, float]:
+        """Hit rates and memory usage of the blob cache"""
+        return self.blob_cache.stats()
+
+    def add_block(self, block_blob: bytes, block: "BamiBlock") -> None:
+        metrics = self.metrics
+        if metrics:
+            start = perf_counter()
 
         block_hash = block.hash
-        block_tx = block.transaction
 
-        # 1. Add block blob and transaction blob to the block storage
-        self.block_store.add_block(block_hash, block_blob)
-        self.block_store.add_tx(block_hash, block_tx)
-        self.block_store.add_extra(block_hash, encode_raw({b"type": block.type}))
+        # 1. Add block blob, transaction blob and the dots to the block storage
+        dot_ids = get_block_dot_keys(block)
+        self.block_store.put_block(
+            block_hash,
+            block_blob,
+            block.transaction,
+            encode_raw({b"type": block.type}),
+            dot_ids,
+        )
+        # Recent blocks are the hottest: they are gossiped to peers and delivered in order
+        self.blob_cache.put_blob(block_hash, block_blob, dot_ids)
+        if self.tracer:
+            self.tracer.record(
+                get_block_chain_ids(block)[1], block.com_dot, BlockStage.PERSISTED
+            )
 
+        self._add_block_to_chains(block)
+        if metrics:
+            metrics.counter("blocks_added_total", "Blocks added to the store").inc()
+            metrics.histogram(
+                "add_block_seconds",
+                "Time to store a block, add it to the chains and notify",
+            ).observe(perf_counter() - start)
+
+    # Highest sequence number of a dot key
+    max_seq_num = (1 << 64) - 1
+
+    def restore_chain(
+        self, chain_id: bytes, unpack: Callable[[bytes], Any], start_seq: int = 1
+    ) -> int:
+        """Add blocks of the chain kept in the block store to the in-memory chains, e.g. after a restart.
+        Subscribers are notified as for the new blocks. The block store is not written.
+
+        Args:
+            chain_id: id of the chain in the block store
+            unpack: function to unpack block blob to the block
+            start_seq: first sequence number to restore
+        Returns:
+            Number of restored blocks
+        """
+        num_blocks = 0
+        for blob in self.block_store.get_block_blobs_by_seq_range(
+            chain_id, start_seq, self.max_seq_num
+        ):
+            self._add_block_to_chains(unpack(blob))
+            num_blocks += 1
+        return num_blocks
+
+    def _add_block_to_chains(self, block: "BamiBlock") -> None:
+        block_hash = block.hash
         # 2. There are two chains: personal and community chain
-        pers = block.public_key
-        com = block.com_id
-
-        if pers == com:
-            pers = block.com_prefix + pers
-            com = block.com_prefix + com
-        else:
-            com = block.com_prefix + com
+        pers, com = get_block_chain_ids(block)
 
         # 2.1: Process the block wrt personal chain
         if pers not in self.chains:
             self.chains[pers] = self.chain_factory.create_chain()
 
-        pers_block_dot = Dot((block.sequence_number, block.short_hash))
         pers_dots_list = self.chains[pers].add_block(
             block.previous, block.sequence_number, block_hash
         )
-        full_dot_id = pers + encode_raw(pers_block_dot)
-        self.block_store.add_dot(full_dot_id, block_hash)
         # TODO: add more chain topic
 
         # Notify subs of the personal chain
@@ -318,17 +473,18 @@ class DBManager(BaseDB):
 
         if com != EMPTY_PK:
             if com == pers:
+                if self.tracer:
+                    self.tracer.record_many(com, pers_dots_list, BlockStage.CONSISTENT)
                 # Chain was processed already, notify rest
                 self.notify(ChainTopic.GROUP, chain_id=com, dots=pers_dots_list)
             else:
                 if com not in self.chains:
                     self.chains[com] = self.chain_factory.create_chain()
-                com_block_dot = Dot((block.com_seq_num, block.short_hash))
                 com_dots_list = self.chains[com].add_block(
                     block.links, block.com_seq_num, block_hash
                 )
-                full_dot_id = com + encode_raw(com_block_dot)
-                self.block_store.add_dot(full_dot_id, block_hash)
+                if self.tracer:
+                    self.tracer.record_many(com, com_dots_list, BlockStage.CONSISTENT)
 
                 self.notify(ChainTopic.ALL, chain_id=com, dots=com_dots_list)
                 self.notify(ChainTopic.GROUP, chain_id=com, dots=com_dots_list)
@@ -0,0 +1,99 @@
+"""
+Migrations of the block store between on-disk layouts.
+
+Usage: python -m bami.backbone.datastore.migrations <block_dir> [--direct]
+"""
+import sys
+from typing import Any
+
+from ipv8.messaging.serialization import default_serializer
+
+from bami.backbone.block import BamiBlock
+from bami.backbone.datastore.block_store import (
+    DOT_KEY_VERSION,
+    DOT_KEY_VERSION_KEY,
+    LMDBDirectBlockStore,
+    LMDBLockStore,
+)
+from bami.backbone.datastore.database import get_block_dot_keys
+
+# Sub dbs of the LMDBLockStore layout
+LEGACY_DBS = (b"blocks", b"txs", b"dots", b"extra")
+
+
+def migrate_dot_keys(
+    block_store: LMDBLockStore, serializer: Any = default_serializer
+) -> int:
+    """Rebuild the dots db with order-preserving keys (chain_id | seq_num | short hash).
+
+    Keys are re-derived from the stored block blobs, so the legacy msgpack keys never have to be parsed.
+    The migration runs in one write transaction: it is either fully applied or not at all.
+
+    Args:
+        block_store: LMDB store with the legacy dot keys
+        serializer: serializer used to unpack the block blobs
+
+    Returns:
+        Number of dot keys written
+    """
+    num_dots = 0
+    with block_store.env.begin(write=True) as txn:
+        txn.drop(block_store.dots, delete=False)
+        for block_hash, block_blob in txn.cursor(db=block_store.blocks):
+            block = BamiBlock.unpack(block_blob, serializer)
+            for dot_key in get_block_dot_keys(block):
+                txn.put(dot_key, block_hash, db=block_store.dots)
+                num_dots += 1
+        txn.put(DOT_KEY_VERSION_KEY, str(DOT_KEY_VERSION).encode(), db=block_store.meta)
+    return num_dots
+
+
+def migrate_to_direct_layout(
+    block_store: LMDBDirectBlockStore, serializer: Any = default_serializer
+) -> int:
+    """Move the blocks of the LMDBLockStore layout in the same directory to the direct layout.
+
+    Dot keys are re-derived from the block blobs, so both versions of the legacy dot keys are supported.
+    The legacy sub dbs are dropped in the same write transaction.
+
+    Args:
+        block_store: direct store opened on the directory of the LMDBLockStore
+        serializer: serializer used to unpack the block blobs
+
+    Returns:
+        Number of migrated blocks
+    """
+    num_blocks = 0
+    env = block_store.env
+    with env.begin(write=True) as txn:
+        legacy_dbs = [env.open_db(key=name, txn=txn) for name in LEGACY_DBS]
+        for block_hash, block_blob in txn.cursor(db=legacy_dbs[0]):
+            block = BamiBlock.unpack(block_blob, serializer)
+            block_store.write_block(
+                txn, block_hash, block_blob, get_block_dot_keys(block)
+            )
+            num_blocks += 1
+        for db in legacy_dbs:
+            txn.drop(db, delete=True)
+    return num_blocks
+
+
+def main(block_dir: str, direct: bool = False) -> None:
+    if direct:
+        block_store = LMDBDirectBlockStore(block_dir)
+        migrate = migrate_to_direct_layout
+    else:
+        block_store = LMDBLockStore(block_dir)
+        migrate = migrate_dot_keys
+    try:
+        if not block_store.needs_migration:
+            print("Block store is up to date")
+            return
+        num_migrated = migrate(block_store)
+        print("Migrated {num} entries".format(num=num_migrated))
+    finally:
+        block_store.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1], direct="--direct" in sys.argv[2:])
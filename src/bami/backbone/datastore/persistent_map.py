@@ -0,0 +1,141 @@
+"""
+Immutable map with cheap updates: a hash array mapped trie with path copying.
+
+Setting a key returns a new map that shares all nodes with the old one, except the O(log n) nodes
+on the path to the key. Snapshots of a large map that changes a few keys at a time cost O(1) to take
+and O(log n) per changed key, instead of a copy of the whole map.
+
+Nodes are plain containers, so that `deep_sizeof` counts the shared nodes once:
+ - internal node: list of the bitmap of the present children followed by the children
+ - leaf: tuple (key, value, hash)
+ - keys with the same hash: tuple (hash, dict of the keys to the values)
+"""
+from collections.abc import ItemsView, Mapping
+from typing import Any, Hashable, Iterator, Optional, Tuple
+
+# Bits of the hash consumed per level of the trie
+LEVEL_BITS = 5
+LEVEL_MASK = (1 << LEVEL_BITS) - 1
+HASH_BITS = 64
+HASH_MASK = (1 << HASH_BITS) - 1
+
+_MISSING = object()
+
+
+def _key_hash(key: Hashable) -> int:
+    return hash(key) & HASH_MASK
+
+
+def _index(bitmap: int, bit: int) -> int:
+    """Position of the child with the bit in the node list"""
+    return 1 + bin(bitmap & (bit - 1)).count("1")
+
+
+def _branch(node: Tuple, node_hash: int, shift: int) -> list:
+    """Internal node with the leaf or the bucket as its only child"""
+    return [1 << ((node_hash >> shift) & LEVEL_MASK), node]
+
+
+def _set(
+    node: Any, key_hash: int, key: Hashable, value: Any, shift: int
+) -> Tuple[Any, bool]:
+    """Copy of the node with the key set. Returns the new node and if the key was added."""
+    if node is None:
+        return (key, value, key_hash), True
+    if type(node) is list:
+        bit = 1 << ((key_hash >> shift) & LEVEL_MASK)
+        bitmap = node[0]
+        pos = _index(bitmap, bit)
+        if bitmap & bit:
+            child, added = _set(node[pos], key_hash, key, value, shift + LEVEL_BITS)
+            new_node = list(node)
+            new_node[pos] = child
+        else:
+            new_node = node[:pos] + [(key, value, key_hash)] + node[pos:]
+            new_node[0] = bitmap | bit
+            added = True
+        return new_node, added
+    if len(node) == 3:
+        if node[0] == key:
+            return (key, value, key_hash), False
+        if node[2] == key_hash:
+            return (key_hash, {node[0]: node[1], key: value}), True
+        return _set(_branch(node, node[2], shift), key_hash, key, value, shift)
+    # Bucket of the keys with the same hash
+    if node[0] == key_hash:
+        bucket = dict(node[1])
+        added = key not in bucket
+        bucket[key] = value
+        return (key_hash, bucket), added
+    return _set(_branch(node, node[0], shift), key_hash, key, value, shift)
+
+
+def _iter_items(node: Any) -> Iterator[Tuple[Hashable, Any]]:
+    if node is None:
+        return
+    if type(node) is list:
+        for child in node[1:]:
+            yield from _iter_items(child)
+    elif len(node) == 3:
+        yield node[0], node[1]
+    else:
+        yield from node[1].items()
+
+
+class _PersistentItems(ItemsView):
+    def __iter__(self) -> Iterator[Tuple[Hashable, Any]]:
+        return _iter_items(self._mapping._root)
+
+
+class PersistentMap(Mapping):
+    """Immutable mapping, `set` returns the updated copy"""
+
+    def __init__(self, root: Any = None, size: int = 0) -> None:
+        self._root = root
+        self._size = size
+
+    def _lookup(self, key: Hashable) -> Any:
+        key_hash = _key_hash(key)
+        node = self._root
+        shift = 0
+        while node is not None:
+            if type(node) is list:
+                bit = 1 << ((key_hash >> shift) & LEVEL_MASK)
+                if not node[0] & bit:
+                    return _MISSING
+                node = node[_index(node[0], bit)]
+                shift += LEVEL_BITS
+            elif len(node) == 3:
+                return node[1] if node[0] == key else _MISSING
+            else:
+                return node[1].get(key, _MISSING)
+        return _MISSING
+
+    def __getitem__(self, key: Hashable) -> Any:
+        value = self._lookup(key)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def get(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        value = self._lookup(key)
+        return default if value is _MISSING else value
+
+    def __contains__(self, key: Any) -> bool:
+        return self._lookup(key) is not _MISSING
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __iter__(self) -> Iterator[Hashable]:
+        return (key for key, _ in _iter_items(self._root))
+
+    def items(self) -> ItemsView:
+        return _PersistentItems(self)
+
+    def set(self, key: Hashable, value: Any) -> "PersistentMap":
+        root, added = _set(self._root, _key_hash(key), key, value, 0)
+        return PersistentMap(root, self._size + 1 if added else self._size)
+
+    def __repr__(self) -> str:
+        return "PersistentMap({})".format(dict(self.items()))
@@ -0,0 +1,472 @@
+"""
+Append-only segment log block store with a memory-mapped hash index.
+"""
+import bisect
+import hashlib
+import mmap
+import os
+import struct
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import zlib
+
+from bami.backbone.datastore.block_store import BaseBlockStore, get_blob_spans
+from bami.backbone.utils import encode_raw, encode_seq_key, SEQ_NUM_LEN
+
+# Kinds of the records in the log. Zero marks the end of the written part of a segment.
+BLOCK_RECORD = 1
+DOT_RECORD = 2
+
+# kind, key length, value length, crc32 of key and value
+RECORD_HEADER = struct.Struct(">BHII")
+# magic, capacity, number of entries, first live segment, checkpoint segment, checkpoint offset
+INDEX_HEADER = struct.Struct(">8sQQIIQ")
+INDEX_MAGIC = b"BAMIIDX1"
+# fingerprint of the key, segment id + 1 (0 for an empty slot), offset of the record
+INDEX_SLOT = struct.Struct(">QII")
+
+DEFAULT_SEGMENT_SIZE = 64 * 1024 * 1024
+DEFAULT_INDEX_CAPACITY = 1 << 14
+MAX_LOAD_FACTOR = 0.7
+
+SEGMENT_PREFIX = "segment_"
+SEGMENT_SUFFIX = ".log"
+INDEX_NAME = "index.idx"
+
+BlockEntry = Tuple[bytes, bytes, bytes, bytes, Iterable[bytes]]
+
+
+def fingerprint(kind: int, key: bytes) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(bytes([kind]) + key, digest_size=8).digest(), "big"
+    )
+
+
+def segment_name(segment_id: int) -> str:
+    return "{prefix}{id:08d}{suffix}".format(
+        prefix=SEGMENT_PREFIX, id=segment_id, suffix=SEGMENT_SUFFIX
+    )
+
+
+class Segment(object):
+    """Preallocated segment file of the log, mapped to memory"""
+
+    def __init__(self, path: str, segment_id: int, size: int) -> None:
+        self.path = path
+        self.segment_id = segment_id
+        self._file = open(path, "a+b")
+        if os.path.getsize(path) < size:
+            self._file.truncate(size)
+        self.size = os.path.getsize(path)
+        self.mm = mmap.mmap(self._file.fileno(), self.size)
+        self.view = memoryview(self.mm)
+        self.write_offset = 0
+
+    def scan(self, offset: int = 0) -> List[Tuple[int, bytes, int]]:
+        """Read valid records starting from the offset. Moves the write offset past the last valid record.
+
+        Returns:
+            List of tuples with kind, key and offset of the records
+        """
+        records = []
+        while offset + RECORD_HEADER.size <= self.size:
+            kind, key_len, val_len, crc = RECORD_HEADER.unpack_from(self.mm, offset)
+            start = offset + RECORD_HEADER.size
+            end = start + key_len + val_len
+            if kind == 0 or end > self.size or zlib.crc32(self.view[start:end]) != crc:
+                # End of the log or a torn write
+                break
+            records.append((kind, bytes(self.view[start : start + key_len]), offset))
+            offset = end
+        self.write_offset = offset
+        return records
+
+    def fits(self, record_len: int) -> bool:
+        return self.write_offset + record_len <= self.size
+
+    def append(self, kind: int, key: bytes, value: bytes) -> int:
+        offset = self.write_offset
+        start = offset + RECORD_HEADER.size
+        self.mm[start : start + len(key)] = key
+        self.mm[start + len(key) : start + len(key) + len(value)] = value
+        crc = zlib.crc32(self.view[start : start + len(key) + len(value)])
+        RECORD_HEADER.pack_into(self.mm, offset, kind, len(key), len(value), crc)
+        self.write_offset = start + len(key) + len(value)
+        return offset
+
+    def read(self, offset: int) -> Tuple[int, memoryview, memoryview]:
+        kind, key_len, val_len, _ = RECORD_HEADER.unpack_from(self.mm, offset)
+        start = offset + RECORD_HEADER.size
+        key_end = start + key_len
+        return kind, self.view[start:key_end], self.view[key_end : key_end + val_len]
+
+    def flush(self) -> None:
+        self.mm.flush()
+
+    def close(self) -> None:
+        self.view.release()
+        self.mm.close()
+        self._file.close()
+
+
+class HashIndex(object):
+    """Open addressing hash index in a memory-mapped file.
+
+    Slots keep only the fingerprint of the key and the location of the record: keys are verified against the log.
+    The header keeps the checkpoint of the log, all records before it are in the index.
+    """
+
+    def __init__(self, path: str, capacity: int = DEFAULT_INDEX_CAPACITY) -> None:
+        self.path = path
+        if not os.path.exists(path):
+            self._create(path, capacity)
+        self._open()
+
+    @staticmethod
+    def _create(path: str, capacity: int) -> None:
+        with open(path, "wb") as f:
+            f.truncate(INDEX_HEADER.size + capacity * INDEX_SLOT.size)
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, capacity, 0, 0, 0, 0))
+
+    def _open(self) -> None:
+        self._file = open(self.path, "r+b")
+        self.mm = mmap.mmap(self._file.fileno(), 0)
+        (
+            magic,
+            self.capacity,
+            self.entries,
+            self.first_segment,
+            checkpoint_segment,
+            checkpoint_offset,
+        ) = INDEX_HEADER.unpack_from(self.mm, 0)
+        if magic != INDEX_MAGIC:
+            raise ValueError("Not a block index", self.path)
+        self.checkpoint = (checkpoint_segment, checkpoint_offset)
+
+    def write_header(self) -> None:
+        INDEX_HEADER.pack_into(
+            self.mm,
+            0,
+            INDEX_MAGIC,
+            self.capacity,
+            self.entries,
+            self.first_segment,
+            *self.checkpoint
+        )
+
+    def _slot_offset(self, slot: int) -> int:
+        return INDEX_HEADER.size + slot * INDEX_SLOT.size
+
+    def candidates(self, key_fp: int) -> Iterator[Tuple[int, int, int]]:
+        """Iterate over slots with the fingerprint. Yields tuples of slot, segment id and offset"""
+        mask = self.capacity - 1
+        slot = key_fp & mask
+        while True:
+            slot_fp, segment, offset = INDEX_SLOT.unpack_from(
+                self.mm, self._slot_offset(slot)
+            )
+            if not segment:
+                return
+            if slot_fp == key_fp:
+                yield slot, segment - 1, offset
+            slot = (slot + 1) & mask
+
+    def locations(self) -> Iterator[Tuple[int, int]]:
+        """Iterate over locations of all records in the live segments"""
+        for slot in range(self.capacity):
+            _, segment, offset = INDEX_SLOT.unpack_from(
+                self.mm, self._slot_offset(slot)
+            )
+            if segment and segment - 1 >= self.first_segment:
+                yield segment - 1, offset
+
+    def set(self, slot: int, key_fp: int, segment_id: int, offset: int) -> None:
+        INDEX_SLOT.pack_into(
+            self.mm, self._slot_offset(slot), key_fp, segment_id + 1, offset
+        )
+
+    def insert(self, key_fp: int, segment_id: int, offset: int) -> None:
+        mask = self.capacity - 1
+        slot = key_fp & mask
+        while INDEX_SLOT.unpack_from(self.mm, self._slot_offset(slot))[1]:
+            slot = (slot + 1) & mask
+        self.set(slot, key_fp, segment_id, offset)
+        self.entries += 1
+
+    @property
+    def is_full(self) -> bool:
+        return self.entries + 1 > self.capacity * MAX_LOAD_FACTOR
+
+    def resize(self, capacity: int) -> None:
+        """Rebuild the index with a new capacity. Entries of the pruned segments are dropped."""
+        tmp_path = self.path + ".tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        new_index = HashIndex(tmp_path, capacity)
+        new_index.first_segment = self.first_segment
+        new_index.checkpoint = self.checkpoint
+        for slot in range(self.capacity):
+            key_fp, segment, offset = INDEX_SLOT.unpack_from(
+                self.mm, self._slot_offset(slot)
+            )
+            if segment and segment - 1 >= self.first_segment:
+                new_index.insert(key_fp, segment - 1, offset)
+        new_index.close()
+        self.close()
+        os.replace(tmp_path, self.path)
+        self._open()
+
+    def flush(self) -> None:
+        self.write_header()
+        self.mm.flush()
+
+    def close(self) -> None:
+        self.flush()
+        self.mm.close()
+        self._file.close()
+
+
+class SegmentLogBlockStore(BaseBlockStore):
+    """BlockStore based on append-only segment files and a memory-mapped hash index.
+
+    Blocks and dots are appended to the active segment, sealed segments are never modified.
+    Writes are sequential and there is no B-tree to copy on write, which suits write-heavy nodes.
+    Transaction and type are read from the block blob. Old segments can be pruned as a whole.
+
+    Records before the index checkpoint are flushed on `flush`, `close` and when a segment is sealed.
+    On open, the log after the checkpoint is replayed into the index.
+    """
+
+    def __init__(
+        self,
+        block_dir: str,
+        segment_size: int = DEFAULT_SEGMENT_SIZE,
+        index_capacity: int = DEFAULT_INDEX_CAPACITY,
+    ) -> None:
+        """
+        Args:
+            block_dir: directory for the segments and the index
+            segment_size: preallocated size of a segment file in bytes
+            index_capacity: initial number of slots in the index. Must be a power of two.
+        """
+        os.makedirs(block_dir, exist_ok=True)
+        self.block_dir = block_dir
+        self.segment_size = segment_size
+        self.index = HashIndex(os.path.join(block_dir, INDEX_NAME), index_capacity)
+
+        self.segments: Dict[int, Segment] = dict()
+        for name in sorted(os.listdir(block_dir)):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+                segment_id = int(name[len(SEGMENT_PREFIX) : -len(SEGMENT_SUFFIX)])
+                path = os.path.join(block_dir, name)
+                if segment_id < self.index.first_segment:
+                    # Pruned, but not removed before the shutdown
+                    os.remove(path)
+                else:
+                    self.segments[segment_id] = Segment(path, segment_id, 0)
+        if not self.segments:
+            self._new_segment(self.index.first_segment)
+        self._replay()
+
+        # Sorted dot keys for the range scans, built on the first scan
+        self._dot_keys: Optional[List[bytes]] = None
+
+    @property
+    def active_segment(self) -> Segment:
+        return self.segments[max(self.segments)]
+
+    @property
+    def segment_ids(self) -> List[int]:
+        return sorted(self.segments)
+
+    def _new_segment(self, segment_id: int, size: int = 0) -> Segment:
+        path = os.path.join(self.block_dir, segment_name(segment_id))
+        segment = Segment(path, segment_id, max(size, self.segment_size))
+        self.segments[segment_id] = segment
+        return segment
+
+    def _replay(self) -> None:
+        checkpoint_segment, checkpoint_offset = self.index.checkpoint
+        for segment_id in sorted(self.segments):
+            if segment_id < checkpoint_segment:
+                # Sealed before the checkpoint: already in the index
+                self.segments[segment_id].write_offset = self.segments[segment_id].size
+                continue
+            offset = checkpoint_offset if segment_id == checkpoint_segment else 0
+            for kind, key, rec_offset in self.segments[segment_id].scan(offset):
+                self._index_record(kind, key, segment_id, rec_offset)
+
+    def _find(
+        self, kind: int, key: bytes
+    ) -> Tuple[Optional[int], Optional[memoryview]]:
+        """Find the record in the log. Returns the index slot and the value of the record."""
+        for slot, segment_id, offset in self.index.candidates(fingerprint(kind, key)):
+            segment = self.segments.get(segment_id)
+            if segment is None:
+                # Pruned segment
+                continue
+            rec_kind, rec_key, value = segment.read(offset)
+            if rec_kind == kind and rec_key == key:
+                return slot, value
+        return None, None
+
+    def _index_record(
+        self, kind: int, key: bytes, segment_id: int, offset: int
+    ) -> None:
+        key_fp = fingerprint(kind, key)
+        slot, _ = self._find(kind, key)
+        if slot is not None:
+            self.index.set(slot, key_fp, segment_id, offset)
+            return
+        if self.index.is_full:
+            self.index.resize(self.index.capacity * 2)
+        self.index.insert(key_fp, segment_id, offset)
+
+    def _append(self, kind: int, key: bytes, value: bytes) -> None:
+        record_len = RECORD_HEADER.size + len(key) + len(value)
+        segment = self.active_segment
+        if not segment.fits(record_len):
+            # Seal the active segment
+            self.flush()
+            segment = self._new_segment(segment.segment_id + 1, record_len)
+        offset = segment.append(kind, key, value)
+        self._index_record(kind, key, segment.segment_id, offset)
+        if kind == DOT_RECORD and self._dot_keys is not None:
+            bisect.insort(self._dot_keys, key)
+
+    def put_blocks(self, blocks: Iterable[BlockEntry]) -> None:
+        """Append a batch of blocks with their dots
+
+        Args:
+            blocks: tuples of block hash, block blob, transaction, extra and dot keys
+        """
+        for block_hash, block_blob, _, _, dots in blocks:
+            self._append(BLOCK_RECORD, block_hash, block_blob)
+            for dot in dots:
+                self._append(DOT_RECORD, dot, block_hash)
+
+    def put_block(
+        self,
+        block_hash: bytes,
+        block_blob: bytes,
+        tx_blob: bytes,
+        extra: bytes,
+        dots: Iterable[bytes],
+    ) -> None:
+        self.put_blocks(((block_hash, block_blob, tx_blob, extra, dots),))
+
+    def add_block(self, block_hash: bytes, block_blob: bytes) -> None:
+        self._append(BLOCK_RECORD, block_hash, block_blob)
+
+    def add_tx(self, block_hash: bytes, tx_blob: bytes) -> None:
+        # Transaction is read from the block blob
+        pass
+
+    def add_extra(self, block_hash: bytes, extra: bytes) -> None:
+        # Type is read from the block blob
+        pass
+
+    def add_dot(self, dot: bytes, block_hash: bytes) -> None:
+        self._append(DOT_RECORD, dot, block_hash)
+
+    def get_block_view(self, block_hash: bytes) -> Optional[memoryview]:
+        """Get the block blob without copying. The view must be released before the store is closed."""
+        return self._find(BLOCK_RECORD, block_hash)[1]
+
+    def get_block_view_by_dot(self, dot: bytes) -> Optional[memoryview]:
+        block_hash = self._find(DOT_RECORD, dot)[1]
+        return self._find(BLOCK_RECORD, block_hash)[1] if block_hash else None
+
+    def has_block(self, block_hash: bytes) -> bool:
+        return self._find(BLOCK_RECORD, block_hash)[0] is not None
+
+    def get_block_by_hash(self, block_hash: bytes) -> Optional[bytes]:
+        view = self.get_block_view(block_hash)
+        return bytes(view) if view is not None else None
+
+    def get_block_by_dot(self, dot: bytes) -> Optional[bytes]:
+        view = self.get_block_view_by_dot(dot)
+        return bytes(view) if view is not None else None
+
+    def get_hash_by_dot(self, dot: bytes) -> Optional[bytes]:
+        block_hash = self._find(DOT_RECORD, dot)[1]
+        return bytes(block_hash) if block_hash is not None else None
+
+    def get_tx_by_hash(self, block_hash: bytes) -> Optional[bytes]:
+        view = self.get_block_view(block_hash)
+        if view is None:
+            return None
+        _, (tx_start, tx_end) = get_blob_spans(view)
+        return bytes(view[tx_start:tx_end])
+
+    def get_extra(self, block_hash: bytes) -> Optional[bytes]:
+        view = self.get_block_view(block_hash)
+        if view is None:
+            return None
+        (type_start, type_end), _ = get_blob_spans(view)
+        return encode_raw({b"type": bytes(view[type_start:type_end])})
+
+    def _build_dot_keys(self) -> List[bytes]:
+        dot_keys = []
+        for segment_id, offset in self.index.locations():
+            segment = self.segments.get(segment_id)
+            if segment is not None:
+                kind, key, _ = segment.read(offset)
+                if kind == DOT_RECORD:
+                    dot_keys.append(bytes(key))
+        dot_keys.sort()
+        return dot_keys
+
+    def get_dot_blocks_by_seq_range(
+        self, chain_id: bytes, start_seq: int, end_seq: int
+    ) -> Iterable[Tuple[bytes, bytes, bytes]]:
+        if self._dot_keys is None:
+            self._dot_keys = self._build_dot_keys()
+        seq_end = len(chain_id) + SEQ_NUM_LEN
+        blobs = []
+        pos = bisect.bisect_left(self._dot_keys, encode_seq_key(chain_id, start_seq))
+        for dot_key in self._dot_keys[pos:]:
+            if not dot_key.startswith(chain_id) or len(dot_key) <= seq_end:
+                break
+            if int.from_bytes(dot_key[len(chain_id) : seq_end], "big") > end_seq:
+                break
+            block_hash = self.get_hash_by_dot(dot_key)
+            val = self.get_block_by_hash(block_hash) if block_hash else None
+            if val:
+                blobs.append((dot_key, block_hash, val))
+        return blobs
+
+    def prune_segments(self, before_segment: int) -> List[int]:
+        """Remove sealed segments with ids lower than `before_segment`. The active segment is never removed.
+
+        Returns:
+            Ids of the removed segments
+        """
+        before_segment = min(before_segment, self.active_segment.segment_id)
+        pruned = [s for s in self.segments if s < before_segment]
+        if not pruned:
+            return pruned
+        # Move the watermark first: the index ignores the entries of pruned segments
+        self.index.first_segment = before_segment
+        self.index.flush()
+        for segment_id in pruned:
+            segment = self.segments.pop(segment_id)
+            segment.close()
+            os.remove(segment.path)
+        self._dot_keys = None
+        return pruned
+
+    def used_bytes(self) -> int:
+        """Bytes written to the live segments and the size of the index"""
+        return sum(s.write_offset for s in self.segments.values()) + len(self.index.mm)
+
+    def flush(self) -> None:
+        segment = self.active_segment
+        segment.flush()
+        self.index.checkpoint = (segment.segment_id, segment.write_offset)
+        self.index.flush()
+
+    def close(self) -> None:
+        self.flush()
+        for segment in self.segments.values():
+            segment.close()
+        self.index.close()
@@ -3,6 +3,7 @@ from __future__ import annotations
 from abc import ABC, ABCMeta, abstractmethod
 from asyncio import Queue, sleep
 from random import sample, shuffle
+from time import perf_counter
 from typing import Iterable, Union
 
 from bami.backbone.community_routines import (
@@ -118,6 +119,11 @@ class GossipFrontiersMixin(
             next_peers = self.gossip_strategy.get_next_gossip_peers(
                 subcom_id, prefix + subcom_id, frontier, self.settings.gossip_fanout
             )
+            if self.metrics:
+                self.metrics.counter("gossip_rounds_total", "Gossip rounds").inc()
+                self.metrics.counter(
+                    "gossip_frontiers_sent_total", "Frontiers sent in gossip rounds"
+                ).inc(len(next_peers))
             for peer in next_peers:
                 self.logger.debug(
                     "Sending frontier %s to peer %s. Witness chain: %s",
@@ -135,12 +141,26 @@ class GossipFrontiersMixin(
             peer, frontier, should_respond = await self.incoming_frontier_queue(
                 subcom_id
             ).get()
+            metrics = self.metrics
+            if metrics:
+                start = perf_counter()
             self.persistence.store_last_frontier(
                 subcom_id, peer.public_key.key_to_bin(), frontier
             )
             frontier_diff = self.persistence.reconcile(
                 subcom_id, frontier, peer.public_key.key_to_bin()
             )
+            if metrics:
+                metrics.histogram(
+                    "reconcile_seconds", "Time to reconcile a received frontier"
+                ).observe(perf_counter() - start)
+                metrics.counter(
+                    "frontiers_processed_total", "Received frontiers reconciled"
+                ).inc()
+                if not frontier_diff.is_empty():
+                    metrics.counter(
+                        "blocks_requests_sent_total", "Requests of missing blocks"
+                    ).inc()
             if frontier_diff.is_empty():
                 # Move to the next
                 await sleep(0.001)
@@ -193,6 +213,9 @@ class GossipFrontiersMixin(
     def received_blocks_request(
         self, peer: Peer, payload: BlocksRequestPayload
     ) -> None:
+        metrics = self.metrics
+        if metrics:
+            start = perf_counter()
         f_diff = FrontierDiff.from_bytes(payload.frontier_diff)
         chain_id = payload.subcom_id
         vals_to_request = set()
@@ -213,6 +236,16 @@ class GossipFrontiersMixin(
         )
         for block in blocks:
             self.send_packet(peer, RawBlockPayload(block))
+        if metrics:
+            metrics.counter(
+                "blocks_requests_received_total", "Received requests of blocks"
+            ).inc()
+            metrics.counter("blocks_sent_total", "Blocks sent on request").inc(
+                len(blocks)
+            )
+            metrics.histogram(
+                "blocks_request_seconds", "Time to answer a request of blocks"
+            ).observe(perf_counter() - start)
 
     def setup_messages(self) -> None:
         self.add_message_handler(FrontierPayload, self.received_frontier)
@@ -0,0 +1,113 @@
+"""
+Monitor of the event loop lag of a community.
+
+A periodic check measures how late it runs. A late check means that handlers or tasks held the loop,
+the handlers that ran since the previous check are taken from the handler profiler.
+"""
+from asyncio import get_event_loop
+from collections import deque
+from dataclasses import dataclass
+import logging
+from typing import Callable, Dict, List, Optional, Tuple
+
+from bami.backbone.profiling import HandlerProfiler
+from bami.backbone.tracing import LatencyHistogram
+
+
+@dataclass
+class LagSpike:
+    # Loop time of the late check
+    time: float
+    lag: float
+    # (name, completed calls, seconds) of the handlers that ran since the previous check,
+    # slowest first
+    handlers: List[Tuple[str, int, float]]
+    # Live tasks by category
+    tasks: Dict[str, int]
+
+
+class LoopMonitor(object):
+    def __init__(
+        self,
+        profiler: HandlerProfiler,
+        interval: float = 0.1,
+        lag_threshold: float = 0.05,
+        max_spikes: int = 100,
+        max_handlers: int = 5,
+    ) -> None:
+        """
+        Args:
+            profiler: times the handlers, to find the handlers that ran during a spike
+            interval: seconds between the checks
+            lag_threshold: lag in seconds from which a check is a spike
+            max_spikes: number of the last spikes kept
+            max_handlers: number of the slowest handlers reported per spike
+        """
+        self.profiler = profiler
+        self.interval = interval
+        self.lag_threshold = lag_threshold
+        self.max_handlers = max_handlers
+        self.lag = LatencyHistogram()
+        self.spikes = deque(maxlen=max_spikes)
+        self.num_spikes = 0
+        self.last_check: Optional[float] = None
+        # Handler name -> (calls, busy time) at the previous check
+        self.last_totals = dict()
+
+    def start(self, now: float = None) -> None:
+        """Take the time and the handler totals the first check is compared to"""
+        self.last_check = get_event_loop().time() if now is None else now
+        self.last_totals = self._handler_totals()
+
+    def _handler_totals(self) -> Dict[str, Tuple[int, float]]:
+        return {
+            name: (stats.calls, stats.busy)
+            for name, stats in self.profiler.stats.items()
+        }
+
+    def check(
+        self, count_tasks: Callable[[], Dict[str, int]], now: float = None
+    ) -> Optional[LagSpike]:
+        """Measure the lag since the previous check. Returns the spike if the lag is too high.
+
+        Args:
+            count_tasks: counts the live tasks by category, called on a spike only
+        """
+        now = get_event_loop().time() if now is None else now
+        totals = self._handler_totals()
+        last_check, last_totals = self.last_check, self.last_totals
+        self.last_check, self.last_totals = now, totals
+        if last_check is None:
+            return None
+        lag = max(0.0, now - last_check - self.interval)
+        self.lag.add(lag)
+        if lag < self.lag_threshold:
+            return None
+        handlers = []
+        for name, (calls, busy) in totals.items():
+            last_calls, last_busy = last_totals.get(name, (0, 0.0))
+            if busy > last_busy:
+                handlers.append((name, calls - last_calls, busy - last_busy))
+        handlers.sort(key=lambda handler: handler[2], reverse=True)
+        spike = LagSpike(now, lag, handlers[: self.max_handlers], count_tasks())
+        self.spikes.append(spike)
+        self.num_spikes += 1
+        return spike
+
+    def report(self) -> Dict:
+        return {
+            "lag": self.lag.summary(),
+            "spikes": self.num_spikes,
+            "last_spikes": list(self.spikes),
+        }
+
+    @staticmethod
+    def log_spike(logger: logging.Logger, spike: LagSpike) -> None:
+        logger.warning(
+            "Event loop lag of %.3fs, handlers: %s, tasks: %s",
+            spike.lag,
+            ", ".join(
+                "{} ({} calls, {:.3f}s)".format(*handler) for handler in spike.handlers
+            ),
+            ", ".join("{} {}".format(*item) for item in sorted(spike.tasks.items())),
+        )
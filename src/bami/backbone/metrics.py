@@ -0,0 +1,140 @@
+"""
+Lightweight metrics of a running node: counters, gauges and histograms.
+
+Metrics are disabled by default. Instrumented code checks the registry first, so a disabled
+registry costs a single attribute check.
+"""
+import os
+from typing import Any, Callable, Dict
+
+from bami.backbone.tracing import LatencyHistogram
+
+
+class Counter(object):
+    kind = "counter"
+
+    def __init__(self) -> None:
+        self.value = 0
+
+    def inc(self, amount: int = 1) -> None:
+        self.value += amount
+
+
+class Gauge(object):
+    kind = "gauge"
+
+    def __init__(self, callback: Callable[[], float] = None) -> None:
+        """
+        Args:
+            callback: function that reads the value when the gauge is exported
+        """
+        self.callback = callback
+        self._value = 0.0
+
+    @property
+    def value(self) -> float:
+        return self.callback() if self.callback else self._value
+
+    def set(self, value: float) -> None:
+        self._value = value
+
+
+class Histogram(LatencyHistogram):
+    kind = "histogram"
+
+    def observe(self, value: float) -> None:
+        self.add(value)
+
+
+class LMDBTransactionCounter(object):
+    """Counts the transactions begun in a LMDB environment, other calls go to the environment"""
+
+    def __init__(self, env: Any, read_txns: Counter, write_txns: Counter) -> None:
+        self.env = env
+        self.read_txns = read_txns
+        self.write_txns = write_txns
+
+    def begin(self, *args, **kwargs) -> Any:
+        if kwargs.get("write"):
+            self.write_txns.inc()
+        else:
+            self.read_txns.inc()
+        return self.env.begin(*args, **kwargs)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.env, name)
+
+
+class MetricsRegistry(object):
+    def __init__(self, prefix: str = "bami_") -> None:
+        self.prefix = prefix
+        # Name -> (metric, description)
+        self.metrics = dict()
+
+    def _get(self, name: str, factory: Callable, description: str) -> Any:
+        entry = self.metrics.get(name)
+        if entry is None:
+            entry = self.metrics[name] = (factory(), description)
+        return entry[0]
+
+    def counter(self, name: str, description: str = "") -> Counter:
+        return self._get(name, Counter, description)
+
+    def gauge(
+        self, name: str, description: str = "", callback: Callable[[], float] = None,
+    ) -> Gauge:
+        gauge = self._get(name, Gauge, description)
+        if callback:
+            gauge.callback = callback
+        return gauge
+
+    def histogram(self, name: str, description: str = "") -> Histogram:
+        """Histogram of durations or other values in seconds"""
+        return self._get(name, Histogram, description)
+
+    def instrument_lmdb(self, block_store: Any) -> None:
+        """Count the LMDB transactions of the block store, if it is backed by LMDB"""
+        env = getattr(block_store, "env", None)
+        if env is None or isinstance(env, LMDBTransactionCounter):
+            return
+        block_store.env = LMDBTransactionCounter(
+            env,
+            self.counter("lmdb_read_txns_total", "LMDB read transactions"),
+            self.counter("lmdb_write_txns_total", "LMDB write transactions"),
+        )
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Values of the counters and gauges, summaries of the histograms"""
+        return {
+            name: metric.summary() if metric.kind == "histogram" else metric.value
+            for name, (metric, _) in sorted(self.metrics.items())
+        }
+
+    def to_prometheus(self) -> str:
+        """Metrics in the Prometheus text exposition format"""
+        lines = []
+        for name, (metric, description) in sorted(self.metrics.items()):
+            full_name = self.prefix + name
+            if description:
+                lines.append("# HELP {} {}".format(full_name, description))
+            lines.append("# TYPE {} {}".format(full_name, metric.kind))
+            if metric.kind != "histogram":
+                lines.append("{} {}".format(full_name, metric.value))
+                continue
+            cumulative = 0
+            for bound, num in zip(metric.bounds, metric.buckets):
+                cumulative += num
+                lines.append(
+                    '{}_bucket{{le="{}"}} {}'.format(full_name, bound, cumulative)
+                )
+            lines.append('{}_bucket{{le="+Inf"}} {}'.format(full_name, metric.count))
+            lines.append("{}_sum {}".format(full_name, metric.total))
+            lines.append("{}_count {}".format(full_name, metric.count))
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str) -> None:
+        """Replace the file with the metrics, e.g. for the textfile collector of the node exporter"""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
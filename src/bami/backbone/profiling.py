@@ -0,0 +1,234 @@
+"""
+Profiling of the message handlers and the flexible tasks of a community.
+
+A wrapped handler counts its calls and the time it holds the event loop. Coroutines are timed
+per step, so the time they wait for other tasks is not counted.
+The top handlers by total time are profiled with cProfile, and optionally with tracemalloc.
+"""
+import cProfile
+from functools import wraps
+import heapq
+from inspect import iscoroutine, iscoroutinefunction
+import io
+import logging
+import pstats
+from time import perf_counter, time
+import tracemalloc
+import types
+from typing import Any, Callable, Coroutine, Dict, Generator, List, Optional
+
+
+class HandlerStats(object):
+    def __init__(self, kind: str, slowest_calls: int) -> None:
+        # Handler or task
+        self.kind = kind
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.slowest_calls = slowest_calls
+        # Min-heap of the (duration, wall time) of the slowest calls
+        self.slowest = []
+        # Profile of the calls, while the handler is one of the top handlers
+        self.profile: Optional[cProfile.Profile] = None
+        # Net bytes allocated by the profiled calls
+        self.allocated = 0
+        # Time of the steps, including the steps of the calls in progress
+        self.busy = 0.0
+
+    def add(self, duration: float) -> None:
+        self.calls += 1
+        self.total += duration
+        if duration > self.max:
+            self.max = duration
+        if len(self.slowest) < self.slowest_calls:
+            heapq.heappush(self.slowest, (duration, time()))
+        elif self.slowest and duration > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (duration, time()))
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "kind": self.kind,
+            "calls": self.calls,
+            "total": self.total,
+            "mean": self.total / self.calls if self.calls else 0.0,
+            "max": self.max,
+            "slowest": sorted(self.slowest, reverse=True),
+            "allocated": self.allocated,
+        }
+
+
+class HandlerProfiler(object):
+    def __init__(
+        self,
+        slowest_calls: int = 10,
+        top_handlers: int = 0,
+        capture_memory: bool = False,
+        selection_calls: int = 1000,
+    ) -> None:
+        """
+        Args:
+            slowest_calls: number of the slowest calls kept per handler
+            top_handlers: number of handlers with the highest total time profiled with cProfile
+            capture_memory: trace the allocations of the top handlers with tracemalloc
+            selection_calls: the top handlers are selected after 100 calls, then again after
+             twice as many calls, up to this number of calls
+        """
+        self.slowest_calls = slowest_calls
+        self.top_handlers = top_handlers
+        self.capture_memory = capture_memory
+        self.selection_calls = selection_calls
+        self.stats: Dict[str, HandlerStats] = dict()
+        self.num_calls = 0
+        self.next_selection = min(100, selection_calls)
+        # Profile enabled at the moment, profiles do not nest
+        self.active: Optional[cProfile.Profile] = None
+        self.started_tracemalloc = False
+
+    def wrap(self, func: Callable, kind: str = "handler") -> Callable:
+        """Wrap the handler or the task function, the name of the function identifies it"""
+        if getattr(func, "profiled", False):
+            return func
+        name = getattr(func, "__name__", repr(func))
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = HandlerStats(kind, self.slowest_calls)
+
+        if iscoroutinefunction(func):
+
+            @wraps(func)
+            async def profiled(*args, **kwargs):
+                return await self._timed_steps(stats, func(*args, **kwargs), 0.0)
+
+        else:
+
+            @wraps(func)
+            def profiled(*args, **kwargs):
+                elapsed = [0.0]
+                try:
+                    result = self._step(stats, elapsed, func, *args, **kwargs)
+                except BaseException:
+                    self._finish(stats, elapsed[0])
+                    raise
+                if iscoroutine(result):
+                    return self._finish_coroutine(stats, result, elapsed[0])
+                self._finish(stats, elapsed[0])
+                return result
+
+        profiled.profiled = True
+        return profiled
+
+    def wrap_handlers(self, decode_map: Dict[str, Callable]) -> None:
+        """Wrap the handlers already in the decode map of a community"""
+        for msg_id, handler in decode_map.items():
+            decode_map[msg_id] = self.wrap(handler)
+
+    def _step(
+        self, stats: HandlerStats, elapsed: List[float], func: Callable, *args, **kwargs
+    ) -> Any:
+        profile = stats.profile if self.active is None else None
+        if profile:
+            self.active = profile
+            memory = tracemalloc.get_traced_memory()[0] if self.capture_memory else 0
+            profile.enable()
+        start = perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            duration = perf_counter() - start
+            elapsed[0] += duration
+            stats.busy += duration
+            if profile:
+                profile.disable()
+                self.active = None
+                if self.capture_memory:
+                    stats.allocated += tracemalloc.get_traced_memory()[0] - memory
+
+    @types.coroutine
+    def _timed_steps(
+        self, stats: HandlerStats, coro: Coroutine, elapsed: float
+    ) -> Generator:
+        """Run the coroutine step by step, adding up the time of the steps"""
+        elapsed = [elapsed]
+        value, error = None, None
+        try:
+            while True:
+                try:
+                    if error is not None:
+                        future = self._step(stats, elapsed, coro.throw, error)
+                    else:
+                        future = self._step(stats, elapsed, coro.send, value)
+                except StopIteration as stop:
+                    return stop.value
+                try:
+                    value, error = (yield future), None
+                except BaseException as e:
+                    value, error = None, e
+        finally:
+            self._finish(stats, elapsed[0])
+
+    async def _finish_coroutine(
+        self, stats: HandlerStats, coro: Coroutine, elapsed: float
+    ) -> Any:
+        return await self._timed_steps(stats, coro, elapsed)
+
+    def _finish(self, stats: HandlerStats, elapsed: float) -> None:
+        stats.add(elapsed)
+        self.num_calls += 1
+        if self.top_handlers and self.num_calls >= self.next_selection:
+            self.select_top()
+
+    def top(self, num: int = None) -> List[str]:
+        """Names of the handlers with the highest total time"""
+        names = sorted(self.stats, key=lambda n: self.stats[n].total, reverse=True)
+        return names[:num] if num is not None else names
+
+    def select_top(self) -> None:
+        """Profile the current top handlers with cProfile, stop profiling the others"""
+        self.next_selection = self.num_calls + min(
+            max(self.num_calls, 100), self.selection_calls
+        )
+        if self.capture_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracemalloc = True
+        top = set(self.top(self.top_handlers))
+        for name, stats in self.stats.items():
+            if name in top and not stats.profile:
+                stats.profile = cProfile.Profile()
+            elif name not in top and stats.profile and stats.profile is not self.active:
+                stats.profile = None
+
+    def format_profile(self, name: str, limit: int = 20) -> str:
+        """cProfile statistics of the handler, sorted by the cumulative time"""
+        stats = self.stats.get(name)
+        if not stats or not stats.profile:
+            return ""
+        stream = io.StringIO()
+        try:
+            pstats.Stats(stats.profile, stream=stream).sort_stats(
+                "cumulative"
+            ).print_stats(limit)
+        except TypeError:
+            # The profile has no calls yet
+            return ""
+        return stream.getvalue()
+
+    def report(self) -> Dict[str, Dict[str, Any]]:
+        """Summaries of the handlers, by the total time"""
+        return {name: self.stats[name].summary() for name in self.top()}
+
+    def dump(self, logger: logging.Logger, num: int = 10) -> None:
+        for name, summary in list(self.report().items())[:num]:
+            logger.info(
+                "Handler %s (%s): calls %d total %.6f mean %.6f max %.6f",
+                name,
+                summary["kind"],
+                summary["calls"],
+                summary["total"],
+                summary["mean"],
+                summary["max"],
+            )
+
+    def close(self) -> None:
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+            self.started_tracemalloc = False
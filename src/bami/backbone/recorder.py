@@ -0,0 +1,104 @@
+"""
+Recording of the inbound packets of a community, to replay identical traffic offline.
+
+The log file starts with a magic header, followed by the records:
+    header (time, kind, host length, port, data length) | host | peer id | data
+Packets keep their raw bytes, including the signature, so a replayed packet is handled as the original.
+"""
+from collections import namedtuple
+from hashlib import sha1
+import struct
+import time
+from typing import Iterator, Tuple
+
+Address = Tuple[str, int]
+
+MAGIC = b"BAMIREC1"
+RECORD_HEADER = struct.Struct(">dBBHI")
+PEER_ID_SIZE = 20
+NO_PEER = b"\x00" * PEER_ID_SIZE
+
+# Record kinds
+PACKET = 1
+SUBSCRIPTION = 2
+
+Record = namedtuple("Record", ["time", "kind", "address", "peer_id", "data"])
+
+
+def packet_peer_id(data: bytes) -> bytes:
+    """Member id of the sender of a signed packet: sha1 of the public key after the message id"""
+    if len(data) < 25:
+        return NO_PEER
+    key_len = int.from_bytes(data[23:25], "big")
+    key = data[25 : 25 + key_len]
+    if not key_len or len(key) != key_len:
+        return NO_PEER
+    return sha1(key).digest()
+
+
+class PacketRecorder(object):
+    """Appends the inbound packets and the subscriptions of a community to a log file"""
+
+    def __init__(self, path: str, buffer_size: int = 1 << 16) -> None:
+        self.path = path
+        self.file = open(path, "ab", buffering=buffer_size)
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+        self.num_records = 0
+
+    def _write(
+        self, kind: int, address: Address, peer_id: bytes, data: bytes, now: float
+    ) -> None:
+        host = address[0].encode()
+        self.file.write(
+            RECORD_HEADER.pack(
+                now if now is not None else time.time(),
+                kind,
+                len(host),
+                address[1],
+                len(data),
+            )
+        )
+        self.file.write(host)
+        self.file.write(peer_id)
+        self.file.write(data)
+        self.num_records += 1
+
+    def record_packet(self, address: Address, data: bytes, now: float = None) -> None:
+        self._write(PACKET, address, packet_peer_id(data), data, now)
+
+    def record_subscription(self, subcom_id: bytes, now: float = None) -> None:
+        self._write(SUBSCRIPTION, ("", 0), NO_PEER, subcom_id, now)
+
+    def flush(self) -> None:
+        self.file.flush()
+
+    def close(self) -> None:
+        if not self.file.closed:
+            self.file.close()
+
+
+def read_records(path: str) -> Iterator[Record]:
+    """Records of the log file in the recorded order. A truncated last record is ignored.
+
+    Raises:
+        ValueError if the file is not a packet log
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("Not a packet log", path)
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            rec_time, kind, host_len, port, data_len = RECORD_HEADER.unpack(header)
+            body = f.read(host_len + PEER_ID_SIZE + data_len)
+            if len(body) < host_len + PEER_ID_SIZE + data_len:
+                return
+            yield Record(
+                rec_time,
+                kind,
+                (body[:host_len].decode(), port),
+                body[host_len : host_len + PEER_ID_SIZE],
+                body[host_len + PEER_ID_SIZE :],
+            )
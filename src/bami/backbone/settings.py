@@ -24,6 +24,21 @@ class SyncMode(Enum):
     PASSIVE = 4
 
 
+class BlockStoreType(Enum):
+    """
+    On-disk layouts of the block store
+    """
+
+    # Dots reference block hashes, transaction and extra are stored separately
+    LMDB = 1
+    # Dots reference block blobs directly
+    LMDB_DIRECT = 2
+    # Append-only segment files with a memory-mapped hash index
+    SEGMENT_LOG = 3
+    # Dicts in memory, for simulations and benchmarks
+    MEMORY = 4
+
+
 class BamiSettings(object):
     """
     This class holds various settings regarding TrustChain.
@@ -46,6 +61,7 @@ class BamiSettings(object):
         self.gossip_sync_max_delay = 0.1
         self.gossip_interval = 0.5
         self.gossip_collect_time = 0.2
+        # Resolution of the maximum wait timers of the blocks to counter-sign
         self.block_sign_delta = 0.3
         # Maximum wait time 100
         # Maximum wait block 100
@@ -54,6 +70,50 @@ class BamiSettings(object):
 
         # working directory for the database
         self.work_directory = ".block_db"
+        # Layout of the block store. Existing stores are migrated on start
+        self.block_store_type = BlockStoreType.LMDB
+        # Size of a preallocated segment file of the segment log block store
+        self.segment_size = 64 * 1024 * 1024
+        # Byte budget of the in-memory block store. 0 for no limit.
+        # Evicted blocks may still be referenced by the chains: set it only if they can go missing
+        self.memory_store_size = 0
+        # Byte budget for the cache of hot block blobs in front of the block store. 0 to disable
+        self.block_cache_size = 16 * 1024 * 1024
+        # Entries of the terminal cache shared by all chains, most recently used chains keep the most.
+        # 0 for a cache of 10000 entries per chain
+        self.term_cache_size = 100_000
+        # Record the latencies of the block stages, from creation or receipt until confirmation
+        self.block_tracing = False
+        # Number of blocks traced at once
+        self.tracing_max_blocks = 10000
+        # Interval of logging the block latencies in seconds. 0 to disable
+        self.tracing_dump_interval = 60.0
+        # Count and time the gossip, the sync and the storage operations
+        self.metrics_enabled = False
+        # File the metrics are written to in the Prometheus text format. Empty to not write them
+        self.metrics_file = ""
+        # Interval of writing the metrics file in seconds
+        self.metrics_interval = 10.0
+        # Log file of the inbound packets and the subscriptions, for a replay. Empty to not record
+        self.record_file = ""
+        # Time the message handlers and the flexible tasks
+        self.handler_profiling = False
+        # Number of the slowest calls kept per handler
+        self.profiling_slowest_calls = 10
+        # Number of the handlers with the highest total time profiled with cProfile. 0 to disable
+        self.profiling_top_handlers = 0
+        # Trace the allocations of the top handlers with tracemalloc
+        self.profiling_memory = False
+        # Interval of logging the handler times in seconds. 0 to disable
+        self.profiling_dump_interval = 60.0
+        # Measure the event loop lag, and time the handlers to report the ones running during a spike
+        self.loop_monitoring = False
+        # Interval of the lag checks in seconds
+        self.loop_monitor_interval = 0.1
+        # Lag in seconds from which the handlers and the tasks are reported
+        self.loop_lag_threshold = 0.05
+        # Number of the last lag spikes kept
+        self.loop_max_spikes = 100
         # Gossip fanout for frontiers exchange
         self.gossip_fanout = 6
 
@@ -290,6 +290,8 @@ class SubCommunityMixin(SubCommunityRoutines, CommunityRoutines, metaclass=ABCMe
                 self.join_subcom(c_id, discovery_params)
                 # Join the sub-community
                 self.join_subcommunity_gossip(c_id)
+                if self.recorder:
+                    self.recorder.record_subscription(c_id)
                 updated = True
         if updated:
             self.notify_peers_on_new_subcoms()
@@ -310,6 +312,8 @@ class SubCommunityMixin(SubCommunityRoutines, CommunityRoutines, metaclass=ABCMe
 
             # Join the protocol audits/ updates
             self.join_subcommunity_gossip(subcom_id)
+            if self.recorder:
+                self.recorder.record_subscription(subcom_id)
 
             # Notify other peers that you are part of the new community
             self.notify_peers_on_new_subcoms()
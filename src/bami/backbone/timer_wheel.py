@@ -0,0 +1,70 @@
+from math import ceil
+from typing import Any, Hashable, List
+
+
+class TimerWheel(object):
+    """Hashed timer wheel: O(1) schedule and cancel of many timeouts with the same resolution.
+
+    The wheel does not run by itself, the owner advances it periodically with the current time.
+    """
+
+    def __init__(self, tick: float, num_slots: int, now: float = 0.0) -> None:
+        """
+        Args:
+            tick: resolution of the timers in seconds
+            num_slots: number of slots in one revolution of the wheel
+            now: current time
+        """
+        self.tick = tick
+        self.num_slots = num_slots
+        self.slots = [dict() for _ in range(num_slots)]
+        # Key -> deadline tick of the timer
+        self.deadlines = dict()
+        self.current_tick = self._to_tick(now)
+
+    def _to_tick(self, time_val: float) -> int:
+        return int(time_val / self.tick)
+
+    def __len__(self) -> int:
+        return len(self.deadlines)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.deadlines
+
+    def schedule(self, key: Hashable, delay: float, now: float) -> None:
+        """Schedule the timer of the key to expire after delay. Replaces an existing timer of the key."""
+        self.cancel(key)
+        deadline = max(ceil((now + delay) / self.tick), self.current_tick + 1)
+        self.deadlines[key] = deadline
+        self.slots[deadline % self.num_slots][key] = deadline
+
+    def cancel(self, key: Hashable) -> bool:
+        deadline = self.deadlines.pop(key, None)
+        if deadline is None:
+            return False
+        del self.slots[deadline % self.num_slots][key]
+        return True
+
+    def advance(self, now: float) -> List[Any]:
+        """Move the wheel to the current time.
+
+        Returns:
+            Keys of the expired timers, in the order of their deadlines
+        """
+        target_tick = self._to_tick(now)
+        if target_tick <= self.current_tick:
+            return []
+        expired = []
+        # Visit every slot at most once, even if more than a revolution passed
+        end_tick = min(target_tick, self.current_tick + self.num_slots)
+        for tick in range(self.current_tick + 1, end_tick + 1):
+            slot = self.slots[tick % self.num_slots]
+            if not slot:
+                continue
+            due = [key for key, deadline in slot.items() if deadline <= target_tick]
+            for key in sorted(due, key=slot.get):
+                del slot[key]
+                del self.deadlines[key]
+                expired.append(key)
+        self.current_tick = target_tick
+        return expired
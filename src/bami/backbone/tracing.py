@@ -0,0 +1,169 @@
+"""
+Opt-in tracing of the block lifecycle.
+
+Every traced block starts when it is created or received. The time until each later stage
+is added to a latency histogram of the community chain of the block.
+"""
+from binascii import hexlify
+from bisect import bisect_left
+from collections import defaultdict, OrderedDict
+from enum import Enum
+import logging
+import time
+from typing import Dict, Iterable, Optional
+
+from bami.backbone.utils import Dot
+
+
+class BlockStage(Enum):
+    # Start of the lifecycle of own and of received blocks
+    CREATED = 1
+    RECEIVED = 2
+    # Block invariants are valid
+    VERIFIED = 3
+    # Block is written to the block store
+    PERSISTED = 4
+    # Block and all its links are in the chain
+    CONSISTENT = 5
+    # Block is processed by the in-order subscribers
+    DELIVERED = 6
+    # Counter-party confirmed the block
+    CONFIRMED = 7
+
+
+class LatencyHistogram(object):
+    """Latencies in exponential buckets from 0.1 ms to about 100 s"""
+
+    bounds = tuple(0.0001 * 2 ** i for i in range(21))
+
+    def __init__(self) -> None:
+        # The last bucket holds the latencies above the last bound
+        self.buckets = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, latency: float) -> None:
+        self.buckets[bisect_left(self.bounds, latency)] += 1
+        self.count += 1
+        self.total += latency
+        self.max = max(self.max, latency)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, rank: float) -> float:
+        """Upper bound of the bucket with the percentile, the maximum for the last bucket"""
+        if not self.count:
+            return 0.0
+        target = rank * self.count / 100
+        seen = 0
+        for i, num in enumerate(self.buckets):
+            seen += num
+            if seen >= target and num:
+                return (
+                    min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+                )
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "max": self.max,
+        }
+
+
+class BlockTracer(object):
+    """Timestamps of the block stages aggregated into per-chain latency histograms"""
+
+    def __init__(self, max_blocks: int = 10000) -> None:
+        """
+        Args:
+            max_blocks: number of blocks traced at once, the oldest blocks are dropped first
+        """
+        self.max_blocks = max_blocks
+        # (chain_id, dot) -> start time of the block
+        self.started = OrderedDict()
+        # chain_id -> stage -> latency since the start of the block
+        self.histograms = defaultdict(dict)
+
+    def start(
+        self, chain_id: bytes, dot: Dot, stage: BlockStage, now: float = None
+    ) -> None:
+        """Start tracing the block. A block that is already traced keeps its start."""
+        key = (chain_id, Dot(dot))
+        if key in self.started:
+            return
+        if len(self.started) >= self.max_blocks:
+            self.started.popitem(last=False)
+        self.started[key] = now if now is not None else time.time()
+        self._histogram(chain_id, stage).add(0.0)
+
+    def record(
+        self,
+        chain_id: bytes,
+        dot: Dot,
+        stage: BlockStage,
+        now: float = None,
+        final: bool = False,
+    ) -> None:
+        """Record the stage of a traced block. Blocks that are not traced are ignored.
+
+        Args:
+            final: stop tracing the block after this stage
+        """
+        key = (chain_id, Dot(dot))
+        start_time = self.started.pop(key, None) if final else self.started.get(key)
+        if start_time is None:
+            return
+        now = now if now is not None else time.time()
+        self._histogram(chain_id, stage).add(max(0.0, now - start_time))
+
+    def record_many(
+        self, chain_id: bytes, dots: Iterable[Dot], stage: BlockStage
+    ) -> None:
+        now = time.time()
+        for dot in dots:
+            self.record(chain_id, dot, stage, now)
+
+    def _histogram(self, chain_id: bytes, stage: BlockStage) -> LatencyHistogram:
+        stages = self.histograms[chain_id]
+        if stage not in stages:
+            stages[stage] = LatencyHistogram()
+        return stages[stage]
+
+    def get_histograms(self, chain_id: bytes) -> Dict[BlockStage, LatencyHistogram]:
+        """Histograms of the time since the start of the blocks, by stage"""
+        return dict(self.histograms.get(chain_id, {}))
+
+    def report(self) -> Dict[bytes, Dict[str, Dict[str, float]]]:
+        """Summaries of the histograms by chain and stage name"""
+        return {
+            chain_id: {
+                stage.name: hist.summary()
+                for stage, hist in sorted(stages.items(), key=lambda x: x[0].value)
+            }
+            for chain_id, stages in self.histograms.items()
+        }
+
+    def dump(self, logger: Optional[logging.Logger] = None) -> None:
+        """Log the summaries, one line per chain and stage"""
+        logger = logger or logging.getLogger(self.__class__.__name__)
+        for chain_id, stages in self.report().items():
+            for stage, summary in stages.items():
+                logger.info(
+                    "Chain %s %s: count %d, ms mean %.1f p50 %.1f p90 %.1f p99 %.1f max %.1f",
+                    hexlify(chain_id)[-8:].decode(),
+                    stage,
+                    summary["count"],
+                    summary["mean"] * 1000,
+                    summary["p50"] * 1000,
+                    summary["p90"] * 1000,
+                    summary["p99"] * 1000,
+                    summary["max"] * 1000,
+                )
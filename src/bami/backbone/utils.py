@@ -1,11 +1,16 @@
 from binascii import hexlify
+from collections import deque
+from collections.abc import Mapping
 from hashlib import sha256
 from itertools import chain
-from typing import Any, Callable, NewType, Set, Tuple
+import sys
+import types
+from typing import Any, Callable, Dict, NewType, Set, Tuple
 
 from msgpack import dumps, loads
 
 KEY_LEN = 8
+SEQ_NUM_LEN = 8
 ShortKey = NewType("ShortKey", bytes)
 BytesLinks = NewType("BytesLinks", bytes)
 Dot = NewType("Dot", Tuple[int, ShortKey])
@@ -22,6 +27,7 @@ ANY_COUNTERPARTY_PK = EMPTY_PK
 
 WITNESS_TYPE = b"witness"
 CONFIRM_TYPE = b"confirm"
+CONFIRM_BATCH_TYPE = b"confirm_batch"
 REJECT_TYPE = b"reject"
 
 
@@ -79,6 +85,41 @@ def decode_raw(byte_raw: bytes) -> Any:
     return loads(byte_raw, strict_map_key=False, use_list=False)
 
 
+def encode_seq_key(chain_id: bytes, seq_num: int) -> bytes:
+    """Encode the chain id with a fixed-width big-endian sequence number.
+    Keys of one chain sort in the order of sequence numbers.
+    """
+    return chain_id + seq_num.to_bytes(SEQ_NUM_LEN, "big")
+
+
+def encode_dot_key(chain_id: bytes, dot: Dot) -> bytes:
+    """Encode the dot of the chain to an order-preserving key: chain_id | seq_num | short hash
+
+    Args:
+        chain_id: id of the chain
+        dot: tuple of sequence number and short hash
+
+    Returns:
+        Key in bytes
+    """
+    return encode_seq_key(chain_id, dot[0]) + dot[1]
+
+
+def decode_dot_key(dot_key: bytes, chain_id_len: int) -> Tuple[bytes, Dot]:
+    """Decode the key of a dot into the chain id and the dot
+
+    Args:
+        dot_key: key encoded with `encode_dot_key`
+        chain_id_len: length of the chain id in bytes
+
+    Returns:
+        Tuple with chain id and dot
+    """
+    seq_end = chain_id_len + SEQ_NUM_LEN
+    seq_num = int.from_bytes(dot_key[chain_id_len:seq_end], "big")
+    return dot_key[:chain_id_len], Dot((seq_num, ShortKey(dot_key[seq_end:])))
+
+
 def encode_links(link_val: Links) -> BytesLinks:
     """Encode to the sendable packet
     Args:
@@ -135,6 +176,50 @@ def ranges(nums: Set[int]) -> Ranges:
     return Ranges(tuple(zip(edges, edges)))
 
 
+# Objects that are not data held by a structure
+_NOT_DATA = (
+    type,
+    types.ModuleType,
+    types.FunctionType,
+    types.MethodType,
+    types.BuiltinFunctionType,
+)
+
+
+def deep_sizeof(obj: Any, seen: Set[int] = None) -> int:
+    """Estimate of the bytes of the object and of the objects it holds. An object held twice is counted once.
+
+    Args:
+        seen: ids of the objects already counted
+    """
+    seen = set() if seen is None else seen
+    if id(obj) in seen or isinstance(obj, _NOT_DATA):
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (bytes, str, int, float)):
+        return size
+    if isinstance(obj, Mapping):
+        size += sum(
+            deep_sizeof(key, seen) + deep_sizeof(val, seen) for key, val in obj.items()
+        )
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    if hasattr(obj, "__dict__"):
+        # Attributes of the objects, e.g. the internal dicts of a cache
+        size += deep_sizeof(vars(obj), seen)
+    return size
+
+
+def memory_usage(entries: int, *structures: Any) -> Dict[str, int]:
+    """Entry of a memory report: number of entries and estimated bytes of the structures"""
+    seen = set()
+    return {
+        "entries": entries,
+        "bytes": sum(deep_sizeof(structure, seen) for structure in structures),
+    }
+
+
 class Notifier(object):
     def __init__(self):
         self.observers = {}
@@ -1,26 +1,600 @@
-# src/project_name/console.py
-import textwrap
+"""
+Command line interface to run payment nodes and load test them on one host.
+
+Example, the first node mints and both nodes spend in its community:
+    console node --port 8090 --work-dir /tmp/node1
+    console node --port 8091 --work-dir /tmp/node2 --peer 127.0.0.1:8090 --community <key of node1>
+"""
+from asyncio import get_event_loop, sleep
+from binascii import hexlify, unhexlify
+import logging
+import os
+import random
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
 
 import click
 
+from bami.backbone.block import BamiBlock
+from bami.backbone.datastore.block_store import BaseBlockStore
+from bami.backbone.loop_monitor import LoopMonitor
+from bami.backbone.profiling import HandlerProfiler
+from bami.backbone.settings import BlockStoreType
+from bami.backbone.sub_community import (
+    IPv8SubCommunityFactory,
+    RandomWalkDiscoveryStrategy,
+)
+from bami.backbone.utils import (
+    CONFIRM_BATCH_TYPE,
+    CONFIRM_TYPE,
+    decode_raw,
+    Dot,
+)
+from bami.payment.community import PaymentCommunity
+from bami.payment.settings import PaymentSettings
+from bami.payment.utils import SPEND_TYPE
+from bami.simulation.replay import create_replay_node, replay
+from ipv8.configuration import get_default_configuration
+from ipv8.keyvault.crypto import default_eccrypto
+from ipv8.keyvault.keys import Key
+from ipv8_service import IPv8
+
 from . import __version__
 
+PERCENTILES = (50, 90, 99)
 
-@click.command()
-@click.option(
-    "--language",
-    "-l",
-    default="en",
-    help="Language of Wikipedia page",
-    metavar="LANG",
+
+class LoadPaymentCommunity(
+    IPv8SubCommunityFactory, RandomWalkDiscoveryStrategy, PaymentCommunity
+):
+    pass
+
+
+def percentiles(
+    values: Sequence[float], ranks: Iterable[int] = PERCENTILES
+) -> Dict[int, float]:
+    """Nearest-rank percentiles of the values, 0 for every rank if there are no values"""
+    ordered = sorted(values)
+    if not ordered:
+        return {rank: 0.0 for rank in ranks}
+    return {
+        rank: ordered[max(0, min(len(ordered), -(-rank * len(ordered) // 100)) - 1)]
+        for rank in ranks
+    }
+
+
+def parse_address(address: str) -> Tuple[str, int]:
+    """Parse host:port. Raises click.BadParameter if malformed."""
+    host, _, port = address.rpartition(":")
+    if not host or not port.isdigit():
+        raise click.BadParameter("expected host:port, got {}".format(address))
+    return host, int(port)
+
+
+def store_stats(block_store: BaseBlockStore) -> Dict[str, int]:
+    """Entries and size of the LMDB environment of the store, empty for other stores"""
+    env = getattr(block_store, "env", None)
+    if env is None:
+        return {}
+    info = env.info()
+    entries = 0
+    with env.begin() as txn:
+        # Keys of the main database are the names of the named databases
+        for name, _ in txn.cursor():
+            entries += txn.stat(env.open_db(name, txn=txn, create=False))["entries"]
+    return {
+        "entries": entries,
+        "used_bytes": (info["last_pgno"] + 1) * env.stat()["psize"],
+        "map_size": info["map_size"],
+        "readers": info["num_readers"],
+    }
+
+
+class LoadGenerator(object):
+    """Mint and spend workload in one community, tracks the confirmation latency of the own spends"""
+
+    def __init__(
+        self,
+        overlay: PaymentCommunity,
+        community_id: bytes,
+        spend_value: int,
+        mint_value: int,
+    ) -> None:
+        self.overlay = overlay
+        self.community_id = community_id
+        self.spend_value = overlay.to_amount(spend_value)
+        self.mint_value = overlay.to_amount(mint_value)
+        # Spend dot -> creation time of the spend
+        self.pending = dict()
+        # Confirmation latencies of the current report interval and of the whole run
+        self.latencies = []
+        self.all_latencies = []
+        self.created = 0
+        self.confirmed = 0
+        self.skipped = 0
+        overlay.subscribe_in_order_block(community_id, self.received_block)
+
+    @property
+    def can_mint(self) -> bool:
+        minters = self.overlay.state_db.known_chain_minters(self.community_id)
+        return bool(minters) and self.overlay.my_pub_key_bin in minters
+
+    def counter_parties(self) -> List[bytes]:
+        subcom = self.overlay.get_subcom(self.community_id)
+        if not subcom:
+            return []
+        return [peer.public_key.key_to_bin() for peer in subcom.get_known_peers()]
+
+    def step(self) -> bool:
+        """Create one spend to a random peer of the community, minting first if needed.
+
+        Returns:
+            False if the spend was skipped for a lack of balance or counter-parties
+        """
+        counter_parties = self.counter_parties()
+        if not counter_parties:
+            self.skipped += 1
+            return False
+        state = self.overlay.state_db
+        my_key = self.overlay.my_pub_key_bin
+        if state.get_balance(my_key) < self.spend_value:
+            if not self.can_mint:
+                self.skipped += 1
+                return False
+            self.overlay.mint(value=self.mint_value, chain_id=self.community_id)
+        counter_party = random.choice(counter_parties)
+        # Spend values are cumulative per counter-party, the balance is checked above
+        self.overlay.spend(
+            self.community_id,
+            counter_party,
+            state.get_spend_value(my_key, counter_party) + self.spend_value,
+            ignore_validation=True,
+        )
+        self.created += 1
+        return True
+
+    def received_block(self, block: BamiBlock) -> None:
+        if block.type == SPEND_TYPE:
+            if block.public_key == self.overlay.my_pub_key_bin:
+                self.pending[block.com_dot] = block.timestamp / 1000
+        elif block.type in (CONFIRM_TYPE, CONFIRM_BATCH_TYPE):
+            tx = decode_raw(block.transaction)
+            confirm_txs = tx[b"confirms"] if block.type == CONFIRM_BATCH_TYPE else [tx]
+            for confirm_tx in confirm_txs:
+                if confirm_tx[b"initiator"] == self.overlay.my_pub_key_bin:
+                    self.confirmed_spend(Dot(confirm_tx[b"dot"]), time.time())
+
+    def confirmed_spend(self, spend_dot: Dot, now: float) -> None:
+        created_time = self.pending.pop(spend_dot, None)
+        if created_time is None:
+            return
+        self.confirmed += 1
+        self.latencies.append(now - created_time)
+        self.all_latencies.append(now - created_time)
+
+    def report(self, elapsed: float, interval: float, last_confirmed: int) -> str:
+        """Report line of the interval, resets the interval latencies"""
+        lat = percentiles(self.latencies)
+        self.latencies = []
+        line = (
+            "[{:7.1f}s] {:7.1f} tx/s | created {} confirmed {} pending {} skipped {} | "
+            "latency ms p50 {:.0f} p90 {:.0f} p99 {:.0f} | peers {}".format(
+                elapsed,
+                (self.confirmed - last_confirmed) / interval if interval else 0.0,
+                self.created,
+                self.confirmed,
+                len(self.pending),
+                self.skipped,
+                lat[50] * 1000,
+                lat[90] * 1000,
+                lat[99] * 1000,
+                len(self.counter_parties()),
+            )
+        )
+        stats = store_stats(self.overlay.persistence.block_store)
+        if stats:
+            line += " | lmdb entries {} used {:.1f} MiB readers {}".format(
+                stats["entries"], stats["used_bytes"] / 2 ** 20, stats["readers"]
+            )
+        return line
+
+    def summary(self, elapsed: float) -> str:
+        lat = percentiles(self.all_latencies)
+        return (
+            "total {:.1f}s: created {} confirmed {} ({:.1f} tx/s) skipped {} | "
+            "latency ms p50 {:.0f} p90 {:.0f} p99 {:.0f}".format(
+                elapsed,
+                self.created,
+                self.confirmed,
+                self.confirmed / elapsed if elapsed else 0.0,
+                self.skipped,
+                lat[50] * 1000,
+                lat[90] * 1000,
+                lat[99] * 1000,
+            )
+        )
+
+    async def run(self, tps: float, duration: float, report_interval: float) -> None:
+        """Create spends at the target rate and report every interval. Runs forever if duration is 0."""
+        loop = get_event_loop()
+        start = next_step = next_report = loop.time()
+        next_report += report_interval
+        last_confirmed = 0
+        while not duration or loop.time() - start < duration:
+            if tps:
+                self.step()
+                next_step += 1 / tps
+            else:
+                next_step += report_interval
+            now = loop.time()
+            if now >= next_report:
+                click.echo(self.report(now - start, report_interval, last_confirmed))
+                last_confirmed = self.confirmed
+                next_report += report_interval
+            await sleep(max(0.0, min(next_step, next_report) - now))
+        click.echo(self.summary(loop.time() - start))
+
+
+def ipv8_configuration(work_dir: str, port: int, settings: PaymentSettings) -> Dict:
+    """Configuration of an IPv8 instance on the loopback interface that runs only the payment community"""
+    config = get_default_configuration()
+    config["address"] = "127.0.0.1"
+    config["port"] = port
+    config["working_directory"] = work_dir
+    config["logger"] = {"level": "WARNING"}
+    config["keys"] = [
+        {
+            "alias": "bami",
+            "generation": "curve25519",
+            "file": os.path.join(work_dir, "ec.pem"),
+        }
+    ]
+    config["overlays"] = [
+        {
+            "class": LoadPaymentCommunity.__name__,
+            "key": "bami",
+            "walkers": [
+                {"strategy": "RandomWalk", "peers": 20, "init": {"timeout": 3.0}}
+            ],
+            "initialize": {"work_dir": work_dir, "settings": settings},
+            "on_start": [],
+        }
+    ]
+    return config
+
+
+def echo_profile(profiler: HandlerProfiler, num: int) -> None:
+    """Print the handlers by the total time and the cProfile statistics of the top ones"""
+    click.echo(
+        "{:<30} {:>7} {:>11} {:>11} {:>10}".format(
+            "handler", "calls", "total (s)", "mean (ms)", "max (ms)"
+        )
+    )
+    handlers = [item for item in profiler.report().items() if item[1]["calls"]]
+    for name, summary in handlers[:num]:
+        click.echo(
+            "{:<30} {:>7} {:>11.4f} {:>11.3f} {:>10.3f}".format(
+                name,
+                summary["calls"],
+                summary["total"],
+                summary["mean"] * 1000,
+                summary["max"] * 1000,
+            )
+        )
+    for name in profiler.top(profiler.top_handlers):
+        profile = profiler.format_profile(name)
+        if profile:
+            click.echo("profile of {}".format(name))
+            if profiler.capture_memory:
+                click.echo("{} bytes allocated".format(profiler.stats[name].allocated))
+            click.echo(profile)
+
+
+def echo_loop_lag(monitor: LoopMonitor, num: int = 5) -> None:
+    """Print the event loop lag and the worst spikes"""
+    lag = monitor.lag.summary()
+    click.echo(
+        "loop lag mean {:.1f} ms p99 {:.1f} ms max {:.1f} ms, {} spikes".format(
+            lag["mean"] * 1000, lag["p99"] * 1000, lag["max"] * 1000, monitor.num_spikes
+        )
+    )
+    for spike in sorted(monitor.spikes, key=lambda s: s.lag, reverse=True)[:num]:
+        click.echo(
+            "  {:.1f} ms: {} | tasks {}".format(
+                spike.lag * 1000,
+                ", ".join(
+                    "{} x{} {:.1f} ms".format(name, calls, busy * 1000)
+                    for name, calls, busy in spike.handlers
+                ),
+                ", ".join(
+                    "{} {}".format(*item) for item in sorted(spike.tasks.items())
+                ),
+            )
+        )
+
+
+async def run_node(
+    work_dir: str,
+    port: int,
+    peers: Iterable[Tuple[str, int]],
+    communities: Iterable[bytes],
+    settings: PaymentSettings,
+    tps: float,
+    duration: float,
+    spend_value: int,
+    mint_value: int,
+    report_interval: float,
+    warmup: float,
+) -> None:
+    os.makedirs(work_dir, exist_ok=True)
+    ipv8 = IPv8(
+        ipv8_configuration(work_dir, port, settings),
+        extra_communities={LoadPaymentCommunity.__name__: LoadPaymentCommunity},
+    )
+    await ipv8.start()
+    overlay = ipv8.get_overlay(LoadPaymentCommunity)
+    overlay.ipv8 = ipv8
+    try:
+        click.echo(
+            "node {} on 127.0.0.1:{}".format(
+                hexlify(overlay.my_pub_key_bin).decode(), port
+            )
+        )
+        for address in peers:
+            overlay.walk_to(address)
+        communities = list(communities) or [overlay.my_pub_key_bin]
+        overlay.subscribe_to_subcoms(communities)
+        # Time to discover the peers of the communities
+        await sleep(warmup)
+        generator = LoadGenerator(overlay, communities[0], spend_value, mint_value)
+        await generator.run(tps, duration, report_interval)
+        if overlay.settings.handler_profiling:
+            echo_profile(overlay.profiler, 20)
+        if overlay.loop_monitor:
+            echo_loop_lag(overlay.loop_monitor)
+    finally:
+        await ipv8.stop(stop_loop=False)
+
+
+async def run_replay(
+    log_file: str,
+    work_dir: str,
+    key: Optional[Key],
+    settings: PaymentSettings,
+    speed: float,
+    settle: float,
+) -> None:
+    node = create_replay_node(LoadPaymentCommunity, work_dir, key, settings)
+    try:
+        report = await replay(node.overlay, log_file, speed)
+        # Queued frontiers and block requests are processed after the last packet
+        await sleep(settle)
+        click.echo(
+            "replayed {} packets and {} subscriptions in {:.2f}s ({:.0f} packets/s), "
+            "recorded in {:.2f}s".format(
+                report.packets,
+                report.subscriptions,
+                report.replay_time,
+                report.packets_per_second,
+                report.recorded_time,
+            )
+        )
+        for name, value in node.overlay.metrics.snapshot().items():
+            if isinstance(value, dict):
+                value = "count {count} mean {mean:.6f} p50 {p50:.6f} p99 {p99:.6f}".format(
+                    **value
+                )
+            click.echo("{} {}".format(name, value))
+        if node.overlay.settings.handler_profiling:
+            echo_profile(node.overlay.profiler, 20)
+        if node.overlay.loop_monitor:
+            echo_loop_lag(node.overlay.loop_monitor)
+    finally:
+        await node.unload()
+
+
+store_option = click.option(
+    "--store",
+    type=click.Choice([t.name for t in BlockStoreType], case_sensitive=False),
+    default=BlockStoreType.LMDB.name,
     show_default=True,
+    help="Block store layout",
+)
+
+profile_option = click.option(
+    "--profile",
+    default=0,
+    metavar="TOP",
+    help="Time the message handlers and the tasks, "
+    "and profile the TOP slowest handlers with cProfile",
+)
+profile_memory_option = click.option(
+    "--profile-memory",
+    is_flag=True,
+    help="Trace the allocations of the profiled handlers, slows down the node",
+)
+
+monitor_loop_option = click.option(
+    "--monitor-loop",
+    is_flag=True,
+    help="Measure the event loop lag and report the handlers and tasks of the spikes",
 )
+
+
+def enable_profiling(settings: PaymentSettings, top: int, memory: bool) -> None:
+    settings.handler_profiling = True
+    settings.profiling_top_handlers = top
+    settings.profiling_memory = memory
+
+
+@click.group()
 @click.version_option(version=__version__)
-def main(language: str) -> None:
-    """Output extract from a random page with a language
-
-    Args:
-        language: Wikipedia page language, default 'en'.
-    """
-    click.secho("Title", fg="green")
-    click.echo(textwrap.fill("Extract"))
+def main() -> None:
+    """Run and load test payment nodes"""
+
+
+@main.command()
+@click.option(
+    "--work-dir", "-d", default="bami_node", show_default=True, help="Node directory"
+)
+@click.option("--port", "-p", default=8090, show_default=True, help="UDP port")
+@click.option(
+    "--peer",
+    "peers",
+    multiple=True,
+    metavar="HOST:PORT",
+    help="Bootstrap peer, can be repeated",
+)
+@click.option(
+    "--community",
+    "communities",
+    multiple=True,
+    metavar="HEX",
+    help="Community to join, can be repeated. The workload runs in the first one. "
+    "Own community by default",
+)
+@click.option(
+    "--tps",
+    default=10.0,
+    show_default=True,
+    help="Target spends per second, 0 to only serve",
+)
+@click.option(
+    "--duration",
+    default=60.0,
+    show_default=True,
+    help="Seconds to run, 0 to run forever",
+)
+@click.option("--spend-value", default=1, show_default=True, help="Value of a spend")
+@click.option(
+    "--mint-value",
+    default=50,
+    show_default=True,
+    help="Value of a mint when the balance runs out",
+)
+@click.option(
+    "--report-interval", default=5.0, show_default=True, help="Seconds between reports"
+)
+@click.option(
+    "--warmup", default=5.0, show_default=True, help="Seconds to discover peers"
+)
+@store_option
+@click.option(
+    "--record",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Record the inbound packets to the file, for the replay command",
+)
+@profile_option
+@profile_memory_option
+@monitor_loop_option
+def node(
+    work_dir: str,
+    port: int,
+    peers: Tuple[str],
+    communities: Tuple[str],
+    tps: float,
+    duration: float,
+    spend_value: int,
+    mint_value: int,
+    report_interval: float,
+    warmup: float,
+    store: str,
+    record: str,
+    profile: int,
+    profile_memory: bool,
+    monitor_loop: bool,
+) -> None:
+    """Run a payment node with a mint and spend workload"""
+    if spend_value > mint_value:
+        raise click.BadParameter(
+            "must not exceed the mint value", param_hint="--spend-value"
+        )
+    addresses = [parse_address(peer) for peer in peers]
+    try:
+        community_ids = [unhexlify(community) for community in communities]
+    except ValueError:
+        raise click.BadParameter("community must be hex", param_hint="--community")
+    settings = PaymentSettings()
+    settings.block_store_type = BlockStoreType[store.upper()]
+    if record:
+        settings.record_file = record
+    if profile:
+        enable_profiling(settings, profile, profile_memory)
+    settings.loop_monitoring = monitor_loop
+    logging.basicConfig(level=logging.WARNING)
+    get_event_loop().run_until_complete(
+        run_node(
+            work_dir,
+            port,
+            addresses,
+            community_ids,
+            settings,
+            tps,
+            duration,
+            spend_value,
+            mint_value,
+            report_interval,
+            warmup,
+        )
+    )
+
+
+@main.command(name="replay")
+@click.argument("log_file", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--work-dir",
+    "-d",
+    default="bami_replay",
+    show_default=True,
+    help="Directory of the fresh node",
+)
+@click.option(
+    "--key-file",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Private key of the recorded node, ec.pem in its work dir",
+)
+@click.option(
+    "--speed",
+    default=0.0,
+    show_default=True,
+    help="1 for the recorded pace, 0 for as fast as possible",
+)
+@click.option(
+    "--settle",
+    default=1.0,
+    show_default=True,
+    help="Seconds to run after the last packet",
+)
+@store_option
+@profile_option
+@profile_memory_option
+@monitor_loop_option
+def replay_command(
+    log_file: str,
+    work_dir: str,
+    key_file: Optional[str],
+    speed: float,
+    settle: float,
+    store: str,
+    profile: int,
+    profile_memory: bool,
+    monitor_loop: bool,
+) -> None:
+    """Replay the recorded packets into a fresh node and print its metrics"""
+    key = None
+    if key_file:
+        with open(key_file, "rb") as f:
+            key = default_eccrypto.key_from_private_bin(f.read())
+    settings = PaymentSettings()
+    settings.block_store_type = BlockStoreType[store.upper()]
+    settings.metrics_enabled = True
+    # Replays of the same log start from the same state
+    settings.snapshot_interval = 0
+    if profile:
+        enable_profiling(settings, profile, profile_memory)
+    settings.loop_monitoring = monitor_loop
+    os.makedirs(work_dir, exist_ok=True)
+    logging.basicConfig(level=logging.WARNING)
+    get_event_loop().run_until_complete(
+        run_replay(log_file, work_dir, key, settings, speed, settle)
+    )
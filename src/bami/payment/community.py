@@ -1,16 +1,22 @@
 from __future__ import annotations
 
 from abc import ABCMeta
-from asyncio import ensure_future, PriorityQueue, sleep
+from asyncio import get_event_loop
+from bisect import bisect_left, insort
 from collections import defaultdict
 from decimal import Decimal
+from math import ceil
+import os
 from random import Random
-from typing import Any, Dict, Optional, Tuple
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
 
 from bami.backbone.block import BamiBlock
 from bami.backbone.community import BamiCommunity, BlockResponse
 from bami.backbone.exceptions import InvalidTransactionFormatException
+from bami.backbone.timer_wheel import TimerWheel
+from bami.backbone.tracing import BlockStage
 from bami.backbone.utils import (
+    CONFIRM_BATCH_TYPE,
     CONFIRM_TYPE,
     decode_raw,
     Dot,
@@ -18,11 +24,11 @@ from bami.backbone.utils import (
     hex_to_int,
     REJECT_TYPE,
     shorten,
-    take_hash,
     WITNESS_TYPE,
 )
-from bami.payment.database import ChainState, PaymentState
+from bami.payment.database import ChainState, chain_state_hash, PaymentState
 from bami.payment.exceptions import (
+    InconsistentStateHashException,
     InsufficientBalanceException,
     InvalidMintRangeException,
     InvalidSpendRangeException,
@@ -31,8 +37,15 @@ from bami.payment.exceptions import (
     UnknownMinterException,
 )
 from bami.payment.settings import PaymentSettings
-from bami.payment.utils import MINT_TYPE, SPEND_TYPE
-import cachetools
+from bami.payment.snapshot import read_snapshot, write_snapshot
+from bami.payment.utils import (
+    Amount,
+    MINT_TYPE,
+    MULTI_SPEND_TYPE,
+    SPEND_TYPE,
+    to_minor_units,
+)
+from msgpack.exceptions import ExtraData, UnpackException
 
 """
 Exchange of the value within one community, where value lives only in one community.
@@ -55,20 +68,39 @@ class PaymentCommunity(BamiCommunity, metaclass=ABCMeta):
         # Add state db
         if not kwargs.get("settings"):
             self._settings = PaymentSettings()
-        self.state_db = PaymentState(self._settings.asset_precision)
+        self.state_db = PaymentState(
+            self._settings.asset_precision,
+            self._settings.max_status_checkpoints,
+            self._settings.minor_unit_amounts,
+            self._settings.max_pinned_status_checkpoints,
+        )
 
         self.context = self.state_db.context
 
-        self.reachability_cache = defaultdict(lambda: cachetools.LRUCache(100))
+        # Last applied sequence number of the chains, stored with the state snapshots
+        self.chain_seq_nums = dict()
+        self.blocks_since_snapshot = 0
+        self.snapshot_seq_nums = self.load_snapshot()
 
         # Dictionary chain_id: block_dot -> block
         self.tracked_blocks = defaultdict(lambda: {})
+        # Sorted dots of the tracked blocks per chain, to find blocks affected by a status update
+        self.waiting_dots = defaultdict(list)
+        # Tracked blocks to evaluate on the next loop iteration: (chain_id, block_dot)
+        self.blocks_to_evaluate = set()
         self.peer_conf = defaultdict(lambda: defaultdict(int))
         self.should_witness_subcom = {}
 
-        self.counter_signing_block_queue = PriorityQueue()
-        self.block_sign_queue_task = ensure_future(
-            self.evaluate_counter_signing_blocks()
+        # Blocks waiting for too long are rejected
+        tick = self.settings.block_sign_delta
+        self.wait_timers = TimerWheel(
+            tick, ceil(self.settings.max_wait_time / tick) + 1, get_event_loop().time()
+        )
+        self.register_task(
+            "expire_waiting_blocks",
+            self.expire_waiting_blocks,
+            delay=tick,
+            interval=tick,
         )
 
         self.witness_delta = kwargs.get("witness_delta")
@@ -88,6 +120,12 @@ class PaymentCommunity(BamiCommunity, metaclass=ABCMeta):
         self.start_gossip_sync(sub_com_id)
         # - Process incoming blocks on the chain in order for payments
         self.subscribe_in_order_block(sub_com_id, self.receive_block_in_order)
+        # - Blocks already stored are processed again, up to the snapshot they are skipped
+        self.persistence.restore_chain(
+            sub_com_id, lambda blob: BamiBlock.unpack(blob, self.serializer)
+        )
+        # - Blocks delivered from now on are new, even if they are below the snapshot
+        self.snapshot_seq_nums.pop(sub_com_id, None)
 
         # 2. Witness chain:
         # - Gossip witness updates on the sub-chain
@@ -98,22 +136,33 @@ class PaymentCommunity(BamiCommunity, metaclass=ABCMeta):
         self.should_witness_subcom[sub_com_id] = self.settings.should_witness_block
 
     def receive_block_in_order(self, block: BamiBlock) -> None:
-        if block.com_dot in self.state_db.applied_dots:
-            raise Exception(
-                "Block already applied?",
-                block.com_dot,
-                self.state_db.vals_cache,
-                self.state_db.peer_mints,
-                self.state_db.applied_dots,
-            )
         chain_id = block.com_id
         dot = block.com_dot
-        self.state_db.applied_dots.add(dot)
+        applied_dots = self.state_db.applied_dots
+        if applied_dots.contains(chain_id, dot):
+            if block.com_seq_num <= self.snapshot_seq_nums.get(chain_id, 0):
+                # Applied before the snapshot was taken
+                return
+            if not applied_dots.is_retired(chain_id, dot):
+                raise Exception(
+                    "Block already applied?",
+                    dot,
+                    self.state_db.vals_cache,
+                    self.state_db.peer_mints,
+                    applied_dots,
+                )
+            # The chain delivers every block once: the block is concurrent to the compacted prefix
+            self.logger.debug(
+                "Applying block %s below the compacted chain %s", dot, chain_id
+            )
+        applied_dots.add(chain_id, dot)
 
         # Check reachability for target block -> update risk
-        for blk_dot in self.tracked_blocks[chain_id]:
-            if self.dot_reachable(chain_id, blk_dot, dot):
-                self.update_risk(chain_id, block.public_key, blk_dot[0])
+        if self.tracked_blocks[chain_id]:
+            chain = self.persistence.get_chain(chain_id)
+            for blk_dot in self.tracked_blocks[chain_id]:
+                if chain.is_reachable(blk_dot, dot):
+                    self.update_risk(chain_id, block.public_key, blk_dot[0])
 
         # Process blocks according to their type
         self.logger.debug(
@@ -123,12 +172,24 @@ class PaymentCommunity(BamiCommunity, metaclass=ABCMeta):
             self.process_mint(block)
         elif block.type == SPEND_TYPE:
             self.process_spend(block)
+        elif block.type == MULTI_SPEND_TYPE:
+            self.process_multi_spend(block)
         elif block.type == CONFIRM_TYPE:
             self.process_confirm(block)
+        elif block.type == CONFIRM_BATCH_TYPE:
+            self.process_confirm_batch(block)
         elif block.type == REJECT_TYPE:
             self.process_reject(block)
         elif block.type == WITNESS_TYPE:
             raise Exception("Witness block received, while shouldn't")
+        if self.should_store_store_update(chain_id, block.com_seq_num):
+            self.chain_status_updated(chain_id, block.com_seq_num)
+        self.chain_seq_nums[chain_id] = max(
+            self.chain_seq_nums.get(chain_id, 0), block.com_seq_num
+        )
+        self.blocks_since_snapshot += 1
+        if 0 < self.settings.snapshot_interval <= self.blocks_since_snapshot:
+            self.save_snapshot()
         # Witness block react on new block:
         if (
             self.should_witness_subcom.get(chain_id)
@@ -139,6 +200,46 @@ class PaymentCommunity(BamiCommunity, metaclass=ABCMeta):
         ):
             self.schedule_witness_block(chain_id, block.com_seq_num)
 
+    # -------------- State snapshots ----------------------
+
+    def load_snapshot(self) -> Dict[bytes, int]:
+        """Load the state snapshot from the work directory, if there is one.
+
+        Returns:
+            Sequence numbers of the chains covered by the snapshot
+        """
+        try:
+            _, chain_seq_nums = read_snapshot(self.work_dir, self.state_db)
+        except (
+            InconsistentStateHashException,
+            ExtraData,
+            UnpackException,
+            ValueError,
+            KeyError,
+            TypeError,
+            AttributeError,
+            OSError,
+        ) as e:
+            self.logger.warning(
+                "Ignoring invalid state snapshot: %s: %s", type(e).__name__, e
+            )
+            # Start from an empty state and apply all blocks
+            self.state_db = PaymentState(
+                self.settings.asset_precision,
+                self.settings.max_status_checkpoints,
+                self.settings.minor_unit_amounts,
+                self.settings.max_pinned_status_checkpoints,
+            )
+            return {}
+        self.chain_seq_nums = dict(chain_seq_nums)
+        return chain_seq_nums
+
+    def save_snapshot(self) -> None:
+        """Write the state snapshot to the work directory"""
+        os.makedirs(self.work_dir, exist_ok=True)
+        write_snapshot(self.work_dir, self.state_db, self.chain_seq_nums)
+        self.blocks_since_snapshot = 0
+
     def process_witness_block(self, blk: BamiBlock) -> None:
         """Process witness block out of order"""
         # No block is processed out of order in this community
@@ -173,6 +274,29 @@ class PaymentCommunity(BamiCommunity, metaclass=ABCMeta):
             return True
         return False
 
+    # -------------- Amounts ----------------------
+
+    def to_amount(self, value: Union[Decimal, float, int]) -> Amount:
+        """Convert value in asset units, e.g. from the settings, to the amount of the state"""
+        if self.state_db.minor_units:
+            return to_minor_units(value, self.settings.minor_unit_decimals)
+        return Decimal(value, self.context)
+
+    def decode_amount(self, tx_value: Any) -> Amount:
+        """Get amount of the state from the transaction value.
+        With minor unit amounts, transactions carry integers.
+        """
+        if self.state_db.minor_units:
+            if type(tx_value) != int:
+                raise InvalidTransactionFormatException(
+                    "Amount is not in minor units", tx_value
+                )
+            return tx_value
+        return Decimal(tx_value, self.context)
+
+    def encode_amount(self, value: Amount) -> Union[float, int]:
+        return int(value) if self.state_db.minor_units else float(value)
+
     # -------------- Mint transaction ----------------------
 
     def verify_mint(
@@ -203,20 +327,20 @@ class PaymentCommunity(BamiCommunity, metaclass=ABCMeta):
             raise InvalidTransactionFormatException(
                 "Mint transaction badly formatted ", mint_transaction, chain_id, minter
             )
+        value = self.decode_amount(mint_transaction[b"value"])
         # 3. Minting value within the range
         if not (
-            Decimal(self.settings.mint_value_range[0], self.context)
-            < mint_transaction[b"value"]
-            < Decimal(self.settings.mint_value_range[1], self.context)
+            self.to_amount(self.settings.mint_value_range[0])
+            < value
+            < self.to_amount(self.settings.mint_value_range[1])
         ):
             raise InvalidMintRangeException(
                 chain_id, minter, mint_transaction.get(b"value")
             )
         # 4. Total value is bounded
         if not (
-            self.state_db.peer_mints[minter]
-            + Decimal(mint_transaction.get(b"value"), self.context)
-            < Decimal(self.settings.mint_max_value, self.context)
+            self.state_db.peer_mints[minter] + value
+            < self.to_amount(self.settings.mint_max_value)
         ):
             raise UnboundedMintException(
                 chain_id,
@@ -225,17 +349,17 @@ class PaymentCommunity(BamiCommunity, metaclass=ABCMeta):
                 mint_transaction.get(b"value"),
             )
 
-    def mint(self, value: Decimal = None, chain_id: bytes = None) -> None:
+    def mint(self, value: Amount = None, chain_id: bytes = None) -> None:
         """
         Create mint for own reputation: Reputation & Liveness  at Stake
         """
         if not value:
-            value = self.settings.initial_mint_value
+            value = self.to_amount(self.settings.initial_mint_value)
         if not chain_id:
             # Community id is the same as the peer id
             chain_id = self.my_pub_key_bin
         # Mint transaction: value
-        mint_tx = {b"value": float(value)}
+        mint_tx = {b"value": self.encode_amount(value)}
         self.verify_mint(chain_id, self.my_pub_key_bin, mint_tx)
         block = self.create_signed_block(
             block_type=MINT_TYPE, transaction=encode_raw(mint_tx), com_id=chain_id
@@ -257,7 +381,7 @@ class PaymentCommunity(BamiCommunity, metaclass=ABCMeta):
             mint_dot,
             prev_links,
             minter,
-            Decimal(mint_tx.get(b"value"), self.context),
+            self.decode_amount(mint_tx.get(b"value")),
             self.should_store_store_update(chain_id, seq_num),
         )
 
@@ -266,7 +390,7 @@ class PaymentCommunity(BamiCommunity, metaclass=ABCMeta):
         self,
         chain_id: bytes,
         counter_party: bytes,
-        value: Decimal,
+        value: Amount,
         ignore_validation: bool = False,
     ) -> None:
         """
@@ -274,13 +398,13 @@ class PaymentCommunity(BamiCommunity, metaclass=ABCMeta):
         Args:
             chain_id: identity of the chain
             counter_party: identity of the counter-party
-            value: Decimal value to transfer
+            value: amount to transfer, Decimal or integer minor units as in the state
             ignore_validation: if True and balance is negative - will raise an Exception
         """
         bal = self.state_db.get_balance(self.my_pub_key_bin)
         if ignore_validation or bal - value >= 0:
             spend_tx = {
-                b"value": float(value),
+                b"value": self.encode_amount(value),
                 b"to_peer": counter_party,
                 b"prev_pairwise_link": self.state_db.get_last_pairwise_links(
                     self.my_pub_key_bin, counter_party
@@ -298,6 +422,73 @@ class PaymentCommunity(BamiCommunity, metaclass=ABCMeta):
         else:
             raise InsufficientBalanceException("Not enough balance for spend")
 
+    def multi_spend(
+        self,
+        chain_id: bytes,
+        outputs: Iterable[Tuple[bytes, Amount]],
+        ignore_validation: bool = False,
+    ) -> None:
+        """
+        Spend tokens in the chain to many counter-parties with one block.
+        Args:
+            chain_id: identity of the chain
+            outputs: counter-party and amount to transfer to it. Every counter-party appears once.
+            ignore_validation: if True and balance is negative - will raise an Exception
+        """
+        outputs = list(outputs)
+        total = sum(value for _, value in outputs)
+        bal = self.state_db.get_balance(self.my_pub_key_bin)
+        if not ignore_validation and bal - total < 0:
+            raise InsufficientBalanceException("Not enough balance for spend")
+        spend_tx = {
+            b"outputs": [
+                {
+                    b"value": self.encode_amount(value),
+                    b"to_peer": counter_party,
+                    b"prev_pairwise_link": self.state_db.get_last_pairwise_links(
+                        self.my_pub_key_bin, counter_party
+                    ),
+                }
+                for counter_party, value in outputs
+            ]
+        }
+        self.verify_multi_spend(self.my_pub_key_bin, spend_tx)
+        block = self.create_signed_block(
+            block_type=MULTI_SPEND_TYPE,
+            transaction=encode_raw(spend_tx),
+            com_id=chain_id,
+        )
+        self.logger.info("Created multi spend block %s", block.com_dot)
+        counter_peers = [
+            self.get_peer_by_key(counter_party, chain_id)
+            for counter_party, _ in outputs
+        ]
+        counter_peers = [p for p in counter_peers if p]
+        if counter_peers:
+            self.send_block(block, counter_peers)
+        self.share_in_community(block, chain_id)
+
+    def verify_multi_spend(self, spender: bytes, spend_transaction: Dict) -> None:
+        """Verify every output of the multi spend transaction as a spend.
+        Raises:
+            InvalidTransactionFormat if there are no outputs or a counter-party is repeated
+        """
+        outputs = (
+            spend_transaction.get(b"outputs")
+            if type(spend_transaction) == dict
+            else None
+        )
+        if not outputs or any(type(output) != dict for output in outputs):
+            raise InvalidTransactionFormatException(
+                "Multi spend transaction badly formatted ", spender, spend_transaction
+            )
+        for output in outputs:
+            self.verify_spend(spender, output)
+        if len({output[b"to_peer"] for output in outputs}) != len(outputs):
+            raise InvalidTransactionFormatException(
+                "Multi spend with repeated counter-party ", spender, spend_transaction
+            )
+
     def verify_spend(self, spender: bytes, spend_transaction: Dict) -> None:
         """Verify the spend transaction:
             - spend formatted correctly
@@ -315,9 +506,9 @@ class PaymentCommunity(BamiCommunity, metaclass=ABCMeta):
             )
         # 2. Verify the spend value in range
         if not (
-            self.settings.spend_value_range[0]
-            < spend_transaction.get(b"value")
-            < self.settings.spend_value_range[1]
+            self.to_amount(self.settings.spend_value_range[0])
+            < self.decode_amount(spend_transaction.get(b"value"))
+            < self.to_amount(self.settings.spend_value_range[1])
         ):
             raise InvalidSpendRangeException(
                 "Spend value out of range", spender, spend_transaction.get(b"value")
@@ -334,7 +525,7 @@ class PaymentCommunity(BamiCommunity, metaclass=ABCMeta):
         pers_links = spend_block.links
 
         prev_spend_links = spend_tx.get(b"prev_pairwise_link")
-        value = Decimal(spend_tx.get(b"value"), self.context)
+        value = self.decode_amount(spend_tx.get(b"value"))
         to_peer = spend_tx.get(b"to_peer")
         seq_num = spend_dot[0]
 
@@ -353,15 +544,83 @@ class PaymentCommunity(BamiCommunity, metaclass=ABCMeta):
         if to_peer == self.my_pub_key_bin:
             self.add_block_to_response_processing(spend_block)
 
+    def process_multi_spend(self, spend_block: BamiBlock) -> None:
+        spend_tx = decode_raw(spend_block.transaction)
+        spender = spend_block.public_key
+        self.verify_multi_spend(spender, spend_tx)
+
+        chain_id = spend_block.com_id
+        outputs = [
+            (
+                output.get(b"to_peer"),
+                output.get(b"prev_pairwise_link"),
+                self.decode_amount(output.get(b"value")),
+            )
+            for output in spend_tx[b"outputs"]
+        ]
+        self.state_db.apply_multi_spend(
+            chain_id,
+            spend_block.links,
+            spend_block.com_dot,
+            spender,
+            outputs,
+            self.should_store_store_update(chain_id, spend_block.com_dot[0]),
+        )
+
+        # Is this block related to my peer?
+        if any(to_peer == self.my_pub_key_bin for to_peer, _, _ in outputs):
+            self.add_block_to_response_processing(spend_block)
+
     # ------------ Block Response processing ---------
 
     def add_block_to_response_processing(self, block: BamiBlock) -> None:
-        self.tracked_blocks[block.com_id][block.com_dot] = block
+        chain_id = block.com_id
+        self.tracked_blocks[chain_id][block.com_dot] = block
+        insort(self.waiting_dots[chain_id], block.com_dot)
+        self.persistence.get_chain(chain_id).watch_dot(block.com_dot)
+        # Status of the chain at the block is needed until the block is counter-signed
+        self.state_db.pin_status(chain_id, block.com_seq_num)
+        self.wait_timers.schedule(
+            (chain_id, block.com_dot),
+            self.settings.max_wait_time,
+            get_event_loop().time(),
+        )
+        self.schedule_block_evaluation([(chain_id, block.com_dot)])
 
-        self.counter_signing_block_queue.put_nowait((block.com_seq_num, (0, block)))
+    def stop_tracking_block(self, block: BamiBlock) -> None:
+        chain_id = block.com_id
+        self.tracked_blocks[chain_id].pop(block.com_dot, None)
+        waiting = self.waiting_dots[chain_id]
+        i = bisect_left(waiting, block.com_dot)
+        if i < len(waiting) and waiting[i] == block.com_dot:
+            del waiting[i]
+        self.persistence.get_chain(chain_id).unwatch_dot(block.com_dot)
+        self.state_db.unpin_status(chain_id, block.com_seq_num)
+        self.wait_timers.cancel((chain_id, block.com_dot))
+
+    def schedule_block_evaluation(self, block_keys: Iterable[Tuple[bytes, Dot]]):
+        """Evaluate the tracked blocks once the current block is processed"""
+        if not self.blocks_to_evaluate:
+            get_event_loop().call_soon(self.evaluate_counter_signing_blocks)
+        self.blocks_to_evaluate.update(block_keys)
+
+    def chain_status_updated(self, chain_id: bytes, seq_num: int) -> None:
+        """Re-evaluate the tracked blocks that use the chain status stored at seq_num"""
+        waiting = self.waiting_dots.get(chain_id)
+        if not waiting:
+            return
+        # Blocks after the previous status point use this status
+        prev_seq_num = self.state_db.peer_statuses[chain_id].previous_seq_num(seq_num)
+        start = bisect_left(waiting, (prev_seq_num + 1,))
+        end = bisect_left(waiting, (seq_num + 1,))
+        self.schedule_block_evaluation((chain_id, dot) for dot in waiting[start:end])
 
     def process_counter_signing_block(
-        self, block: BamiBlock, time_passed: float = None, num_block_passed: int = None,
+        self,
+        block: BamiBlock,
+        time_passed: float = None,
+        num_block_passed: int = None,
+        confirm_batch: List[BamiBlock] = None,
     ) -> bool:
         """
         Process block that should be counter-signed and return True if the block should be delayed more.
@@ -369,38 +628,85 @@ class PaymentCommunity(BamiCommunity, metaclass=ABCMeta):
             block: Processed block
             time_passed: time passed since first added
             num_block_passed: number of blocks passed since first added
+            confirm_batch: if given, the block is added to it instead of being confirmed immediately
         Returns:
             Should add to queue again.
         """
         res = self.block_response(block, time_passed, num_block_passed)
         if res == BlockResponse.CONFIRM:
-            self.confirm(
-                block,
-                extra_data={b"value": decode_raw(block.transaction).get(b"value")},
-            )
+            if confirm_batch is not None:
+                confirm_batch.append(block)
+            else:
+                self.confirm(block, extra_data=self._confirm_extra_data(block))
             return False
         elif res == BlockResponse.REJECT:
             self.reject(block)
             return False
         return True
 
-    async def evaluate_counter_signing_blocks(self, delta: float = None):
-        while True:
-            _delta = delta if delta else self.settings.block_sign_delta
-            priority, block_info = await self.counter_signing_block_queue.get()
-            process_time, block = block_info
-            should_delay = self.process_counter_signing_block(block, process_time)
+    def _confirm_extra_data(self, block: BamiBlock) -> Dict:
+        spend_tx = decode_raw(block.transaction)
+        if block.type == MULTI_SPEND_TYPE:
+            # Confirm the output to my peer
+            spend_tx = next(
+                output
+                for output in spend_tx[b"outputs"]
+                if output[b"to_peer"] == self.my_pub_key_bin
+            )
+        return {b"value": spend_tx.get(b"value")}
+
+    def confirm_blocks(self, blocks: List[BamiBlock]) -> None:
+        """Confirm the blocks of one chain with batch blocks of at most `confirm_batch_size` confirms"""
+        batch_size = max(self.settings.confirm_batch_size, 1)
+        for i in range(0, len(blocks), batch_size):
+            batch = blocks[i : i + batch_size]
+            if len(batch) == 1:
+                self.confirm(batch[0], extra_data=self._confirm_extra_data(batch[0]))
+            else:
+                self.confirm_batch(
+                    batch, extra_data=[self._confirm_extra_data(b) for b in batch]
+                )
+
+    def evaluate_counter_signing_blocks(self) -> None:
+        block_keys = sorted(self.blocks_to_evaluate, key=lambda k: k[1])
+        self.blocks_to_evaluate.clear()
+        to_confirm = defaultdict(list)
+        for chain_id, block_dot in block_keys:
+            block = self.tracked_blocks[chain_id].get(block_dot)
+            if not block:
+                continue
+            last_claim_dot = self.state_db.get_last_claim_dot(
+                self.my_pub_key_bin, block.public_key
+            )
+            if last_claim_dot >= block_dot:
+                # Reaction is known already, e.g. the chain is restored after a restart
+                self.stop_tracking_block(block)
+                continue
+            should_delay = self.process_counter_signing_block(
+                block, confirm_batch=to_confirm[chain_id]
+            )
             self.logger.debug(
                 "Processing counter signing block. Delayed: %s", should_delay
             )
-            if should_delay:
-                self.counter_signing_block_queue.put_nowait(
-                    (priority, (process_time + _delta, block))
-                )
-                await sleep(_delta)
-            else:
-                self.tracked_blocks[block.com_id].pop(block.com_dot)
-                await sleep(0.001)
+            if not should_delay:
+                self.stop_tracking_block(block)
+        # Blocks confirmed in the same pass share confirm blocks
+        for blocks in to_confirm.values():
+            if blocks:
+                self.confirm_blocks(blocks)
+
+    def expire_waiting_blocks(self) -> None:
+        """Reject the tracked blocks still without the chain status after the maximum wait time.
+
+        Blocks with the status that wait for more diverse peers stay tracked,
+        they are evaluated again on the next risk or status update.
+        """
+        # Timers fire within a tick after the maximum wait time
+        wait_time = self.settings.max_wait_time + self.settings.block_sign_delta
+        for chain_id, block_dot in self.wait_timers.advance(get_event_loop().time()):
+            block = self.tracked_blocks[chain_id].get(block_dot)
+            if block and not self.process_counter_signing_block(block, wait_time):
+                self.stop_tracking_block(block)
 
     def block_response(
         self, block: BamiBlock, wait_time: float = None, wait_blocks: int = None
@@ -433,31 +739,28 @@ class PaymentCommunity(BamiCommunity, metaclass=ABCMeta):
         else:
             return BlockResponse.DELAY
 
-    def dot_reachable(self, chain_id: bytes, target_dot: Dot, block_dot: Dot):
-        val = self.reachability_cache[(chain_id, target_dot)].get(block_dot)
-        if val is not None:
-            return val
-        res = self.persistence.get_chain(chain_id).get_prev_links(block_dot)
-        if target_dot in res:
-            return True
-        if max(res)[0] < target_dot[0]:
-            return False
-        else:
-            # Need to take more step
-            for prev_dot in res:
-                new_val = self.dot_reachable(chain_id, target_dot, prev_dot)
-                if new_val:
-                    self.reachability_cache[(chain_id, target_dot)][block_dot] = True
-                    return True
-            self.reachability_cache[(chain_id, target_dot)][block_dot] = False
-            return False
+    def dot_reachable(self, chain_id: bytes, target_dot: Dot, block_dot: Dot) -> bool:
+        return self.persistence.get_chain(chain_id).is_reachable(target_dot, block_dot)
 
     def update_risk(self, chain_id: bytes, conf_peer_id: bytes, target_seq_num: int):
         print("Risk update: ", shorten(conf_peer_id), target_seq_num)
         self.peer_conf[(chain_id, target_seq_num)][conf_peer_id] += 1
+        waiting = self.waiting_dots.get(chain_id)
+        if waiting:
+            start = bisect_left(waiting, (target_seq_num,))
+            end = bisect_left(waiting, (target_seq_num + 1,))
+            self.schedule_block_evaluation(
+                (chain_id, dot) for dot in waiting[start:end]
+            )
 
     # ----------- Witness transactions --------------
 
+    def task_category(self, name: str) -> str:
+        # Witness tasks are named by the number of the chain and the sequence number
+        if name.isdigit():
+            return "witness"
+        return super().task_category(name)
+
     def schedule_witness_block(
         self, chain_id: bytes, seq_num: int, delay: float = None
     ):
@@ -472,6 +775,7 @@ class PaymentCommunity(BamiCommunity, metaclass=ABCMeta):
                 delay=self.settings.witness_delta_time,
             )
         else:
+            self.state_db.pin_status(chain_id, seq_num)
             self.register_task(
                 name_prefix,
                 self.witness,
@@ -485,15 +789,17 @@ class PaymentCommunity(BamiCommunity, metaclass=ABCMeta):
 
     def build_witness_blob(self, chain_id: bytes, seq_num: int) -> Optional[bytes]:
         chain_state = self.state_db.get_closest_peers_status(chain_id, seq_num)
+        self.state_db.unpin_status(chain_id, seq_num)
         if not chain_state:
             return None
-        return encode_raw(chain_state)
+        seq_num, state = chain_state
+        return encode_raw((seq_num, dict(state.items())))
 
     def apply_witness_tx(
         self, block: BamiBlock, witness_tx: Tuple[int, ChainState]
     ) -> None:
         state = witness_tx[1]
-        state_hash = take_hash(state)
+        state_hash = chain_state_hash(state)
         seq_num = witness_tx[0]
 
         if not self.should_witness_chain_point(block.com_id, block.public_key, seq_num):
@@ -508,6 +814,8 @@ class PaymentCommunity(BamiCommunity, metaclass=ABCMeta):
             block.com_id, seq_num, state_hash, block.public_key
         )
         self.state_db.add_chain_state(block.com_id, seq_num, state_hash, state)
+        self.chain_status_updated(block.com_id, seq_num)
+        self.compact_witnessed_state(block.com_id, seq_num)
 
         chain_id = block.com_id
         if self.tracked_blocks.get(chain_id):
@@ -519,6 +827,35 @@ class PaymentCommunity(BamiCommunity, metaclass=ABCMeta):
                 ):
                     self.update_risk(chain_id, block.public_key, block_dot[0])
 
+    def compact_witnessed_state(self, chain_id: bytes, seq_num: int) -> None:
+        """Retire the state of the chain up to the checkpoint once enough witnesses agree on it"""
+        min_votes = self.settings.compaction_witness_votes
+        if (
+            not min_votes
+            or self.state_db.get_witness_votes(chain_id, seq_num) < min_votes
+        ):
+            return
+        # Only the prefix of the chain in which every known block is applied is retired
+        applied_dots = self.state_db.applied_dots
+        chain = self.persistence.get_chain(chain_id)
+        last_seq = min(seq_num, self.chain_seq_nums.get(chain_id, 0))
+        compact_seq = applied_dots.get_watermark(chain_id)
+        while chain and compact_seq < last_seq:
+            versions = chain.get_all_short_hash_by_seq_num(compact_seq + 1)
+            if not versions or not all(
+                applied_dots.contains(chain_id, Dot((compact_seq + 1, short_hash)))
+                for short_hash in versions
+            ):
+                break
+            compact_seq += 1
+        num_retired = self.state_db.compact(chain_id, compact_seq)
+        self.logger.debug(
+            "Compacted chain %s up to %s: %s dots retired",
+            chain_id,
+            compact_seq,
+            num_retired,
+        )
+
     # ------ Confirm and reject transactions -------
 
     def apply_confirm_tx(self, block: BamiBlock, confirm_tx: Dict) -> None:
@@ -527,6 +864,13 @@ class PaymentCommunity(BamiCommunity, metaclass=ABCMeta):
         claimer = block.public_key
         com_links = block.links
         seq_num = claim_dot[0]
+        if self.tracer:
+            self.tracer.record(
+                block.com_prefix + chain_id,
+                confirm_tx[b"dot"],
+                BlockStage.CONFIRMED,
+                final=True,
+            )
         self.state_db.apply_confirm(
             chain_id,
             claimer,
@@ -534,10 +878,37 @@ class PaymentCommunity(BamiCommunity, metaclass=ABCMeta):
             claim_dot,
             confirm_tx[b"initiator"],
             confirm_tx[b"dot"],
-            Decimal(confirm_tx[b"value"], self.context),
+            self.decode_amount(confirm_tx[b"value"]),
             self.should_store_store_update(chain_id, seq_num),
         )
 
+    def apply_confirm_batch_tx(
+        self, block: BamiBlock, confirm_txs: Iterable[Dict]
+    ) -> None:
+        if self.tracer:
+            for confirm_tx in confirm_txs:
+                self.tracer.record(
+                    block.com_prefix + block.com_id,
+                    confirm_tx[b"dot"],
+                    BlockStage.CONFIRMED,
+                    final=True,
+                )
+        self.state_db.apply_confirm_batch(
+            block.com_id,
+            block.public_key,
+            block.links,
+            block.com_dot,
+            [
+                (
+                    confirm_tx[b"initiator"],
+                    confirm_tx[b"dot"],
+                    self.decode_amount(confirm_tx[b"value"]),
+                )
+                for confirm_tx in confirm_txs
+            ],
+            self.should_store_store_update(block.com_id, block.com_seq_num),
+        )
+
     def apply_reject_tx(self, block: BamiBlock, reject_tx: Dict) -> None:
         self.state_db.apply_reject(
             block.com_id,
@@ -550,8 +921,7 @@ class PaymentCommunity(BamiCommunity, metaclass=ABCMeta):
         )
 
     async def unload(self):
-        if not self.block_sign_queue_task.done():
-            self.block_sign_queue_task.cancel()
+        self.blocks_to_evaluate.clear()
         await super().unload()
 
 
@@ -1,39 +1,239 @@
-from collections import defaultdict
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
 from decimal import Decimal, getcontext
-from typing import Dict, Iterable, NewType, Optional, Set, Tuple
+from hashlib import sha256
+from typing import Any, Dict, Iterable, Mapping, NewType, Optional, Set, Tuple
 
 import cachetools
 
+from bami.backbone.datastore.persistent_map import PersistentMap
 from bami.backbone.utils import (
     Dot,
     GENESIS_DOT,
     Links,
+    memory_usage,
     shorten,
-    take_hash,
 )
 from bami.payment.exceptions import (
+    InconsistentBlockException,
     InconsistentClaimException,
     InconsistentStateHashException,
     InvalidClaimException,
 )
+from bami.payment.utils import Amount
 
-ChainState = NewType("ChainState", Dict[bytes, Tuple[bool, bool]])
+ChainState = NewType("ChainState", Mapping[bytes, Tuple[bool, bool]])
+
+STATE_HASH_MOD = 1 << 256
+
+
+def status_entry_hash(peer_key: bytes, status: Tuple[bool, bool]) -> int:
+    digest = sha256(peer_key + bytes((bool(status[0]), bool(status[1])))).digest()
+    return int.from_bytes(digest, "big")
+
+
+def encode_state_hash(hash_val: int) -> bytes:
+    return hash_val.to_bytes(32, "big")
+
+
+def chain_state_hash(state: ChainState) -> bytes:
+    """Order-independent hash of the chain state: sum of the hashes of the peer entries modulo 2^256.
+    Can be updated per peer without hashing the whole state again.
+    """
+    return encode_state_hash(
+        sum(status_entry_hash(k, v) for k, v in state.items()) % STATE_HASH_MOD
+    )
+
+
+class StatusCheckpoints(object):
+    """Stored chain statuses of one chain, sorted by the sequence number.
+
+    Every checkpoint keeps the candidate states by their hash, the preferred hash and the witness votes.
+    Only the newest `max_checkpoints` are retained, except the pinned ones:
+    checkpoints at or after the lowest pinned sequence number are kept while witnesses still need them,
+    up to `max_pinned` more checkpoints. Past it the oldest are dropped, a pin falls back to the closest later one.
+    """
+
+    def __init__(self, max_checkpoints: int, max_pinned: int = 1000) -> None:
+        self.max_checkpoints = max_checkpoints
+        self.max_pinned = max_pinned
+        self.seq_nums = []
+        self.states = dict()
+        self.preferred = dict()
+        self.votes = dict()
+        self.pins = Counter()
+        self.pinned_seq_nums = []
+
+    def __len__(self) -> int:
+        return len(self.seq_nums)
+
+    def _add_seq_num(self, seq_num: int) -> None:
+        if seq_num in self.states:
+            return
+        self.states[seq_num] = dict()
+        insort(self.seq_nums, seq_num)
+        self._evict()
+
+    def _evict(self) -> None:
+        floor = self.pinned_seq_nums[0] if self.pinned_seq_nums else None
+        while len(self.seq_nums) > self.max_checkpoints and (
+            floor is None
+            or self.seq_nums[0] < floor
+            or len(self.seq_nums) > self.max_checkpoints + self.max_pinned
+        ):
+            seq_num = self.seq_nums.pop(0)
+            del self.states[seq_num]
+            self.preferred.pop(seq_num, None)
+            self.votes.pop(seq_num, None)
+
+    def add_state(self, seq_num: int, state_hash: bytes, state: ChainState) -> None:
+        self._add_seq_num(seq_num)
+        if seq_num in self.states:
+            self.states[seq_num][state_hash] = state
+
+    def get_state(self, seq_num: int, state_hash: bytes) -> Optional[ChainState]:
+        return self.states.get(seq_num, {}).get(state_hash)
+
+    def set_preferred(self, seq_num: int, state_hash: bytes) -> None:
+        self._add_seq_num(seq_num)
+        if seq_num in self.states:
+            self.preferred[seq_num] = state_hash
+
+    def get_preferred(self, seq_num: int) -> Optional[bytes]:
+        return self.preferred.get(seq_num)
+
+    def add_vote(self, seq_num: int, state_hash: bytes, voter: bytes) -> None:
+        """Add vote for the state hash and prefer the hash with the most votes"""
+        self._add_seq_num(seq_num)
+        if seq_num not in self.states:
+            return
+        votes = self.votes.setdefault(seq_num, defaultdict(set))
+        votes[state_hash].add(voter)
+        self.preferred[seq_num] = max(votes.items(), key=lambda x: len(x[1]))[0]
+
+    def num_votes(self, seq_num: int) -> int:
+        votes = self.votes.get(seq_num)
+        return len(votes.get(self.preferred.get(seq_num), ())) if votes else 0
+
+    def closest(self, seq_num: int) -> Optional[Tuple[int, ChainState]]:
+        """Get the preferred state of the first checkpoint at or after seq_num"""
+        i = bisect_left(self.seq_nums, seq_num)
+        if i == len(self.seq_nums):
+            return None
+        closest_seq = self.seq_nums[i]
+        state = self.states[closest_seq].get(self.preferred.get(closest_seq))
+        return (closest_seq, state) if state is not None else None
+
+    def previous_seq_num(self, seq_num: int) -> int:
+        """Sequence number of the last checkpoint before seq_num, 0 if there is none"""
+        i = bisect_left(self.seq_nums, seq_num)
+        return self.seq_nums[i - 1] if i else 0
+
+    def pin(self, seq_num: int) -> None:
+        """Retain the checkpoints at or after seq_num until unpinned"""
+        if not self.pins[seq_num]:
+            insort(self.pinned_seq_nums, seq_num)
+        self.pins[seq_num] += 1
+
+    def unpin(self, seq_num: int) -> None:
+        if not self.pins[seq_num]:
+            return
+        self.pins[seq_num] -= 1
+        if not self.pins[seq_num]:
+            del self.pins[seq_num]
+            self.pinned_seq_nums.remove(seq_num)
+            self._evict()
+
+
+class AppliedDots(object):
+    """Dots of the applied blocks, per chain.
+
+    The watermark of a chain covers a prefix in which every known block was applied: these dots are retired.
+    Only the dots above the watermark are kept, typically a small set behind the frontier,
+    together with the dots of concurrent blocks applied below the watermark after the compaction.
+    """
+
+    def __init__(self) -> None:
+        self.watermarks = dict()
+        self.dots = defaultdict(set)
+
+    def __len__(self) -> int:
+        return sum(len(dots) for dots in self.dots.values())
+
+    def add(self, chain_id: bytes, dot: Dot) -> None:
+        self.dots[chain_id].add(dot)
+
+    def contains(self, chain_id: bytes, dot: Dot) -> bool:
+        """Dot is applied or at or below the watermark"""
+        if dot[0] <= self.watermarks.get(chain_id, 0):
+            return True
+        dots = self.dots.get(chain_id)
+        return dots is not None and dot in dots
+
+    def is_retired(self, chain_id: bytes, dot: Dot) -> bool:
+        """Dot is at or below the watermark and was not applied after the compaction"""
+        if dot[0] > self.watermarks.get(chain_id, 0):
+            return False
+        dots = self.dots.get(chain_id)
+        return dots is None or dot not in dots
+
+    def get_watermark(self, chain_id: bytes) -> int:
+        return self.watermarks.get(chain_id, 0)
+
+    def compact(self, chain_id: bytes, seq_num: int) -> int:
+        """Move the watermark of the chain up to seq_num.
+
+        Returns:
+            Number of retired dots
+        """
+        if seq_num <= self.watermarks.get(chain_id, 0):
+            return 0
+        self.watermarks[chain_id] = seq_num
+        dots = self.dots.get(chain_id)
+        if not dots:
+            return 0
+        retired = {dot for dot in dots if dot[0] <= seq_num}
+        dots -= retired
+        if not dots:
+            del self.dots[chain_id]
+        return len(retired)
 
 
 class PaymentState(object):
-    def __init__(self, precision: int) -> None:
+    def __init__(
+        self,
+        precision: int,
+        max_checkpoints: int = 100,
+        minor_units: bool = False,
+        max_pinned_checkpoints: int = 1000,
+    ) -> None:
+        """
+        Args:
+            precision: precision of the Decimal context, unused with minor units
+            max_checkpoints: number of stored chain statuses to keep per chain
+            minor_units: keep amounts as integer number of minor units instead of Decimal
+            max_pinned_checkpoints: number of stored chain statuses kept per chain for the pins,
+             on top of max_checkpoints
+        """
 
         self.precision = precision
-        new_con = getcontext()
-        new_con.prec = precision
-        self.context = new_con
+        self.minor_units = minor_units
+        if minor_units:
+            # Integer arithmetic is exact, the Decimal context is left as it is
+            self.context = getcontext()
+            self.zero = 0
+        else:
+            new_con = getcontext()
+            new_con.prec = precision
+            self.context = new_con
+            self.zero = Decimal(0, self.context)
 
         # Frontiers to track for the chain invariants
         self.peer_frontiers = defaultdict(lambda: defaultdict(lambda: 0))
         self.fork_attempts = defaultdict(lambda: defaultdict(lambda: set()))
         # Last spend values: spender-claimer - value
         self.last_spend_values = defaultdict(
-            lambda: defaultdict(lambda: {GENESIS_DOT: Decimal(0, self.context)})
+            lambda: defaultdict(lambda: {GENESIS_DOT: self.zero})
         )
 
         # Values to keep spender-claimer - value
@@ -49,26 +249,55 @@ class PaymentState(object):
         # Store last reaction dot of the counter-party with the spender: cp-spender - dot
         self.claim_dict = defaultdict(lambda: defaultdict(lambda: GENESIS_DOT))
         # Last finalized pairwise balance counter-party - spender - value
-        self.claim_vals = defaultdict(
-            lambda: defaultdict(lambda: Decimal(0, self.context))
-        )
+        self.claim_vals = defaultdict(lambda: defaultdict(lambda: self.zero))
 
-        self.peer_mints = defaultdict(lambda: Decimal(0, self.context))
+        self.peer_mints = defaultdict(lambda: self.zero)
+        # Running totals of the last spend values and the finalized claims per peer
+        self.peer_spends = defaultdict(lambda: self.zero)
+        self.peer_claims = defaultdict(lambda: self.zero)
 
         self.known_minters = defaultdict(lambda: set())
 
         self.chain_peers = defaultdict(lambda: set())
+        self.peer_chains = defaultdict(lambda: set())
+
+        # Last status of the chains, updated for the touched peers only: chain_id -> PersistentMap.
+        # Stored statuses share the map: a change copies O(log peers) nodes, not the status
+        self.chain_status = dict()
+        self.chain_status_hash = defaultdict(int)
+        # Peers with a possibly changed status since the last status read
+        self.touched_peers = set()
+
+        # Stored statuses with witness votes: chain_id -> StatusCheckpoints
+        self.max_checkpoints = max_checkpoints
+        self.max_pinned_checkpoints = max_pinned_checkpoints
+        self.peer_statuses = defaultdict(
+            lambda: StatusCheckpoints(self.max_checkpoints, self.max_pinned_checkpoints)
+        )
 
-        # Chain_id: seq_num: hash: set of voters
-        self.prefered_statuses = defaultdict(lambda: cachetools.LRUCache(100))
-        self.peer_statuses = defaultdict(lambda: cachetools.LRUCache(100))
-        self.witness_votes = defaultdict(lambda: cachetools.LRUCache(100))
-
-        self.applied_dots = set()
+        self.applied_dots = AppliedDots()
         self.balance_invariants = defaultdict(lambda: True)
 
     def get_last_pairwise_links(self, spender: bytes, claimer: bytes) -> Links:
-        return tuple(self.last_spend_values[spender][claimer].keys())
+        spend_values = self.last_spend_values.get(spender, {}).get(claimer)
+        return tuple(spend_values.keys()) if spend_values else Links((GENESIS_DOT,))
+
+    def get_spend_value(self, spender: bytes, receiver: bytes) -> Amount:
+        """Cumulative value spent by the spender to the receiver"""
+        spend_values = self.last_spend_values.get(spender, {}).get(receiver, {})
+        return sum(
+            (self._spend_amount(val) for val in spend_values.values()), self.zero
+        )
+
+    def get_last_claim_dot(self, claimer: bytes, spender: bytes) -> Dot:
+        """Spend dot of the last reaction of the claimer to the spender"""
+        return self.claim_dict.get(claimer, {}).get(spender, GENESIS_DOT)
+
+    def _get_cached_value(self, spender: bytes, claimer: bytes, spend_dot: Dot) -> Any:
+        return self.vals_cache.get(spender, {}).get(claimer, {}).get(spend_dot)
+
+    def _has_spend_value(self, spender: bytes, claimer: bytes, spend_dot: Dot) -> bool:
+        return spend_dot in self.last_spend_values.get(spender, {}).get(claimer, ())
 
     def known_chain_minters(self, chain_id: bytes) -> Optional[Iterable[bytes]]:
         return self.known_minters.get(chain_id)
@@ -92,14 +321,38 @@ class PaymentState(object):
             )
             self.fork_attempts[chain_id][peer_id].add(dot[0])
 
+    def _update_peer_status(self, chain_id: bytes, peer_id: bytes) -> None:
+        peer_key = shorten(peer_id)
+        new_val = (
+            self.get_balance(peer_id) >= 0,
+            not self.is_chain_forked(chain_id, peer_id),
+        )
+        status = self.chain_status.get(chain_id)
+        if status is None:
+            status = self.chain_status[chain_id] = PersistentMap()
+        old_val = status.get(peer_key)
+        if old_val == new_val:
+            return
+        hash_val = self.chain_status_hash[chain_id]
+        if old_val is not None:
+            hash_val -= status_entry_hash(peer_key, old_val)
+        self.chain_status[chain_id] = status.set(peer_key, new_val)
+        hash_val += status_entry_hash(peer_key, new_val)
+        self.chain_status_hash[chain_id] = hash_val % STATE_HASH_MOD
+
+    def _refresh_statuses(self) -> None:
+        """Update the status of the touched peers in all their chains"""
+        for peer_id in self.touched_peers:
+            for chain_id in self.peer_chains.get(peer_id, ()):
+                self._update_peer_status(chain_id, peer_id)
+        self.touched_peers.clear()
+
     def _store_status_update(self, dot: Dot, chain_id: bytes):
         seq_num = dot[0]
         status = self.get_last_peer_status(chain_id=chain_id)
-        state_hash = take_hash(status)
-        if not self.peer_statuses[chain_id].get(seq_num):
-            self.peer_statuses[chain_id][seq_num] = dict()
-        self.peer_statuses[chain_id][seq_num][state_hash] = status
-        self.prefered_statuses[chain_id][seq_num] = state_hash
+        state_hash = self.get_last_state_hash(chain_id)
+        self.peer_statuses[chain_id].add_state(seq_num, state_hash, status)
+        self.peer_statuses[chain_id].set_preferred(seq_num, state_hash)
 
     def _update_chain_invariants(
         self,
@@ -108,13 +361,41 @@ class PaymentState(object):
         prev_links: Links,
         tx_dot: Dot,
         store_update: bool,
+        counter_parties: Iterable[bytes] = (),
     ) -> None:
         self.chain_peers[chain_id].add(peer_id)
+        self.peer_chains[peer_id].add(chain_id)
         self._check_forking(chain_id, peer_id, tx_dot)
+        self.touched_peers.add(peer_id)
+        # Balances of the counter-parties might have changed too
+        self.touched_peers.update(counter_parties)
         if store_update:
             self._store_status_update(tx_dot, chain_id)
         self._check_invariants(peer_id)
 
+    @staticmethod
+    def _spend_amount(val: Any) -> Amount:
+        # Inconsistent value is stored as tuple => take the max
+        return max(val) if type(val) == tuple else val
+
+    def _set_spend_value(
+        self, spender: bytes, receiver: bytes, spend_dot: Dot, val: Any
+    ) -> None:
+        spend_values = self.last_spend_values[spender][receiver]
+        if spend_dot in spend_values:
+            self.peer_spends[spender] -= self._spend_amount(spend_values[spend_dot])
+        spend_values[spend_dot] = val
+        self.peer_spends[spender] += self._spend_amount(val)
+
+    def _pop_spend_value(self, spender: bytes, receiver: bytes, spend_dot: Dot) -> Any:
+        val = self.last_spend_values[spender][receiver].pop(spend_dot)
+        self.peer_spends[spender] -= self._spend_amount(val)
+        return val
+
+    def _set_claim_value(self, claimer: bytes, spender: bytes, value: Amount) -> None:
+        self.peer_claims[claimer] += value - self.claim_vals[claimer][spender]
+        self.claim_vals[claimer][spender] = value
+
     def apply_spend(
         self,
         chain_id: bytes,
@@ -123,42 +404,77 @@ class PaymentState(object):
         spend_dot: Dot,
         spender: bytes,
         receiver: bytes,
-        value: Decimal,
+        value: Amount,
         store_status_update: bool = False,
     ) -> None:
         """Apply spend transaction to the state"""
         # apply spend to the personal chain
+        self._apply_spend_output(spender, receiver, prev_spend_links, spend_dot, value)
+
+        # spender changed the state of the chain =>
+        self._update_chain_invariants(
+            chain_id, spender, prev_chain_links, spend_dot, store_status_update
+        )
+
+    def apply_multi_spend(
+        self,
+        chain_id: bytes,
+        prev_chain_links: Links,
+        spend_dot: Dot,
+        spender: bytes,
+        outputs: Iterable[Tuple[bytes, Links, Amount]],
+        store_status_update: bool = False,
+    ) -> None:
+        """Apply spend transaction with many outputs (receiver, prev_spend_links, value) in one block.
+        Every receiver can appear only once. The outputs are applied fully or not at all.
+        """
+        outputs = list(outputs)
+        receivers = {receiver for receiver, _, _ in outputs}
+        if len(receivers) != len(outputs):
+            raise InconsistentBlockException(
+                "Multi spend with repeated receivers", spender, spend_dot
+            )
+        for receiver, prev_spend_links, value in outputs:
+            self._apply_spend_output(
+                spender, receiver, prev_spend_links, spend_dot, value
+            )
+        self._update_chain_invariants(
+            chain_id, spender, prev_chain_links, spend_dot, store_status_update
+        )
 
+    def _apply_spend_output(
+        self,
+        spender: bytes,
+        receiver: bytes,
+        prev_spend_links: Links,
+        spend_dot: Dot,
+        value: Amount,
+    ) -> None:
         # Iterate through last spend values and sum them up
         full_val = 0
         for dot in prev_spend_links:
             if dot in self.last_spend_values[spender][receiver]:
-                next_val = self.last_spend_values[spender][receiver].pop(dot)
+                next_val = self._pop_spend_value(spender, receiver, dot)
                 next_val = next_val if next_val else 0
                 full_val += next_val
 
         if value >= full_val:
             # The value is monotonically increasing => The update should be consistent => replace with the given value.
-            self.last_spend_values[spender][receiver][spend_dot] = value
+            self._set_spend_value(spender, receiver, spend_dot, value)
             self.vals_cache[spender][receiver][spend_dot] = value
         else:
             # TODO: revisit. There is inconsistency in the spend declaration => How to react?
             #  1. Store both new value and estimated
-            self.last_spend_values[spender][receiver][spend_dot] = (value, full_val)
+            self._set_spend_value(spender, receiver, spend_dot, (value, full_val))
             self.vals_cache[spender][receiver][spend_dot] = (value, full_val)
 
-        # spender changed the state of the chain =>
-        self._update_chain_invariants(
-            chain_id, spender, prev_chain_links, spend_dot, store_status_update
-        )
-
     def apply_mint(
         self,
         chain_id: bytes,
         mint_dot: Dot,
         prev_links: Links,
         minter: bytes,
-        value: Decimal,
+        value: Amount,
         store_update: bool = False,
     ) -> None:
         """Apply mint transaction as it is to the state. Assumes that mint is valid!"""
@@ -174,10 +490,11 @@ class PaymentState(object):
         """ Check if the claim/reject was not applied previously => Claim is too old.
             Check if previous links are consistent wrt spend_dot
          """
-        if spend_dot <= self.claim_dict[claimer][spender]:
+        last_claim_dot = self.get_last_claim_dot(claimer, spender)
+        if spend_dot <= last_claim_dot:
             raise InvalidClaimException(
                 "Counter-party reaction with link {spend_dot} already applied. Current frontier: {current}".format(
-                    spend_dot=spend_dot, current=self.claim_dict[claimer][spender]
+                    spend_dot=spend_dot, current=last_claim_dot
                 )
             )
         if max(prev_links) < spend_dot and spend_dot not in prev_links:
@@ -195,7 +512,7 @@ class PaymentState(object):
         claim_dot: Dot,
         spender: bytes,
         spend_dot: Dot,
-        value: Decimal,
+        value: Amount,
         store_update: bool = False,
     ) -> None:
         """Apply confirm transaction to the state. Might raise exceptions if confirm is not valid:
@@ -204,7 +521,22 @@ class PaymentState(object):
         # 1. Check if the confirm or reject is too old?
         self._verify_reaction(prev_links, spend_dot, claimer, spender)
         # 2. Check if claim is consistent with the spend value
-        val = self.vals_cache[spender][claimer].get(spend_dot)
+        self._verify_claim_value(chain_id, claimer, spender, spend_dot, value)
+        self._apply_claim(claimer, spender, spend_dot, value)
+
+        self._update_chain_invariants(
+            chain_id, claimer, prev_links, claim_dot, store_update, (spender,)
+        )
+
+    def _verify_claim_value(
+        self,
+        chain_id: bytes,
+        claimer: bytes,
+        spender: bytes,
+        spend_dot: Dot,
+        value: Amount,
+    ) -> None:
+        val = self._get_cached_value(spender, claimer, spend_dot)
         if (
             not val
             or (type(val) == tuple and val[0] != value)
@@ -215,17 +547,51 @@ class PaymentState(object):
                     peer=claimer, chain_id=chain_id, value=value, val=val
                 )
             )
+
+    def _apply_claim(
+        self, claimer: bytes, spender: bytes, spend_dot: Dot, value: Amount
+    ) -> None:
+        val = self._get_cached_value(spender, claimer, spend_dot)
         # Counter-parties agreed => Fix any inconsistencies introduced
         if type(val) == tuple and val[0] == value:
             self.vals_cache[spender][claimer][spend_dot] = value
-            if spend_dot in self.last_spend_values[spender][claimer]:
-                self.last_spend_values[spender][claimer][spend_dot] = value
+            if self._has_spend_value(spender, claimer, spend_dot):
+                self._set_spend_value(spender, claimer, spend_dot, value)
         # Link this claim to the spend value
         self.claim_dict[claimer][spender] = spend_dot
-        self.claim_vals[claimer][spender] = value
+        self._set_claim_value(claimer, spender, value)
+
+    def apply_confirm_batch(
+        self,
+        chain_id: bytes,
+        claimer: bytes,
+        prev_links: Links,
+        claim_dot: Dot,
+        confirms: Iterable[Tuple[bytes, Dot, Amount]],
+        store_update: bool = False,
+    ) -> None:
+        """Apply confirm transaction of many spends in one block: (spender, spend_dot, value).
+        All confirms are verified before any is applied: the batch is applied fully or not at all.
+        Confirms of the same spender must be ordered by the spend dot.
+        """
+        confirms = list(confirms)
+        last_dots = dict()
+        for spender, spend_dot, value in confirms:
+            last_dot = last_dots.get(spender)
+            if last_dot is not None and spend_dot <= last_dot:
+                raise InvalidClaimException(
+                    "Confirms of {spender} not ordered: {spend_dot} after {last_dot}".format(
+                        spender=spender, spend_dot=spend_dot, last_dot=last_dot
+                    )
+                )
+            last_dots[spender] = spend_dot
+            self._verify_reaction(prev_links, spend_dot, claimer, spender)
+            self._verify_claim_value(chain_id, claimer, spender, spend_dot, value)
+        for spender, spend_dot, value in confirms:
+            self._apply_claim(claimer, spender, spend_dot, value)
 
         self._update_chain_invariants(
-            chain_id, claimer, prev_links, claim_dot, store_update
+            chain_id, claimer, prev_links, claim_dot, store_update, last_dots.keys()
         )
 
     def apply_reject(
@@ -243,106 +609,155 @@ class PaymentState(object):
         # This reaction rejects this spend_dot and leaves the value as it is.
         self.claim_dict[claimer][spender] = spend_dot
         # Update the spend value => revert to previous finalized
-        if spend_dot in self.last_spend_values[spender][claimer]:
-            self.last_spend_values[spender][claimer][spend_dot] = self.claim_vals[
-                claimer
-            ][spender]
+        if self._has_spend_value(spender, claimer, spend_dot):
+            self._set_spend_value(
+                spender,
+                claimer,
+                spend_dot,
+                self.claim_vals.get(claimer, {}).get(spender, self.zero),
+            )
         # Update chain invariants
         self._update_chain_invariants(
-            chain_id, claimer, prev_links, reject_dot, store_update
+            chain_id, claimer, prev_links, reject_dot, store_update, (spender,)
         )
 
-    def get_total_spend(self, peer_id: bytes) -> Decimal:
-        spends = Decimal(0, self.context)
-        for _, val_dict in self.last_spend_values[peer_id].items():
-            for dot, val in val_dict.items():
-                if type(val) == tuple:
-                    # value is inconsistent => take the max
-                    spends = spends + max(val)
-                else:
-                    spends = spends + val
-        return spends
-
-    def get_total_claims(self, peer_id: bytes) -> Decimal:
-        total_claim = Decimal(0, self.context)
-        for _, val in self.claim_vals[peer_id].items():
-            total_claim = total_claim + val
-        return total_claim
-
-    def get_balance(self, peer_id: bytes) -> Decimal:
+    def get_total_spend(self, peer_id: bytes) -> Amount:
+        return self.peer_spends.get(peer_id, self.zero)
+
+    def get_total_claims(self, peer_id: bytes) -> Amount:
+        return self.peer_claims.get(peer_id, self.zero)
+
+    def get_balance(self, peer_id: bytes) -> Amount:
         return (
-            self.peer_mints[peer_id]
+            self.peer_mints.get(peer_id, self.zero)
             + self.get_total_claims(peer_id)
             - self.get_total_spend(peer_id)
         )
 
     def was_balance_negative(self, peer_id: bytes) -> bool:
-        return not self.balance_invariants[peer_id]
+        return not self.balance_invariants.get(peer_id, True)
 
     def is_chain_forked(self, chain_id: bytes, peer_id: bytes) -> bool:
-        last_sn = self.peer_frontiers[chain_id][peer_id]
-        if last_sn in self.fork_attempts[chain_id][peer_id]:
-            return True
-        return False
+        attempts = self.fork_attempts.get(chain_id, {}).get(peer_id)
+        if not attempts:
+            return False
+        return self.peer_frontiers[chain_id][peer_id] in attempts
 
     def was_chain_forked(self, chain_id: bytes, peer_id: bytes) -> bool:
-        return len(self.fork_attempts[chain_id][peer_id]) >= 1
+        return bool(self.fork_attempts.get(chain_id, {}).get(peer_id))
+
+    def compact(self, chain_id: bytes, seq_num: int) -> int:
+        """Retire the state of the chain at or below a witnessed checkpoint.
+        Applied dots are replaced with the chain watermark, older fork attempts are dropped.
+
+        Returns:
+            Number of retired dots
+        """
+        num_retired = self.applied_dots.compact(chain_id, seq_num)
+        for peer_id, attempts in self.fork_attempts.get(chain_id, {}).items():
+            frontier = self.peer_frontiers[chain_id][peer_id]
+            kept = {s for s in attempts if s > seq_num or s == frontier}
+            # At least one attempt is kept: the peer forked the chain once
+            attempts.intersection_update(kept or {max(attempts)})
+        return num_retired
+
+    def memory_report(self) -> Dict[str, Dict[str, int]]:
+        """Entries and estimated bytes of the structures that grow with the history.
+        Objects held by two structures, like the statuses shared with the checkpoints, are counted in both.
+        """
+        applied = self.applied_dots
+        return {
+            "applied_dots": memory_usage(len(applied), applied.dots),
+            "applied_watermarks": memory_usage(
+                len(applied.watermarks), applied.watermarks
+            ),
+            "last_spend_values": memory_usage(
+                sum(
+                    len(vals)
+                    for d in self.last_spend_values.values()
+                    for vals in d.values()
+                ),
+                self.last_spend_values,
+            ),
+            "vals_cache": memory_usage(
+                sum(len(vals) for d in self.vals_cache.values() for vals in d.values()),
+                self.vals_cache,
+            ),
+            "claim_dict": memory_usage(
+                sum(len(d) for d in self.claim_dict.values()), self.claim_dict
+            ),
+            "claim_vals": memory_usage(
+                sum(len(d) for d in self.claim_vals.values()), self.claim_vals
+            ),
+            "fork_attempts": memory_usage(
+                sum(len(v) for d in self.fork_attempts.values() for v in d.values()),
+                self.fork_attempts,
+            ),
+            "peer_frontiers": memory_usage(
+                sum(len(d) for d in self.peer_frontiers.values()), self.peer_frontiers
+            ),
+            "peer_statuses": memory_usage(
+                sum(len(c) for c in self.peer_statuses.values()), self.peer_statuses
+            ),
+            "chain_status": memory_usage(
+                sum(len(status) for status in self.chain_status.values()),
+                self.chain_status,
+                self.chain_status_hash,
+            ),
+            "chain_peers": memory_usage(
+                sum(len(peers) for peers in self.chain_peers.values()),
+                self.chain_peers,
+                self.peer_chains,
+            ),
+        }
 
     # ----- For auditing and witnessing ---------
     def get_last_peer_status(self, chain_id: bytes) -> ChainState:
-        """Get last balance of peers in the community"""
-        v = dict()
-        for p in self.chain_peers[chain_id]:
-            v[shorten(p)] = (
-                self.get_balance(p) >= 0,
-                not self.is_chain_forked(chain_id, p),
-            )
-        return ChainState(v)
+        """Get last balance of peers in the community. The state is immutable, taking it costs O(1)."""
+        self._refresh_statuses()
+        status = self.chain_status.get(chain_id)
+        if status is None:
+            return ChainState(PersistentMap())
+        return ChainState(status)
+
+    def get_last_state_hash(self, chain_id: bytes) -> bytes:
+        """Get hash of the last peer status in the community, see `chain_state_hash`"""
+        self._refresh_statuses()
+        return encode_state_hash(self.chain_status_hash.get(chain_id, 0))
 
     def add_witness_vote(
         self, chain_id: bytes, seq_num: int, state_hash: bytes, witness_id: bytes
     ) -> None:
-        prev_values = self.witness_votes[chain_id].get(seq_num)
-        if not prev_values:
-            self.witness_votes[chain_id][seq_num] = defaultdict(lambda: set())
-        self.witness_votes[chain_id][seq_num][state_hash].add(witness_id)
         # TODO: add reaction if there is inconsistency
-        state_hash = max(
-            self.witness_votes[chain_id][seq_num].items(), key=lambda x: len(x[1])
-        )[0]
-        self.prefered_statuses[chain_id][seq_num] = state_hash
+        self.peer_statuses[chain_id].add_vote(seq_num, state_hash, witness_id)
+
+    def get_witness_votes(self, chain_id: bytes, seq_num: int) -> int:
+        """Number of witness votes for the preferred status at seq_num"""
+        checkpoints = self.peer_statuses.get(chain_id)
+        return checkpoints.num_votes(seq_num) if checkpoints else 0
 
     def add_chain_state(
         self, chain_id: bytes, seq_num: int, state_hash: bytes, state: ChainState
     ) -> None:
-        calc_hash = take_hash(state)
+        calc_hash = chain_state_hash(state)
         if calc_hash != state_hash:
             raise InconsistentStateHashException(
                 "State hash not equal", state_hash, calc_hash
             )
-        if not self.peer_statuses[chain_id].get(seq_num):
-            self.peer_statuses[chain_id][seq_num] = dict()
-        self.peer_statuses[chain_id][seq_num][state_hash] = state
+        self.peer_statuses[chain_id].add_state(seq_num, state_hash, state)
 
     def get_closest_peers_status(
         self, chain_id: bytes, seq_num: int
     ) -> Optional[Tuple[int, ChainState]]:
-        int_max = 9999
-        try:
-            v = min(
-                self.peer_statuses[chain_id].keys(),
-                key=lambda x: abs(x - seq_num) if x >= seq_num else int_max,
-            )
-            if v < seq_num:
-                # No data with seq_num yet
-                return None
-            else:
-                # choose state hash - last own?
-                # get preferred status
-                state_hash = self.prefered_statuses[chain_id][v]
-                return v, self.peer_statuses[chain_id][v][state_hash]
-        except ValueError:
-            # No data in the chain
-            return None
-        except KeyError:
-            return None
+        """Get the preferred status stored at seq_num or the first one after it"""
+        checkpoints = self.peer_statuses.get(chain_id)
+        return checkpoints.closest(seq_num) if checkpoints else None
+
+    def pin_status(self, chain_id: bytes, seq_num: int) -> None:
+        """Keep the statuses at or after seq_num while a witness or a pending block needs them"""
+        self.peer_statuses[chain_id].pin(seq_num)
+
+    def unpin_status(self, chain_id: bytes, seq_num: int) -> None:
+        checkpoints = self.peer_statuses.get(chain_id)
+        if checkpoints:
+            checkpoints.unpin(seq_num)
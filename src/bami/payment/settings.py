@@ -4,13 +4,29 @@ from bami.backbone.settings import BamiSettings
 class PaymentSettings(BamiSettings):
     def __init__(self):
         super().__init__()
+        # Significant digits of the Decimal amounts
         self.asset_precision = 10
+        # Keep amounts as integer minor units (10^-minor_unit_decimals) in the state and in the transactions
+        self.minor_unit_amounts = False
+        # Decimal places of a minor unit. Unlike asset_precision, it does not limit the integer part
+        self.minor_unit_decimals = 10
         # Mint settings
         self.mint_value_range = (0, 100)
         self.mint_max_value = 10 ** 7
         # Spend settings
         self.spend_value_range = (0, 10 ** 7)
 
+        # Spends confirmed together are acknowledged with one block of at most this many confirms
+        self.confirm_batch_size = 100
+
         # Required diversity
         self.diversity_confirm = 0
         self.should_witness_block = False
+        # Stored chain statuses kept per chain, besides the ones pinned by witnesses and pending blocks
+        self.max_status_checkpoints = 100
+        # Stored chain statuses kept per chain for the witnesses and the pending blocks, on top of the others
+        self.max_pinned_status_checkpoints = 1000
+        # Applied state at or below a checkpoint is retired once this many witnesses agree on it. 0 disables it
+        self.compaction_witness_votes = 0
+        # Snapshot of the payment state is written every this many applied blocks. 0 disables snapshots
+        self.snapshot_interval = 1000
@@ -0,0 +1,165 @@
+"""
+Compact snapshots of the payment state for a fast recovery after a restart.
+
+The snapshot keeps the last applied sequence number and the state hash of every chain.
+Blocks of the chains up to these points are skipped on recovery, only the tail is applied again.
+"""
+from decimal import Decimal
+import os
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from bami.backbone.utils import decode_raw, encode_raw
+from bami.payment.database import PaymentState
+from bami.payment.exceptions import InconsistentStateHashException
+
+SNAPSHOT_VERSION = 2
+SNAPSHOT_FILE = "payment_state.snapshot"
+
+# Nested dicts of the state with their depth (number of key levels)
+NESTED_AMOUNTS = (
+    # Spend values are replaced as a whole, without the default genesis value
+    ("last_spend_values", 2),
+    ("vals_cache", 3),
+    ("claim_vals", 2),
+    ("peer_mints", 1),
+    ("peer_spends", 1),
+    ("peer_claims", 1),
+)
+NESTED_VALUES = (
+    ("peer_frontiers", 2),
+    ("claim_dict", 2),
+    ("balance_invariants", 1),
+)
+NESTED_SETS = (
+    ("fork_attempts", 2),
+    ("known_minters", 1),
+    ("chain_peers", 1),
+    ("peer_chains", 1),
+)
+
+
+def _encode_amount(val: Any) -> Any:
+    if type(val) == dict:
+        return {k: _encode_amount(v) for k, v in val.items()}
+    if type(val) == tuple:
+        # Inconsistent spend value
+        return tuple(_encode_amount(v) for v in val)
+    return str(val) if isinstance(val, Decimal) else val
+
+
+def _decode_amount(val: Any) -> Any:
+    if type(val) == dict:
+        return {k: _decode_amount(v) for k, v in val.items()}
+    if type(val) == tuple:
+        return tuple(_decode_amount(v) for v in val)
+    return Decimal(val) if isinstance(val, str) else val
+
+
+def _dump_nested(nested: Dict, depth: int, encode: Callable[[Any], Any]) -> Dict:
+    if depth == 1:
+        return {k: encode(v) for k, v in nested.items()}
+    return {k: _dump_nested(v, depth - 1, encode) for k, v in nested.items()}
+
+
+def _load_nested(
+    target: Dict, data: Dict, depth: int, decode: Callable[[Any], Any]
+) -> None:
+    for k, v in data.items():
+        if depth == 1:
+            target[k] = decode(v)
+        else:
+            _load_nested(target[k], v, depth - 1, decode)
+
+
+def encode_snapshot(state: PaymentState, chain_seq_nums: Dict[bytes, int]) -> bytes:
+    """Encode the state applied up to the sequence numbers of the chains"""
+    data = {
+        name: _dump_nested(getattr(state, name), depth, _encode_amount)
+        for name, depth in NESTED_AMOUNTS
+    }
+    for name, depth in NESTED_VALUES:
+        data[name] = _dump_nested(getattr(state, name), depth, lambda v: v)
+    for name, depth in NESTED_SETS:
+        data[name] = _dump_nested(getattr(state, name), depth, tuple)
+    data["applied_watermarks"] = state.applied_dots.watermarks
+    data["applied_dots"] = {k: tuple(v) for k, v in state.applied_dots.dots.items()}
+    return encode_raw(
+        {
+            "version": SNAPSHOT_VERSION,
+            "minor_units": state.minor_units,
+            "chain_seq_nums": chain_seq_nums,
+            "state_hashes": {
+                chain_id: state.get_last_state_hash(chain_id)
+                for chain_id in chain_seq_nums
+            },
+            "state": data,
+        }
+    )
+
+
+def decode_snapshot(snapshot: bytes, state: PaymentState) -> Optional[Dict[bytes, int]]:
+    """Load the snapshot into the empty state.
+
+    Returns:
+        Last applied sequence numbers of the chains, None if the snapshot is of another version
+    Raises:
+        InconsistentStateHashException if the restored state does not match the stored hashes
+    """
+    snapshot = decode_raw(snapshot)
+    if (
+        snapshot.get("version") != SNAPSHOT_VERSION
+        or snapshot.get("minor_units") != state.minor_units
+    ):
+        return None
+    data = snapshot["state"]
+    for name, depth in NESTED_AMOUNTS:
+        _load_nested(getattr(state, name), data[name], depth, _decode_amount)
+    for name, depth in NESTED_VALUES:
+        _load_nested(getattr(state, name), data[name], depth, lambda v: v)
+    for name, depth in NESTED_SETS:
+        _load_nested(getattr(state, name), data[name], depth, set)
+    state.applied_dots.watermarks.update(data["applied_watermarks"])
+    for chain_id, dots in data["applied_dots"].items():
+        state.applied_dots.dots[chain_id].update(dots)
+
+    # Statuses are derived from the restored balances and forks
+    state.touched_peers.update(state.peer_chains.keys())
+    for chain_id, state_hash in snapshot["state_hashes"].items():
+        calc_hash = state.get_last_state_hash(chain_id)
+        if calc_hash != state_hash:
+            raise InconsistentStateHashException(
+                "Snapshot state hash not equal", chain_id, state_hash, calc_hash
+            )
+    return dict(snapshot["chain_seq_nums"])
+
+
+def write_snapshot(
+    snapshot_dir: str, state: PaymentState, chain_seq_nums: Dict[bytes, int]
+) -> str:
+    """Replace the snapshot in the directory. The file is replaced atomically."""
+    path = os.path.join(snapshot_dir, SNAPSHOT_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(encode_snapshot(state, chain_seq_nums))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return path
+
+
+def read_snapshot(
+    snapshot_dir: str, state: PaymentState
+) -> Tuple[bool, Dict[bytes, int]]:
+    """Load the snapshot in the directory into the empty state, if there is any.
+
+    Returns:
+        If the snapshot was loaded, and the last applied sequence numbers of the chains
+    """
+    path = os.path.join(snapshot_dir, SNAPSHOT_FILE)
+    if not os.path.exists(path):
+        return False, {}
+    with open(path, "rb") as f:
+        chain_seq_nums = decode_snapshot(f.read(), state)
+    if chain_seq_nums is None:
+        return False, {}
+    return True, chain_seq_nums
@@ -1,2 +1,31 @@
+from decimal import Context, Decimal, MAX_EMAX, MAX_PREC, MIN_EMIN, ROUND_HALF_EVEN
+from typing import Union
+
 SPEND_TYPE = b"spend"
+MULTI_SPEND_TYPE = b"multi_spend"
 MINT_TYPE = b"mint"
+
+# Amount in the payment state: Decimal, or integer number of minor units
+Amount = Union[Decimal, int]
+
+# Context of the minor unit conversions: exact, whatever the precision of the Decimal amounts
+_EXACT_CONTEXT = Context(prec=MAX_PREC, Emax=MAX_EMAX, Emin=MIN_EMIN)
+
+
+def _check_decimals(decimals: int) -> None:
+    if type(decimals) != int or decimals < 0:
+        raise ValueError("Not a number of decimal places", decimals)
+
+
+def to_minor_units(value: Union[Decimal, float, int, str], decimals: int) -> int:
+    """Convert the value to an integer number of minor units (10^-decimals). Rounds half to even.
+    The integer part is kept whole: the decimals are places after the point, not significant digits.
+    """
+    _check_decimals(decimals)
+    units = Decimal(str(value)).scaleb(decimals, _EXACT_CONTEXT)
+    return int(units.to_integral_value(rounding=ROUND_HALF_EVEN))
+
+
+def from_minor_units(units: int, decimals: int) -> Decimal:
+    _check_decimals(decimals)
+    return Decimal(units).scaleb(-decimals, _EXACT_CONTEXT)
@@ -0,0 +1,54 @@
+"""
+Event loop running on virtual time.
+
+When no callback is ready the clock jumps to the next scheduled callback instead of sleeping,
+so timers, gossip intervals and network delays cost no wall-clock time.
+"""
+from asyncio import SelectorEventLoop
+import selectors
+from typing import Any, List, Optional, Tuple
+
+
+class VirtualTimeSelector(selectors.BaseSelector):
+    """Selector that advances the virtual clock by the select timeout instead of waiting"""
+
+    def __init__(self, loop: "VirtualTimeEventLoop") -> None:
+        self.loop = loop
+        # Real selector for the self-pipe of the loop (wake ups from other threads)
+        self.selector = selectors.DefaultSelector()
+
+    def register(self, fileobj: Any, events: int, data: Any = None) -> Any:
+        return self.selector.register(fileobj, events, data)
+
+    def unregister(self, fileobj: Any) -> Any:
+        return self.selector.unregister(fileobj)
+
+    def modify(self, fileobj: Any, events: int, data: Any = None) -> Any:
+        return self.selector.modify(fileobj, events, data)
+
+    def get_map(self) -> Any:
+        return self.selector.get_map()
+
+    def close(self) -> None:
+        self.selector.close()
+
+    def select(self, timeout: Optional[float] = None) -> List[Tuple[Any, int]]:
+        if timeout is None:
+            # Nothing is scheduled: only another thread can wake the loop up
+            return self.selector.select(timeout)
+        ready = self.selector.select(0)
+        if not ready and timeout > 0:
+            self.loop.advance(timeout)
+        return ready
+
+
+class VirtualTimeEventLoop(SelectorEventLoop):
+    def __init__(self, start_time: float = 0.0) -> None:
+        self.virtual_time = start_time
+        super().__init__(VirtualTimeSelector(self))
+
+    def time(self) -> float:
+        return self.virtual_time
+
+    def advance(self, delta: float) -> None:
+        self.virtual_time += delta
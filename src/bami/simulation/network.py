@@ -0,0 +1,134 @@
+"""
+Simulated network between endpoints on a virtual-time event loop.
+"""
+from asyncio import get_event_loop
+import random
+from typing import Any, Dict, Optional, Tuple
+
+from ipv8.messaging.interfaces.endpoint import Endpoint
+
+Address = Tuple[str, int]
+
+
+class NetworkModel(object):
+    """Latency, loss and bandwidth of the links between the nodes.
+
+    Every node has an uplink of `bandwidth` bytes per second: packets are sent one after the other,
+    a packet waits for the previous packets of the sender to be transmitted.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.05,
+        jitter: float = 0.0,
+        loss: float = 0.0,
+        bandwidth: Optional[float] = None,
+        seed: Any = 0,
+    ) -> None:
+        """
+        Args:
+            latency: one-way delay of a packet in seconds
+            jitter: maximum random delay added to the latency
+            loss: probability to drop a packet
+            bandwidth: uplink of a node in bytes per second, None for no limit
+            seed: seed of the random losses and jitter
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.bandwidth = bandwidth
+        self.random = random.Random(seed)
+        # Time when the uplink of the sender is free
+        self.uplink_free = dict()
+
+    def is_lost(self) -> bool:
+        return self.loss > 0 and self.random.random() < self.loss
+
+    def arrival_time(self, sender: Address, packet_size: int, now: float) -> float:
+        send_time = now
+        if self.bandwidth:
+            send_time = max(now, self.uplink_free.get(sender, now))
+            send_time += packet_size / self.bandwidth
+            self.uplink_free[sender] = send_time
+        delay = self.latency
+        if self.jitter:
+            delay += self.random.random() * self.jitter
+        return send_time + delay
+
+
+class NetworkStats(object):
+    def __init__(self) -> None:
+        self.messages_sent = 0
+        self.bytes_sent = 0
+        self.messages_lost = 0
+        self.messages_delivered = 0
+
+    def as_dict(self) -> Dict[str, int]:
+        return dict(self.__dict__)
+
+
+class SimulatedNetwork(object):
+    def __init__(self, model: NetworkModel = None) -> None:
+        self.model = model if model else NetworkModel()
+        self.endpoints = dict()
+        self.stats = NetworkStats()
+        self.next_host = 1
+
+    def create_endpoint(self) -> "SimulatedEndpoint":
+        address = (
+            "10.{}.{}.{}".format(
+                self.next_host >> 16, (self.next_host >> 8) & 255, self.next_host & 255
+            ),
+            8090,
+        )
+        self.next_host += 1
+        endpoint = SimulatedEndpoint(self, address)
+        self.endpoints[address] = endpoint
+        return endpoint
+
+    def send(self, sender: Address, address: Address, packet: bytes) -> None:
+        receiver = self.endpoints.get(address)
+        if not receiver:
+            return
+        self.stats.messages_sent += 1
+        self.stats.bytes_sent += len(packet)
+        if self.model.is_lost():
+            self.stats.messages_lost += 1
+            return
+        loop = get_event_loop()
+        arrival = self.model.arrival_time(sender, len(packet), loop.time())
+        loop.call_at(arrival, self.deliver, receiver, sender, packet)
+
+    def deliver(self, receiver: "SimulatedEndpoint", sender: Address, packet: bytes):
+        if receiver.is_open():
+            self.stats.messages_delivered += 1
+            receiver.notify_listeners((sender, packet))
+
+
+class SimulatedEndpoint(Endpoint):
+    def __init__(self, network: SimulatedNetwork, address: Address) -> None:
+        super().__init__()
+        self.network = network
+        self.lan_address = address
+        self.wan_address = address
+        self._port = address[1]
+        self._open = False
+
+    def assert_open(self) -> None:
+        assert self._open
+
+    def is_open(self) -> bool:
+        return self._open
+
+    def get_address(self) -> Address:
+        return self.wan_address
+
+    def send(self, socket_address: Address, packet: bytes) -> None:
+        if self._open:
+            self.network.send(self.wan_address, socket_address, packet)
+
+    def open(self) -> None:
+        self._open = True
+
+    def close(self, timeout: float = 0.0) -> None:
+        self._open = False
@@ -0,0 +1,87 @@
+"""
+Replay of recorded inbound packets into a fresh community, to profile identical traffic offline.
+
+Example:
+    node = create_replay_node(SimulatedPaymentCommunity, "/tmp/replay", key=recorded_key)
+    report = await replay(node.overlay, "node.rec", speed=0)
+"""
+from asyncio import get_event_loop, sleep
+from dataclasses import dataclass
+from typing import Type
+
+from bami.backbone.community import BamiCommunity
+from bami.backbone.recorder import PACKET, read_records, SUBSCRIPTION
+from bami.backbone.settings import BamiSettings
+from bami.simulation.network import SimulatedNetwork
+from bami.simulation.simulation import SimulatedNode
+from ipv8.keyvault.keys import Key
+
+
+@dataclass
+class ReplayReport:
+    packets: int
+    subscriptions: int
+    # Seconds between the first and the last record when they were recorded
+    recorded_time: float
+    # Seconds the replay took
+    replay_time: float
+
+    @property
+    def packets_per_second(self) -> float:
+        return self.packets / self.replay_time if self.replay_time else 0.0
+
+
+def create_replay_node(
+    overlay_class: Type[BamiCommunity],
+    work_dir: str,
+    key: Key = None,
+    settings: BamiSettings = None,
+) -> SimulatedNode:
+    """Node without peers, the packets it sends are dropped.
+
+    Args:
+        key: key of the recorded node, so that the packets addressed to it are handled the same
+    """
+    kwargs = {"settings": settings} if settings else {}
+    return SimulatedNode(SimulatedNetwork(), overlay_class, work_dir, key=key, **kwargs)
+
+
+async def replay(
+    overlay: BamiCommunity, path: str, speed: float = 1.0, batch: int = 100
+) -> ReplayReport:
+    """Feed the recorded packets and subscriptions to the community.
+
+    Args:
+        overlay: fresh community
+        path: log file of the recorder
+        speed: 1 for the recorded pace, 2 for twice as fast, 0 for as fast as possible
+        batch: at the maximum speed, other tasks run after every batch of packets
+    """
+    loop = get_event_loop()
+    start = loop.time()
+    first_time = last_time = None
+    packets = subscriptions = 0
+    for record in read_records(path):
+        if first_time is None:
+            first_time = record.time
+        last_time = record.time
+        if speed:
+            delay = (record.time - first_time) / speed - (loop.time() - start)
+            if delay > 0:
+                await sleep(delay)
+        elif (packets + 1) % batch == 0:
+            await sleep(0)
+        if record.kind == SUBSCRIPTION:
+            overlay.subscribe_to_subcom(record.data)
+            subscriptions += 1
+        elif record.kind == PACKET:
+            overlay.on_packet((record.address, record.data))
+            packets += 1
+    # Let the tasks started by the last packets run
+    await sleep(0)
+    return ReplayReport(
+        packets=packets,
+        subscriptions=subscriptions,
+        recorded_time=(last_time - first_time) if first_time is not None else 0.0,
+        replay_time=loop.time() - start,
+    )
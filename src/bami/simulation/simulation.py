@@ -0,0 +1,283 @@
+"""
+Many communities in one process on a virtual-time event loop, for convergence experiments.
+
+Example:
+    report = run_simulation(Simulation(100, model=NetworkModel(latency=0.1)).measure_convergence(10))
+"""
+from asyncio import all_tasks, gather, get_event_loop, set_event_loop, sleep
+from dataclasses import dataclass
+import os
+import random
+import shutil
+import tempfile
+from typing import Any, Callable, Coroutine, Iterable, List, Optional, Type
+
+from bami.backbone.community import BamiCommunity
+from bami.backbone.settings import BamiSettings, BlockStoreType
+from bami.backbone.sub_community import (
+    IPv8SubCommunityFactory,
+    RandomWalkDiscoveryStrategy,
+)
+from bami.backbone.utils import Dot
+from bami.payment.community import PaymentCommunity
+from bami.payment.settings import PaymentSettings
+from bami.simulation.loop import VirtualTimeEventLoop
+from bami.simulation.network import NetworkModel, SimulatedNetwork
+from ipv8.keyvault.crypto import default_eccrypto
+from ipv8.keyvault.keys import Key
+from ipv8.peer import Peer
+from ipv8.peerdiscovery.network import Network
+
+
+class SimulatedPaymentCommunity(
+    IPv8SubCommunityFactory, RandomWalkDiscoveryStrategy, PaymentCommunity
+):
+    pass
+
+
+class SimulatedNode(object):
+    """IPv8 stand-in with one overlay on a simulated endpoint"""
+
+    def __init__(
+        self,
+        sim_network: SimulatedNetwork,
+        overlay_class: Type[BamiCommunity],
+        work_dir: str,
+        key: Key = None,
+        **kwargs
+    ) -> None:
+        self.endpoint = sim_network.create_endpoint()
+        self.endpoint.open()
+        self.network = Network()
+        if not key:
+            key = default_eccrypto.generate_key(u"curve25519")
+        self.my_peer = Peer(key, self.endpoint.wan_address)
+        self.overlays = []
+        self.strategies = []
+        self.overlay = overlay_class(
+            self.my_peer, self.endpoint, self.network, work_dir=work_dir, **kwargs
+        )
+        self.overlay._use_main_thread = False
+        self.overlay.ipv8 = self
+        self.overlay.my_estimated_wan = self.endpoint.wan_address
+        self.overlay.my_estimated_lan = self.endpoint.lan_address
+
+    async def unload(self) -> None:
+        self.endpoint.close()
+        for overlay in self.overlays:
+            await overlay.unload()
+        await self.overlay.unload()
+
+
+@dataclass
+class ConvergenceReport:
+    num_nodes: int
+    num_blocks: int
+    # Every node received every block
+    converged: bool
+    # Virtual seconds from the first created block until the last node received the last block
+    convergence_time: float
+    messages: int
+    bytes: int
+
+    @property
+    def messages_per_block(self) -> float:
+        return self.messages / self.num_blocks if self.num_blocks else 0.0
+
+    @property
+    def bytes_per_block(self) -> float:
+        return self.bytes / self.num_blocks if self.num_blocks else 0.0
+
+
+def default_settings() -> PaymentSettings:
+    settings = PaymentSettings()
+    # Nodes keep the blocks in memory and do not write snapshots
+    settings.block_store_type = BlockStoreType.MEMORY
+    settings.snapshot_interval = 0
+    return settings
+
+
+def mint_block(overlay: PaymentCommunity) -> None:
+    overlay.mint(value=overlay.to_amount(1), chain_id=overlay.my_pub_key_bin)
+
+
+class Simulation(object):
+    def __init__(
+        self,
+        num_nodes: int,
+        overlay_class: Type[BamiCommunity] = SimulatedPaymentCommunity,
+        model: NetworkModel = None,
+        settings: BamiSettings = None,
+        degree: Optional[int] = None,
+        seed: Any = 0,
+        work_dir: str = None,
+    ) -> None:
+        """
+        Args:
+            num_nodes: number of nodes
+            overlay_class: class of the community every node runs
+            model: latency, loss and bandwidth of the network
+            settings: settings shared by the nodes, e.g. with the gossip parameters
+            degree: number of random neighbours of a node, every node knows every other node if None
+            seed: seed of the keys and the random choices. Runs with the same seed and PYTHONHASHSEED
+             differ only by the wall-clock timestamps of the blocks
+            work_dir: directory for the node directories, temporary directory if None
+        """
+        self.num_nodes = num_nodes
+        self.overlay_class = overlay_class
+        self.sim_network = SimulatedNetwork(model)
+        self.settings = settings if settings else default_settings()
+        self.degree = degree
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.own_work_dir = work_dir is None
+        self.work_dir = work_dir if work_dir else tempfile.mkdtemp(prefix="bami_sim_")
+        self.nodes = []
+
+    @property
+    def overlays(self) -> List[BamiCommunity]:
+        return [node.overlay for node in self.nodes]
+
+    @property
+    def stats(self):
+        return self.sim_network.stats
+
+    def start(self, community_id: bytes = None) -> bytes:
+        """Create and connect the nodes and subscribe them to the community.
+        Must run in the simulation loop.
+
+        Returns:
+            Community id, the key of the first node by default
+        """
+        # Gossip peer selection and delays use the global random
+        random.seed(self.seed)
+        for i in range(self.num_nodes):
+            work_dir = os.path.join(self.work_dir, str(i))
+            self.nodes.append(
+                SimulatedNode(
+                    self.sim_network,
+                    self.overlay_class,
+                    work_dir,
+                    key=self.generate_key(),
+                    settings=self.settings,
+                )
+            )
+        self.connect()
+        if not community_id:
+            community_id = self.overlays[0].my_pub_key_bin
+        for overlay in self.overlays:
+            overlay.subscribe_to_subcom(community_id)
+        return community_id
+
+    def generate_key(self) -> Key:
+        """Curve25519 key derived from the seed of the simulation"""
+        key_bytes = bytes(self.random.getrandbits(8) for _ in range(64))
+        return default_eccrypto.key_from_private_bin(b"LibNaCLSK:" + key_bytes)
+
+    def connect(self) -> None:
+        for node in self.nodes:
+            others = [other for other in self.nodes if other is not node]
+            if self.degree is not None:
+                others = self.random.sample(others, min(self.degree, len(others)))
+            for other in others:
+                public_peer = Peer(other.my_peer.public_key, other.my_peer.address)
+                node.network.add_verified_peer(public_peer)
+                node.network.discover_services(
+                    public_peer, [self.overlay_class.master_peer.mid]
+                )
+
+    async def stop(self) -> None:
+        for node in self.nodes:
+            await node.unload()
+        self.nodes = []
+        if self.own_work_dir:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def has_blocks(self, chain_id: bytes, dots: Iterable[Dot]) -> bool:
+        """All nodes know the blocks"""
+        for overlay in self.overlays:
+            chain = overlay.persistence.get_chain(chain_id)
+            if not chain:
+                return False
+            for seq_num, short_hash in dots:
+                if short_hash not in chain.versions.get(seq_num, ()):
+                    return False
+        return True
+
+    async def wait_until(
+        self, predicate: Callable[[], bool], timeout: float, step: float = 0.01
+    ) -> bool:
+        """Wait in virtual time until the predicate holds. Returns False on timeout."""
+        waited = 0.0
+        while not predicate():
+            if waited >= timeout:
+                return False
+            await sleep(step)
+            waited += step
+        return True
+
+    async def measure_convergence(
+        self,
+        num_blocks: int,
+        create_block: Callable[[BamiCommunity], None] = mint_block,
+        block_interval: float = 0.0,
+        timeout: float = 60.0,
+        warmup: float = 1.0,
+    ) -> ConvergenceReport:
+        """Create the blocks on the first node and wait until all nodes received them.
+        Convergence is checked every 10 ms of virtual time.
+
+        Args:
+            num_blocks: number of blocks to create
+            create_block: creates and shares one block on the community chain of the overlay
+            block_interval: virtual time between the blocks
+            timeout: maximum virtual time to wait for the convergence
+            warmup: virtual time for the nodes to exchange the subscriptions before the first block
+        """
+        community_id = self.start()
+        try:
+            await sleep(warmup)
+            creator = self.overlays[0]
+            start_time = get_event_loop().time()
+            start_messages = self.stats.messages_sent
+            start_bytes = self.stats.bytes_sent
+            for i in range(num_blocks):
+                if i and block_interval:
+                    await sleep(block_interval)
+                create_block(creator)
+            chain = creator.persistence.get_chain(community_id)
+            dots = [
+                Dot((seq_num, short_hash))
+                for seq_num, hashes in chain.versions.items()
+                for short_hash in hashes
+            ]
+            converged = await self.wait_until(
+                lambda: self.has_blocks(community_id, dots), timeout
+            )
+            report = ConvergenceReport(
+                num_nodes=self.num_nodes,
+                num_blocks=len(dots),
+                converged=converged,
+                convergence_time=get_event_loop().time() - start_time,
+                messages=self.stats.messages_sent - start_messages,
+                bytes=self.stats.bytes_sent - start_bytes,
+            )
+        finally:
+            await self.stop()
+        return report
+
+
+def run_simulation(coro: Coroutine, start_time: float = 0.0) -> Any:
+    """Run the coroutine to completion on a new virtual-time event loop"""
+    loop = VirtualTimeEventLoop(start_time)
+    set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        tasks = all_tasks(loop)
+        for task in tasks:
+            task.cancel()
+        loop.run_until_complete(gather(*tasks, return_exceptions=True))
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
+        set_event_loop(None)
@@ -1,5 +1,14 @@
 import pytest
-from bami.backbone.datastore.block_store import LMDBLockStore
+from bami.backbone.datastore.block_store import (
+    DOT_KEY_VERSION,
+    get_blob_spans,
+    LMDBDirectBlockStore,
+    LMDBLockStore,
+    MemoryBlockStore,
+)
+from bami.backbone.datastore.cache import ENTRY_OVERHEAD
+from bami.backbone.datastore.segment_store import SegmentLogBlockStore
+from bami.backbone.utils import Dot, encode_dot_key, encode_raw, ShortKey
 
 
 @pytest.fixture
@@ -13,6 +22,25 @@ def lmdb_store(tmpdir):
     tmp_val.remove()
 
 
+@pytest.fixture
+def direct_store(tmpdir):
+    db = LMDBDirectBlockStore(str(tmpdir))
+    yield db
+    db.close()
+
+
+@pytest.fixture(
+    params=[LMDBLockStore, LMDBDirectBlockStore, SegmentLogBlockStore, MemoryBlockStore]
+)
+def block_store(request, tmpdir):
+    if request.param is MemoryBlockStore:
+        db = MemoryBlockStore()
+    else:
+        db = request.param(str(tmpdir))
+    yield db
+    db.close()
+
+
 def test_add_block(lmdb_store):
     test_blob = b"123123123123123"
     test_key = b"lopo1"
@@ -38,3 +66,131 @@ def test_add_dot(lmdb_store):
     lmdb_store.add_dot(test_key, test_blob)
     res = lmdb_store.get_hash_by_dot(test_key)
     assert res == test_blob
+
+
+def test_new_store_has_latest_layout(lmdb_store):
+    assert lmdb_store.dot_key_version == DOT_KEY_VERSION
+    assert not lmdb_store.needs_migration
+
+
+def test_blobs_by_seq_range(block_store):
+    chain_id = b"chain"
+    other_chain_id = b"other"
+    for seq_num in range(1, 300):
+        for chain in (chain_id, other_chain_id):
+            blk_hash = chain + bytes([seq_num % 256]) + seq_num.to_bytes(2, "big")
+            block_store.add_block(blk_hash, blk_hash)
+            block_store.add_dot(
+                encode_dot_key(chain, Dot((seq_num, ShortKey(b"12345678")))), blk_hash
+            )
+
+    blobs = block_store.get_block_blobs_by_seq_range(chain_id, 100, 200)
+    assert len(blobs) == 101
+    assert all(b.startswith(chain_id) for b in blobs)
+    assert not block_store.get_block_blobs_by_seq_range(chain_id, 300, 400)
+
+
+def test_blob_spans():
+    block_blob = b"\x00\x00\x00\x04test\x00\x00\x00\x02tx" + b"rest"
+    (type_start, type_end), (tx_start, tx_end) = get_blob_spans(block_blob)
+    assert block_blob[type_start:type_end] == b"test"
+    assert block_blob[tx_start:tx_end] == b"tx"
+
+
+def test_direct_store_reads(direct_store):
+    block_blob = b"\x00\x00\x00\x04test\x00\x00\x00\x02tx" + b"rest"
+    com_dot = encode_dot_key(b"com", Dot((1, ShortKey(b"12345678"))))
+    pers_dot = encode_dot_key(b"pers", Dot((1, ShortKey(b"12345678"))))
+    direct_store.put_block(b"hash", block_blob, b"tx", b"", [com_dot, pers_dot])
+
+    for dot in (com_dot, pers_dot):
+        assert direct_store.get_block_by_dot(dot) == block_blob
+        assert direct_store.get_hash_by_dot(dot) == b"hash"
+        assert direct_store.get_tx_by_dot(dot) == b"tx"
+        assert direct_store.get_extra_by_dot(dot) == encode_raw({b"type": b"test"})
+    assert direct_store.get_block_by_hash(b"hash") == block_blob
+    assert direct_store.get_tx_by_hash(b"hash") == b"tx"
+    assert direct_store.has_block(b"hash")
+    assert not direct_store.has_block(b"other_hash")
+    assert direct_store.get_block_by_dot(b"other_dot") is None
+    assert direct_store.get_block_blobs_by_seq_range(b"pers", 1, 1) == [block_blob]
+
+
+def test_direct_store_late_dot(direct_store):
+    direct_store.add_block(b"hash", b"blob")
+    assert direct_store.get_block_by_hash(b"hash") == b"blob"
+    direct_store.add_dot(b"dot1", b"hash")
+    direct_store.add_dot(b"dot2", b"hash")
+    assert direct_store.get_block_by_dot(b"dot1") == b"blob"
+    assert direct_store.get_block_by_dot(b"dot2") == b"blob"
+    assert direct_store.get_block_by_hash(b"hash") == b"blob"
+    with pytest.raises(KeyError):
+        direct_store.add_dot(b"dot3", b"unknown")
+
+
+def test_put_block(block_store):
+    block_blob = b"\x00\x00\x00\x04test\x00\x00\x00\x02tx" + b"rest"
+    extra = encode_raw({b"type": b"test"})
+    dots = [
+        encode_dot_key(chain_id, Dot((1, ShortKey(b"12345678"))))
+        for chain_id in (b"com", b"pers")
+    ]
+    block_store.put_block(b"hash", block_blob, b"tx", extra, dots)
+
+    for dot in dots:
+        assert block_store.get_block_by_dot(dot) == block_blob
+        assert block_store.get_hash_by_dot(dot) == b"hash"
+        assert block_store.get_tx_by_dot(dot) == b"tx"
+        assert block_store.get_extra_by_dot(dot) == extra
+    assert block_store.get_block_by_hash(b"hash") == block_blob
+    assert block_store.has_block(b"hash")
+    assert not block_store.has_block(b"other_hash")
+
+
+def test_memory_store_eviction():
+    blob = b"1" * 100
+    store = MemoryBlockStore(max_bytes=3 * (len(blob) + ENTRY_OVERHEAD))
+    for i in range(4):
+        dot = encode_dot_key(b"chain", Dot((i + 1, ShortKey(b"12345678"))))
+        store.put_block(bytes([i]), blob, b"", b"", [dot])
+    # The least recently used block is evicted with its dots
+    assert not store.has_block(bytes([0]))
+    assert (
+        store.get_block_by_dot(
+            encode_dot_key(b"chain", Dot((1, ShortKey(b"12345678"))))
+        )
+        is None
+    )
+    assert len(store.get_block_blobs_by_seq_range(b"chain", 1, 4)) == 3
+    assert store.current_bytes <= store.max_bytes
+
+
+def test_memory_store_dot_added_twice():
+    blob = b"1" * 100
+    store = MemoryBlockStore(max_bytes=3 * (len(blob) + ENTRY_OVERHEAD))
+    dot = encode_dot_key(b"chain", Dot((1, ShortKey(b"12345678"))))
+    store.add_block(b"h1", blob)
+    store.add_dot(dot, b"h1")
+    store.add_dot(dot, b"h1")
+    for block_hash in (b"h2", b"h3", b"h4"):
+        store.add_block(block_hash, blob)
+    assert not store.has_block(b"h1")
+    assert store.get_block_by_dot(dot) is None
+    assert not store.get_block_blobs_by_seq_range(b"chain", 1, 1)
+
+
+def test_memory_store_dot_moved_to_other_block():
+    blob = b"1" * 100
+    store = MemoryBlockStore(max_bytes=3 * (len(blob) + ENTRY_OVERHEAD))
+    dot = encode_dot_key(b"chain", Dot((1, ShortKey(b"12345678"))))
+    store.add_block(b"h1", blob)
+    store.add_dot(dot, b"h1")
+    store.add_block(b"h2", b"2" * 100)
+    store.add_dot(dot, b"h2")
+    store.add_block(b"h3", blob)
+    store.add_block(b"h4", blob)
+    # Eviction of the old block keeps the dot of the new one
+    assert not store.has_block(b"h1")
+    assert store.get_block_by_dot(dot) == b"2" * 100
+    assert store.get_hash_by_dot(dot) == b"h2"
+    assert store.get_block_blobs_by_seq_range(b"chain", 1, 1) == [b"2" * 100]
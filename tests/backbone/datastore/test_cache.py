@@ -0,0 +1,97 @@
+from bami.backbone.datastore.cache import BlobCache, ENTRY_OVERHEAD, TermCacheBudget
+from bami.backbone.utils import memory_usage
+
+
+def test_disabled_cache():
+    cache = BlobCache(0)
+    cache.put_blob(b"hash", b"blob", [b"dot"])
+    assert not cache.enabled
+    assert cache.get_blob(b"dot") is None
+    assert not cache.has_hash(b"hash")
+    assert cache.stats()["blob_misses"] == 1
+
+
+def test_blob_hits():
+    cache = BlobCache(10 * 1024)
+    cache.put_blob(b"hash", b"blob", [b"dot"])
+
+    assert cache.has_hash(b"hash")
+    assert cache.get_blob(b"dot") == b"blob"
+    assert cache.get_blob(b"other_dot") is None
+
+    stats = cache.stats()
+    assert stats["blob_hits"] == 1 and stats["blob_misses"] == 1
+    assert stats["blob_hit_rate"] == 0.5
+
+
+def test_blob_cached_once_for_all_dots():
+    blob = b"1" * 100
+    cache = BlobCache(10 * 1024)
+    cache.put_blob(b"hash", blob, [b"com_dot", b"pers_dot"])
+    assert cache.get_blob(b"com_dot") == blob
+    assert cache.get_blob(b"pers_dot") == blob
+    # One blob and two references to its hash
+    assert cache.current_bytes == len(blob) + 2 * len(b"hash") + 3 * ENTRY_OVERHEAD
+
+
+def test_size_based_eviction():
+    blob = b"1" * 100
+    entry_size = len(blob) + 1 + 2 * ENTRY_OVERHEAD
+    cache = BlobCache(3 * entry_size)
+    for i in range(4):
+        cache.put_blob(bytes([i]), blob, [bytes([i])])
+    # The least recently used blob is evicted
+    assert cache.get_blob(bytes([0])) is None
+    assert all(cache.get_blob(bytes([i])) == blob for i in range(1, 4))
+    assert cache.current_bytes <= cache.max_bytes
+
+
+def test_too_large_blob_not_cached():
+    cache = BlobCache(100)
+    cache.put_blob(b"hash", b"1" * 100, [b"dot"])
+    assert cache.get_blob(b"dot") is None
+    assert cache.has_hash(b"hash")
+
+
+def test_term_cache_budget_shared():
+    budget = TermCacheBudget(4)
+    hot, cold = budget.chain_cache(), budget.chain_cache()
+    hot["a"] = 1
+    cold["a"] = 2
+    hot["b"] = 3
+    # Same key in another chain is another entry
+    assert hot.get("a") == 1 and cold.get("a") == 2
+    assert len(hot) == 2 and len(cold) == 1
+
+    # The least recently used entries are evicted, whichever chain they belong to
+    hot.get("a")
+    hot["c"] = 4
+    hot["d"] = 5
+    assert len(hot) == 3 and len(cold) == 1
+    hot["e"] = 6
+    assert len(hot) == 4 and len(cold) == 0
+    assert cold.get("a") is None
+    assert sorted(hot) == ["a", "c", "d", "e"]
+
+    del hot["a"]
+    assert len(hot) == 3 and "a" not in hot
+    stats = budget.stats()
+    assert stats["entries"] == 3
+    assert stats["chains"] == 1
+    assert stats["evictions"] == 2
+    assert stats["hits"] == 3 and stats["misses"] == 1
+
+
+def test_term_cache_report_keeps_eviction_order():
+    budget = TermCacheBudget(3)
+    chain_a, chain_b = budget.chain_cache(), budget.chain_cache()
+    chain_a["old"] = 1
+    chain_a["new"] = 2
+    chain_b["x"] = 3
+
+    # Report of chain A reads its entries only, without refreshing them
+    assert dict(chain_a.items()) == {"old": 1, "new": 2}
+    assert memory_usage(len(chain_a), chain_a)["entries"] == 2
+    chain_b["y"] = 4
+    assert sorted(chain_a) == ["new"]
+    assert sorted(chain_b) == ["x", "y"]
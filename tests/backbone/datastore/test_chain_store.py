@@ -1,7 +1,7 @@
 from itertools import chain
 
 import pytest
-from bami.backbone.datastore.chain_store import Chain
+from bami.backbone.datastore.chain_store import Chain, ChainFactory
 from bami.backbone.utils import (
     expand_ranges,
     GENESIS_DOT,
@@ -457,3 +457,91 @@ def test_empty_get_dots(create_batches):
     chain = Chain()
     v = chain.get_dots_by_seq_num(1)
     assert len(list(v)) == 0
+
+
+def test_shared_term_cache(create_batches):
+    batches = create_batches(2, 30)
+    # The budget is smaller than the links of one chain
+    factory = ChainFactory(term_cache_size=16)
+    chains = [factory.create_chain() for _ in batches]
+    own_chains = [Chain() for _ in batches]
+    for blocks, chain, own_chain in zip(batches, chains, own_chains):
+        for blk in reversed(blocks):
+            chain.add_block(blk.links, blk.com_seq_num, blk.hash)
+            own_chain.add_block(blk.links, blk.com_seq_num, blk.hash)
+
+    for chain, own_chain in zip(chains, own_chains):
+        assert chain.terminal == own_chain.terminal
+        assert chain.frontier == own_chain.frontier
+    assert sum(len(chain.term_cache) for chain in chains) <= 16
+    assert factory.term_caches.stats()["evictions"] > 0
+    report = chains[0].memory_report()["term_cache"]
+    assert report["entries"] == len(chains[0].term_cache)
+    assert ChainFactory().create_chain().term_cache.maxsize == 10_000
+
+
+def test_memory_report(create_batches):
+    blocks = create_batches(1, 10)[0]
+    chain = Chain()
+    empty = chain.memory_report()
+    assert not any(usage["entries"] for usage in empty.values())
+
+    # A hole at the second block
+    for blk in blocks[:1] + blocks[2:]:
+        chain.add_block(blk.links, blk.com_seq_num, blk.hash)
+    chain.watch_dot(blocks[5].com_dot)
+    report = chain.memory_report()
+    assert report["versions"]["entries"] == 9
+    assert report["back_pointers"]["entries"] == 9
+    assert report["holes"]["entries"] == 1
+    assert report["reach_masks"]["entries"] > 0
+    for structure in ("versions", "forward_pointers", "back_pointers", "holes"):
+        assert report[structure]["bytes"] > empty[structure]["bytes"]
+
+
+class TestReachability:
+    def test_watched_dot(self, create_batches):
+        batches = create_batches(2, 10)
+        chain = Chain()
+        for blk in batches[0][:5]:
+            chain.add_block(blk.links, blk.com_seq_num, blk.hash)
+        target = batches[0][2].com_dot
+        chain.watch_dot(target)
+        for blk in batches[0][5:] + batches[1]:
+            chain.add_block(blk.links, blk.com_seq_num, blk.hash)
+
+        assert not chain.is_reachable(target, target)
+        assert not chain.is_reachable(target, batches[0][1].com_dot)
+        assert all(chain.is_reachable(target, b.com_dot) for b in batches[0][3:])
+        assert not any(chain.is_reachable(target, b.com_dot) for b in batches[1])
+
+    def test_hole_filled(self, create_batches):
+        blocks = create_batches(1, 10)[0]
+        chain = Chain()
+        target = blocks[1].com_dot
+        chain.watch_dot(target)
+        for blk in blocks[:3] + blocks[4:]:
+            chain.add_block(blk.links, blk.com_seq_num, blk.hash)
+        assert chain.is_reachable(target, blocks[2].com_dot)
+        assert not chain.is_reachable(target, blocks[-1].com_dot)
+
+        blk = blocks[3]
+        chain.add_block(blk.links, blk.com_seq_num, blk.hash)
+        assert chain.is_reachable(target, blocks[-1].com_dot)
+
+    def test_unwatch_reuses_bit(self, create_batches):
+        blocks = create_batches(1, 10)[0]
+        chain = Chain()
+        for blk in blocks:
+            chain.add_block(blk.links, blk.com_seq_num, blk.hash)
+        chain.watch_dot(blocks[5].com_dot)
+        chain.unwatch_dot(blocks[5].com_dot)
+        assert not chain.reach_masks
+
+        chain.watch_dot(blocks[7].com_dot)
+        assert chain.watched_bits[blocks[7].com_dot] == 1
+        assert not chain.is_reachable(blocks[7].com_dot, blocks[6].com_dot)
+        assert chain.is_reachable(blocks[7].com_dot, blocks[8].com_dot)
+        # Not watched dots are checked with a walk over the back links
+        assert chain.is_reachable(blocks[5].com_dot, blocks[8].com_dot)
+        assert not chain.is_reachable(blocks[8].com_dot, blocks[5].com_dot)
@@ -1,17 +1,23 @@
 import pytest
-from bami.backbone.datastore.block_store import LMDBLockStore
+from bami.backbone.datastore.block_store import LMDBDirectBlockStore, LMDBLockStore
+from bami.backbone.datastore.cache import BlobCache, ENTRY_OVERHEAD
 from bami.backbone.datastore.chain_store import ChainFactory
-from bami.backbone.datastore.database import ChainTopic, DBManager
+from bami.backbone.datastore.database import ChainTopic, DBManager, get_block_chain_ids
 from bami.backbone.datastore.frontiers import Frontier, FrontierDiff
+from bami.backbone.datastore.migrations import (
+    migrate_dot_keys,
+    migrate_to_direct_layout,
+)
 from bami.backbone.utils import (
     Dot,
+    encode_dot_key,
     encode_raw,
     Ranges,
     ShortKey,
     wrap_iterate,
 )
 
-from tests.conftest import FakeBlock
+from tests.conftest import FakeBlock, insert_batch_seq
 from tests.mocking.mock_db import MockBlockStore, MockChain, MockChainFactory
 
 
@@ -25,9 +31,8 @@ class TestDBManager:
     @pytest.fixture
     def std_vals(self):
         self.chain_id = b"chain_id"
-        self.block_dot = Dot((3, ShortKey("808080")))
-        self.block_dot_encoded = encode_raw(self.block_dot)
-        self.dot_id = self.chain_id + self.block_dot_encoded
+        self.block_dot = Dot((3, ShortKey(b"808080")))
+        self.dot_id = encode_dot_key(self.chain_id, self.block_dot)
 
         self.test_hash = b"test_hash"
         self.tx_blob = b"tx_blob"
@@ -103,20 +108,26 @@ class TestDBManager:
             MockBlockStore, "get_block_by_hash", lambda _, blob_hash: bytes(blob_hash)
         )
         monkeypatch.setattr(
-            MockChain, "get_dots_by_seq_num", lambda _, seq_num: ("dot1", "dot2")
+            MockChain,
+            "get_dots_by_seq_num",
+            lambda _, seq_num: (
+                Dot((seq_num, ShortKey(b"dot1"))),
+                Dot((seq_num, ShortKey(b"dot2"))),
+            ),
         )
 
         # init chain
         chain_id = self.chain_id
         self.dbms.chains[chain_id] = MockChain()
-        frontier_diff = FrontierDiff(Ranges(((1, 2),)), {(1, ShortKey("efef")): {}})
+        frontier_diff = FrontierDiff(Ranges(((1, 2),)), {(1, ShortKey(b"efef")): {}})
         vals_to_request = set()
 
         blobs = self.dbms.get_block_blobs_by_frontier_diff(
             chain_id, frontier_diff, vals_to_request
         )
         assert len(vals_to_request) == 0
-        assert len(blobs) == 3
+        # Two versions for each of the two missing sequence numbers and the conflict
+        assert len(blobs) == 5
 
     def test_blocks_frontier_with_extra_request(self, monkeypatch, std_vals):
         monkeypatch.setattr(
@@ -126,10 +137,15 @@ class TestDBManager:
             MockBlockStore, "get_block_by_hash", lambda _, blob_hash: self.block_blob
         )
         monkeypatch.setattr(
-            MockChain, "get_dots_by_seq_num", lambda _, seq_num: ("dot1", "dot2")
+            MockChain,
+            "get_dots_by_seq_num",
+            lambda _, seq_num: (
+                Dot((seq_num, ShortKey(b"dot1"))),
+                Dot((seq_num, ShortKey(b"dot2"))),
+            ),
         )
 
-        local_vers = {2: {"ef1"}, 7: {"ef1"}}
+        local_vers = {2: {b"ef1"}, 7: {b"ef1"}}
 
         monkeypatch.setattr(
             MockChain,
@@ -139,14 +155,14 @@ class TestDBManager:
         monkeypatch.setattr(
             MockChain,
             "get_next_links",
-            lambda _, dot: ((dot[0] + 1, ShortKey("efef")),),
+            lambda _, dot: ((dot[0] + 1, ShortKey(b"efef")),),
         )
 
         # init chain
         chain_id = self.chain_id
         self.dbms.chains[chain_id] = MockChain()
         frontier_diff = FrontierDiff(
-            (), {(10, ShortKey("efef")): {2: ("ef1",), 7: ("ef2",)}}
+            (), {(10, ShortKey(b"efef")): {2: (b"ef1",), 7: (b"ef2",)}}
         )
 
         set_to_request = set()
@@ -243,6 +259,148 @@ class TestIntegrationDBManager:
             == packed_block
         )
 
+    def test_cached_block_reads(self):
+        dbms = DBManager(self.chain_factory, self.block_store, cache_size=1024 * 1024)
+        test_block = FakeBlock()
+        packed_block = test_block.pack()
+        dbms.add_block(packed_block, test_block)
+
+        for _ in range(3):
+            blob = dbms.get_block_blob_by_dot(test_block.com_id, test_block.com_dot)
+            assert blob == packed_block
+        pers_id = get_block_chain_ids(test_block)[0]
+        assert dbms.get_block_blob_by_dot(pers_id, test_block.pers_dot) == packed_block
+        assert dbms.has_block(test_block.hash)
+        stats = dbms.cache_stats()
+        assert stats["blob_hits"] == 4 and stats["blob_misses"] == 0
+        # The blob is cached once, the dots of both chains refer to its hash
+        assert (
+            stats["current_bytes"]
+            == len(packed_block) + 2 * len(test_block.hash) + 3 * ENTRY_OVERHEAD
+        )
+
+    def test_migrate_legacy_dot_keys(self, create_batches):
+        blks = create_batches(num_batches=1, num_blocks=10)[0]
+        com_id = blks[0].com_id
+        for blk in blks:
+            self.block_store.add_block(blk.hash, blk.pack())
+            for chain_id, dot in (
+                (blk.public_key, blk.pers_dot),
+                (com_id, blk.com_dot),
+            ):
+                self.block_store.add_dot(chain_id + encode_raw(dot), blk.hash)
+        self.block_store.set_dot_key_version(1)
+        assert self.block_store.needs_migration
+
+        assert migrate_dot_keys(self.block_store) == 20
+        assert not self.block_store.needs_migration
+        for blk in blks:
+            assert self.dbms.get_block_blob_by_dot(com_id, blk.com_dot) == blk.pack()
+            assert (
+                self.dbms.get_block_blob_by_dot(blk.public_key, blk.pers_dot)
+                == blk.pack()
+            )
+
+    def test_migrate_to_direct_layout(self, create_batches, tmpdir):
+        blks = create_batches(num_batches=1, num_blocks=10)[0]
+        com_id = blks[0].com_id
+        block_dir = str(tmpdir.mkdir("direct"))
+        dbms = DBManager(ChainFactory(), LMDBLockStore(block_dir))
+        wrap_iterate(insert_batch_seq(dbms, blks))
+        dbms.close()
+
+        direct_store = LMDBDirectBlockStore(block_dir)
+        assert direct_store.needs_migration
+        assert migrate_to_direct_layout(direct_store) == 10
+        assert not direct_store.needs_migration
+
+        dbms = DBManager(ChainFactory(), direct_store)
+        for blk in blks:
+            assert dbms.get_block_blob_by_dot(com_id, blk.com_dot) == blk.pack()
+            assert (
+                dbms.get_block_blob_by_dot(blk.public_key, blk.pers_dot) == blk.pack()
+            )
+            assert dbms.get_tx_blob_by_dot(com_id, blk.com_dot) == blk.transaction
+            assert dbms.has_block(blk.hash)
+        dbms.close()
+
+    def test_direct_store_frontier_diff(self, create_batches, tmpdir):
+        blks = create_batches(num_batches=1, num_blocks=40)[0]
+        com_id = blks[0].com_id
+        dbms = DBManager(
+            ChainFactory(), LMDBDirectBlockStore(str(tmpdir.mkdir("direct")))
+        )
+        wrap_iterate(insert_batch_seq(dbms, blks))
+
+        for missing in (((1, 40),), ((1, 5), (30, 31))):
+            front_diff = FrontierDiff(Ranges(missing), {})
+            blobs = dbms.get_block_blobs_by_frontier_diff(com_id, front_diff, set())
+            assert blobs == {
+                blk.pack()
+                for blk in blks
+                if any(s <= blk.com_seq_num <= e for s, e in missing)
+            }
+        dbms.close()
+
+    def test_missing_range_with_store_scan(self, create_batches):
+        blks = create_batches(num_batches=1, num_blocks=40)[0]
+        com_id = blks[0].com_id
+        wrap_iterate(insert_batch_seq(self.dbms, blks))
+
+        front_diff = FrontierDiff(Ranges(((1, 40),)), {})
+        blobs = self.dbms.get_block_blobs_by_frontier_diff(com_id, front_diff, set())
+        assert blobs == {blk.pack() for blk in blks}
+
+    def test_missing_range_scan_fills_cache(self, create_batches, monkeypatch):
+        blks = create_batches(num_batches=1, num_blocks=40)[0]
+        com_id = blks[0].com_id
+        dbms = DBManager(self.chain_factory, self.block_store)
+        wrap_iterate(insert_batch_seq(dbms, blks))
+        # Blobs are only in the block store
+        dbms.blob_cache = BlobCache(1024 * 1024)
+
+        front_diff = FrontierDiff(Ranges(((1, 40),)), {})
+        blobs = dbms.get_block_blobs_by_frontier_diff(com_id, front_diff, set())
+        assert blobs == {blk.pack() for blk in blks}
+        assert all(dbms.blob_cache.has_hash(blk.hash) for blk in blks)
+
+        def no_scan(*args):
+            raise AssertionError("Blobs are cached")
+
+        monkeypatch.setattr(self.block_store, "get_dot_blocks_by_seq_range", no_scan)
+        assert dbms.get_block_blobs_by_frontier_diff(com_id, front_diff, set()) == blobs
+
+    @pytest.mark.parametrize("missing", [((1, 40),), ((15, 20),)])
+    def test_missing_block_in_store(self, create_batches, missing):
+        blks = create_batches(num_batches=1, num_blocks=40)[0]
+        com_id = blks[0].com_id
+        for blk in blks:
+            if blk.com_seq_num == 18:
+                # Known to the chain, but not stored
+                self.dbms._add_block_to_chains(blk)
+            else:
+                self.dbms.add_block(blk.pack(), blk)
+        self.dbms.blob_cache = BlobCache(1024 * 1024)
+
+        front_diff = FrontierDiff(Ranges(missing), {})
+        with pytest.raises(Exception, match="No block"):
+            self.dbms.get_block_blobs_by_frontier_diff(com_id, front_diff, set())
+
+    def test_memory_report(self, create_batches):
+        blks = create_batches(num_batches=1, num_blocks=20)[0]
+        com_id = blks[0].com_id
+        wrap_iterate(insert_batch_seq(self.dbms, blks))
+        self.dbms.set_last_reconcile_point(com_id, b"peer", 10)
+
+        report = self.dbms.memory_report()
+        assert report["chains"][com_id]["versions"]["entries"] == 20
+        assert report["chain_totals"]["versions"]["entries"] >= 20
+        assert report["chain_totals"]["versions"]["bytes"] >= sum(
+            chain["versions"]["bytes"] for chain in report["chains"].values()
+        )
+        assert report["last_reconcile_seq_num"]["entries"] == 1
+        assert report["blob_cache"] == {"entries": 0, "bytes": 0}
+
     def test_add_notify_block_one_chain(self, create_batches, insert_function):
         self.val_dots = []
 
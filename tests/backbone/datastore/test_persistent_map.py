@@ -0,0 +1,89 @@
+import random
+
+from bami.backbone.datastore.persistent_map import PersistentMap
+from bami.backbone.utils import deep_sizeof
+
+
+class SameHash:
+    """Key with a chosen hash, to force collisions"""
+
+    def __init__(self, name: str, key_hash: int) -> None:
+        self.name = name
+        self.key_hash = key_hash
+
+    def __hash__(self) -> int:
+        return self.key_hash
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, SameHash) and self.name == other.name
+
+    def __repr__(self) -> str:
+        return self.name
+
+
+def test_empty_map():
+    pmap = PersistentMap()
+    assert len(pmap) == 0
+    assert list(pmap) == []
+    assert pmap.get(b"key") is None
+    assert b"key" not in pmap
+    assert pmap == {}
+
+
+def test_matches_dict():
+    rand = random.Random(42)
+    pmap = PersistentMap()
+    expected = {}
+    for _ in range(3000):
+        key = rand.getrandbits(16).to_bytes(2, "big")
+        value = rand.random()
+        pmap = pmap.set(key, value)
+        expected[key] = value
+    for key in list(expected)[:500]:
+        pmap = pmap.set(key, -1)
+        expected[key] = -1
+
+    assert len(pmap) == len(expected)
+    assert pmap == expected
+    assert dict(pmap.items()) == expected
+    assert set(pmap) == set(expected)
+    assert all(pmap[key] == value for key, value in expected.items())
+
+
+def test_snapshots_unchanged_by_set():
+    first = PersistentMap().set(b"a", 1).set(b"b", 2)
+    second = first.set(b"a", 3).set(b"c", 4)
+
+    assert first == {b"a": 1, b"b": 2}
+    assert second == {b"a": 3, b"b": 2, b"c": 4}
+
+
+def test_snapshot_shares_nodes():
+    pmap = PersistentMap()
+    for i in range(1000):
+        pmap = pmap.set(i, i)
+    snapshots = [pmap.set(i, -i) for i in range(10)]
+    # Each snapshot copies a path, not the map
+    assert deep_sizeof(snapshots) < 2 * deep_sizeof(pmap)
+
+
+def test_same_hash_keys():
+    one, two, three = SameHash("one", 7), SameHash("two", 7), SameHash("three", 7)
+    pmap = PersistentMap().set(one, 1).set(two, 2)
+    updated = pmap.set(three, 3).set(one, -1)
+
+    assert pmap == {one: 1, two: 2}
+    assert updated == {one: -1, two: 2, three: 3}
+    assert len(updated) == 3
+
+
+def test_same_hash_bucket_split():
+    # Shares the first level of the hash with the bucket, then differs
+    first, second = SameHash("first", 7), SameHash("second", 7)
+    other = SameHash("other", 7 + (1 << 10))
+    pmap = PersistentMap().set(first, 1).set(second, 2).set(other, 3)
+
+    assert pmap == {first: 1, second: 2, other: 3}
+    assert pmap[other] == 3
+    assert SameHash("missing", 7) not in pmap
+    assert SameHash("missing", 7 + (1 << 20)) not in pmap
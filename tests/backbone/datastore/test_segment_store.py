@@ -0,0 +1,143 @@
+import os
+
+import pytest
+from bami.backbone.datastore.chain_store import ChainFactory
+from bami.backbone.datastore.database import DBManager
+from bami.backbone.datastore.frontiers import FrontierDiff
+from bami.backbone.datastore.segment_store import (
+    RECORD_HEADER,
+    SegmentLogBlockStore,
+)
+from bami.backbone.utils import (
+    Dot,
+    encode_dot_key,
+    encode_raw,
+    Ranges,
+    ShortKey,
+    wrap_iterate,
+)
+
+from tests.conftest import insert_batch_seq
+
+BLOCK_BLOB = b"\x00\x00\x00\x04test\x00\x00\x00\x02tx" + b"rest"
+
+
+def dot_key(chain_id: bytes, seq_num: int) -> bytes:
+    return encode_dot_key(chain_id, Dot((seq_num, ShortKey(b"12345678"))))
+
+
+@pytest.fixture
+def block_dir(tmpdir):
+    return str(tmpdir)
+
+
+@pytest.fixture
+def segment_store(block_dir):
+    store = SegmentLogBlockStore(block_dir, segment_size=4096, index_capacity=16)
+    yield store
+    store.close()
+
+
+def test_put_and_get(segment_store):
+    segment_store.put_block(b"hash", BLOCK_BLOB, b"tx", b"", [dot_key(b"com", 1)])
+
+    assert segment_store.get_block_by_hash(b"hash") == BLOCK_BLOB
+    assert segment_store.get_block_by_dot(dot_key(b"com", 1)) == BLOCK_BLOB
+    assert segment_store.get_hash_by_dot(dot_key(b"com", 1)) == b"hash"
+    assert segment_store.get_tx_by_dot(dot_key(b"com", 1)) == b"tx"
+    assert segment_store.get_extra(b"hash") == encode_raw({b"type": b"test"})
+    assert segment_store.has_block(b"hash")
+    assert not segment_store.has_block(b"other_hash")
+    assert segment_store.get_block_by_dot(dot_key(b"com", 2)) is None
+
+
+def test_zero_copy_view(segment_store):
+    segment_store.add_block(b"hash", BLOCK_BLOB)
+    view = segment_store.get_block_view(b"hash")
+    assert isinstance(view, memoryview)
+    assert view == BLOCK_BLOB
+    view.release()
+
+
+def test_segments_and_index_grow(segment_store):
+    blob = b"1" * 1000
+    for i in range(50):
+        segment_store.put_blocks(
+            [(bytes([i]), blob, b"", b"", [dot_key(b"chain", i + 1)])]
+        )
+    assert len(segment_store.segment_ids) > 10
+    assert segment_store.index.capacity > 16
+    assert all(segment_store.get_block_by_hash(bytes([i])) == blob for i in range(50))
+    blobs = segment_store.get_block_blobs_by_seq_range(b"chain", 10, 19)
+    assert len(blobs) == 10
+
+
+def test_reopen_and_replay(block_dir):
+    store = SegmentLogBlockStore(block_dir, segment_size=4096)
+    store.put_block(b"hash1", BLOCK_BLOB, b"tx", b"", [dot_key(b"com", 1)])
+    store.close()
+
+    store = SegmentLogBlockStore(block_dir, segment_size=4096)
+    store.put_block(b"hash2", BLOCK_BLOB, b"tx", b"", [dot_key(b"com", 2)])
+    # Records after the checkpoint are replayed into the index on open
+    store.index.checkpoint = (0, 0)
+    store.index.flush()
+    for segment in store.segments.values():
+        segment.flush()
+
+    reopened = SegmentLogBlockStore(block_dir, segment_size=4096)
+    assert reopened.get_block_by_dot(dot_key(b"com", 1)) == BLOCK_BLOB
+    assert reopened.get_block_by_dot(dot_key(b"com", 2)) == BLOCK_BLOB
+    assert reopened.active_segment.write_offset == store.active_segment.write_offset
+    reopened.close()
+    store.close()
+
+
+def test_torn_write_ignored(block_dir):
+    store = SegmentLogBlockStore(block_dir, segment_size=4096)
+    store.add_block(b"hash1", BLOCK_BLOB)
+    offset = store.active_segment.write_offset
+    store.add_block(b"hash2", BLOCK_BLOB)
+    # Corrupt the last record and drop it from the index checkpoint
+    segment = store.active_segment
+    segment.mm[offset + RECORD_HEADER.size + 1] ^= 0xFF
+    store.index.checkpoint = (0, 0)
+    store.index.flush()
+    segment.flush()
+
+    reopened = SegmentLogBlockStore(block_dir, segment_size=4096)
+    assert reopened.has_block(b"hash1")
+    assert reopened.active_segment.write_offset == offset
+    reopened.close()
+    store.close()
+
+
+def test_prune_segments(segment_store, block_dir):
+    blob = b"1" * 1000
+    for i in range(20):
+        segment_store.put_block(bytes([i]), blob, b"", b"", [dot_key(b"chain", i + 1)])
+    first_ids = segment_store.segment_ids[:2]
+    pruned = segment_store.prune_segments(first_ids[-1] + 1)
+    assert pruned == first_ids
+    assert not any(
+        os.path.exists(os.path.join(block_dir, "segment_{:08d}.log".format(s)))
+        for s in pruned
+    )
+    assert not segment_store.has_block(bytes([0]))
+    assert segment_store.get_block_by_hash(bytes([19])) == blob
+    # The active segment is never pruned
+    segment_store.prune_segments(1000)
+    assert len(segment_store.segment_ids) == 1
+
+
+def test_dbmanager_with_segment_log(create_batches, block_dir):
+    blks = create_batches(num_batches=1, num_blocks=40)[0]
+    com_id = blks[0].com_id
+    dbms = DBManager(ChainFactory(), SegmentLogBlockStore(block_dir))
+    wrap_iterate(insert_batch_seq(dbms, blks))
+
+    front_diff = FrontierDiff(Ranges(((1, 40),)), {})
+    blobs = dbms.get_block_blobs_by_frontier_diff(com_id, front_diff, set())
+    assert blobs == {blk.pack() for blk in blks}
+    assert dbms.get_tx_blob_by_dot(com_id, blks[0].com_dot) == blks[0].transaction
+    dbms.close()
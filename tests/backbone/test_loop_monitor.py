@@ -0,0 +1,31 @@
+from bami.backbone.loop_monitor import LoopMonitor
+from bami.backbone.profiling import HandlerProfiler
+
+
+def test_lag_spikes():
+    profiler = HandlerProfiler()
+    monitor = LoopMonitor(profiler, interval=0.1, lag_threshold=0.05, max_spikes=1)
+    handler = profiler.wrap(lambda: None)
+    counted = []
+
+    def count_tasks():
+        counted.append(True)
+        return {"gossip_sync": 2}
+
+    monitor.start(now=0.0)
+    assert monitor.check(count_tasks, now=0.12) is None
+    handler()
+    spike = monitor.check(count_tasks, now=0.3)
+    assert spike.lag == 0.3 - 0.12 - 0.1
+    assert spike.tasks == {"gossip_sync": 2}
+    assert [(name, calls) for name, calls, _ in spike.handlers] == [("<lambda>", 1)]
+    # Tasks are only counted for the spikes
+    assert len(counted) == 1
+
+    # Handlers of a spike ran since the previous check
+    assert monitor.check(count_tasks, now=0.5).handlers == []
+    assert monitor.num_spikes == 2
+    assert list(monitor.spikes) == [monitor.spikes[-1]]
+    report = monitor.report()
+    assert report["lag"]["count"] == 3
+    assert report["spikes"] == 2
@@ -0,0 +1,57 @@
+from bami.backbone.datastore.block_store import LMDBLockStore
+from bami.backbone.metrics import LMDBTransactionCounter, MetricsRegistry
+
+
+def test_registry_snapshot():
+    registry = MetricsRegistry()
+    registry.counter("blocks_total").inc()
+    registry.counter("blocks_total").inc(2)
+    registry.gauge("depth").set(4)
+    items = [1, 2]
+    registry.gauge("items", callback=lambda: len(items))
+    registry.histogram("seconds").observe(0.01)
+    items.append(3)
+
+    snapshot = registry.snapshot()
+    assert snapshot["blocks_total"] == 3
+    assert snapshot["depth"] == 4
+    assert snapshot["items"] == 3
+    assert snapshot["seconds"]["count"] == 1
+    assert snapshot["seconds"]["max"] == 0.01
+
+
+def test_prometheus_text(tmpdir):
+    registry = MetricsRegistry()
+    registry.counter("blocks_total", "Blocks").inc(5)
+    hist = registry.histogram("seconds")
+    hist.observe(0.0001)
+    hist.observe(1000.0)
+
+    text = registry.to_prometheus()
+    assert "# HELP bami_blocks_total Blocks\n" in text
+    assert "# TYPE bami_blocks_total counter\nbami_blocks_total 5\n" in text
+    assert '# TYPE bami_seconds histogram\nbami_seconds_bucket{le="0.0001"} 1\n' in text
+    assert 'bami_seconds_bucket{le="+Inf"} 2\n' in text
+    assert "bami_seconds_count 2\n" in text
+
+    path = str(tmpdir.join("bami.prom"))
+    registry.write_prometheus(path)
+    with open(path) as f:
+        assert f.read() == text
+
+
+def test_lmdb_transactions(tmpdir):
+    registry = MetricsRegistry()
+    store = LMDBLockStore(str(tmpdir))
+    registry.instrument_lmdb(store)
+    # Instrumenting twice does not count twice
+    registry.instrument_lmdb(store)
+    assert isinstance(store.env, LMDBTransactionCounter)
+    assert not isinstance(store.env.env, LMDBTransactionCounter)
+
+    store.add_block(b"hash", b"blob")
+    assert store.get_block_by_hash(b"hash") == b"blob"
+    snapshot = registry.snapshot()
+    assert snapshot["lmdb_write_txns_total"] == 1
+    assert snapshot["lmdb_read_txns_total"] == 1
+    store.close()
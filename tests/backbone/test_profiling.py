@@ -0,0 +1,95 @@
+from asyncio import sleep
+
+import pytest
+from bami.backbone.profiling import HandlerProfiler
+
+
+def busy(duration):
+    # Hold the loop like a slow handler
+    total = 0
+    for i in range(int(duration * 1e6)):
+        total += i
+    return total
+
+
+def test_sync_handler():
+    profiler = HandlerProfiler(slowest_calls=2)
+    calls = []
+
+    def on_message(source_address, data):
+        calls.append(data)
+        return len(data)
+
+    wrapped = profiler.wrap(on_message)
+    assert wrapped.__name__ == "on_message"
+    # Wrapping twice does not time twice
+    assert profiler.wrap(wrapped) is wrapped
+    for data in (b"a", b"bb", b"ccc"):
+        assert wrapped(("1.2.3.4", 5), data) == len(data)
+
+    summary = profiler.report()["on_message"]
+    assert calls == [b"a", b"bb", b"ccc"]
+    assert summary["kind"] == "handler"
+    assert summary["calls"] == 3
+    assert summary["max"] <= summary["total"]
+    assert len(summary["slowest"]) == 2
+    assert summary["slowest"][0][0] == summary["max"]
+
+
+def test_failing_handler():
+    profiler = HandlerProfiler()
+
+    def on_message():
+        raise ValueError()
+
+    wrapped = profiler.wrap(on_message)
+    with pytest.raises(ValueError):
+        wrapped()
+    assert profiler.stats["on_message"].calls == 1
+
+
+@pytest.mark.asyncio
+async def test_coroutine_steps():
+    profiler = HandlerProfiler()
+
+    async def task(value):
+        busy(0.001)
+        await sleep(0.05)
+        busy(0.001)
+        return value
+
+    def handler():
+        return task(1)
+
+    assert await profiler.wrap(task, "task")(2) == 2
+    assert await profiler.wrap(handler)() == 1
+    report = profiler.report()
+    assert report["task"]["kind"] == "task"
+    for name in ("task", "handler"):
+        assert report[name]["calls"] == 1
+        # The sleep does not hold the loop
+        assert 0 < report[name]["total"] < 0.05
+
+
+def test_top_handlers_profiled():
+    profiler = HandlerProfiler(top_handlers=1, capture_memory=True, selection_calls=10)
+
+    def slow():
+        busy(0.001)
+        return [bytes(100) for _ in range(100)]
+
+    def fast():
+        pass
+
+    wrapped = [profiler.wrap(slow), profiler.wrap(fast)]
+    for _ in range(20):
+        for func in wrapped:
+            func()
+    profiler.close()
+
+    assert profiler.top() == ["slow", "fast"]
+    assert profiler.stats["slow"].profile
+    assert not profiler.stats["fast"].profile
+    assert "busy" in profiler.format_profile("slow")
+    assert profiler.format_profile("fast") == ""
+    assert profiler.stats["slow"].allocated > 0
@@ -0,0 +1,58 @@
+from hashlib import sha1
+
+import pytest
+from bami.backbone.recorder import (
+    NO_PEER,
+    PACKET,
+    packet_peer_id,
+    PacketRecorder,
+    read_records,
+    SUBSCRIPTION,
+)
+
+
+def test_records_round_trip(tmpdir):
+    path = str(tmpdir.join("node.rec"))
+    recorder = PacketRecorder(path)
+    recorder.record_subscription(b"community", now=1.0)
+    recorder.record_packet(("1.2.3.4", 5), b"packet", now=2.5)
+    recorder.close()
+    # Reopening appends to the same log
+    recorder = PacketRecorder(path)
+    recorder.record_packet(("1.2.3.4", 6), b"other", now=3.0)
+    recorder.close()
+
+    records = list(read_records(path))
+    assert [record.kind for record in records] == [SUBSCRIPTION, PACKET, PACKET]
+    assert records[0].data == b"community"
+    assert records[1].time == 2.5
+    assert records[1].address == ("1.2.3.4", 5)
+    assert records[1].peer_id == NO_PEER
+    assert records[2].data == b"other"
+
+
+def test_truncated_record_ignored(tmpdir):
+    path = str(tmpdir.join("node.rec"))
+    recorder = PacketRecorder(path)
+    recorder.record_packet(("1.2.3.4", 5), b"first")
+    recorder.record_packet(("1.2.3.4", 5), b"second")
+    recorder.close()
+    with open(path, "r+b") as f:
+        f.truncate(f.seek(0, 2) - 3)
+
+    assert [record.data for record in read_records(path)] == [b"first"]
+
+
+def test_bad_magic(tmpdir):
+    path = tmpdir.join("node.rec")
+    path.write_binary(b"not a log")
+    with pytest.raises(ValueError):
+        list(read_records(str(path)))
+
+
+def test_packet_peer_id():
+    key = b"public key"
+    data = b"\x00" * 22 + b"\x01" + len(key).to_bytes(2, "big") + key + b"payload"
+    assert packet_peer_id(data) == sha1(key).digest()
+    assert packet_peer_id(data[:30]) == NO_PEER
+    assert packet_peer_id(b"short") == NO_PEER
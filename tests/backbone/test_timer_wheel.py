@@ -0,0 +1,33 @@
+from bami.backbone.timer_wheel import TimerWheel
+
+
+def test_expire_in_order():
+    wheel = TimerWheel(tick=1, num_slots=4)
+    wheel.schedule(b"a", 3, now=0)
+    wheel.schedule(b"b", 1, now=0)
+    wheel.schedule(b"c", 10, now=0)
+    assert wheel.advance(0.5) == []
+    assert wheel.advance(3) == [b"b", b"a"]
+    assert len(wheel) == 1
+    # More than a revolution passed
+    assert wheel.advance(20) == [b"c"]
+    assert not wheel
+
+
+def test_cancel_and_reschedule():
+    wheel = TimerWheel(tick=0.5, num_slots=8, now=10)
+    wheel.schedule(b"a", 1, now=10)
+    assert wheel.cancel(b"a")
+    assert not wheel.cancel(b"a")
+    wheel.schedule(b"b", 1, now=10)
+    wheel.schedule(b"b", 2, now=10)
+    assert b"b" in wheel
+    assert wheel.advance(11) == []
+    assert wheel.advance(12) == [b"b"]
+
+
+def test_zero_delay_expires_next_tick():
+    wheel = TimerWheel(tick=1, num_slots=4)
+    wheel.schedule(b"a", 0, now=0)
+    assert wheel.advance(0.9) == []
+    assert wheel.advance(1) == [b"a"]
@@ -0,0 +1,63 @@
+import logging
+
+from bami.backbone.tracing import BlockStage, BlockTracer, LatencyHistogram
+from bami.backbone.utils import Dot
+
+
+def test_histogram():
+    hist = LatencyHistogram()
+    assert hist.percentile(50) == 0.0
+    for latency in (0.001, 0.002, 0.003, 0.5):
+        hist.add(latency)
+    assert hist.count == 4
+    assert hist.max == 0.5
+    assert 0.002 <= hist.percentile(50) <= 0.004
+    assert hist.percentile(99) == 0.5
+    # Latencies above the last bound are in the overflow bucket
+    hist.add(1000.0)
+    assert hist.percentile(100) == 1000.0
+    assert hist.summary()["count"] == 5
+
+
+def test_tracer_stages():
+    tracer = BlockTracer()
+    dot = Dot((1, b"12345678"))
+    tracer.start(b"chain", dot, BlockStage.RECEIVED, now=10.0)
+    # The first start is kept
+    tracer.start(b"chain", dot, BlockStage.RECEIVED, now=11.0)
+    tracer.record(b"chain", dot, BlockStage.VERIFIED, now=10.001)
+    tracer.record_many(b"chain", [dot, Dot((2, b"unknown"))], BlockStage.CONSISTENT)
+    tracer.record(b"chain", (1, b"12345678"), BlockStage.CONFIRMED, 10.5, final=True)
+    assert len(tracer.started) == 0
+    # Stages of blocks that are not traced are ignored
+    tracer.record(b"chain", dot, BlockStage.DELIVERED, now=12.0)
+
+    hists = tracer.get_histograms(b"chain")
+    assert set(hists) == {
+        BlockStage.RECEIVED,
+        BlockStage.VERIFIED,
+        BlockStage.CONSISTENT,
+        BlockStage.CONFIRMED,
+    }
+    assert hists[BlockStage.RECEIVED].count == 1
+    assert hists[BlockStage.CONFIRMED].max == 0.5
+    assert list(tracer.report()[b"chain"]) == [
+        "RECEIVED",
+        "VERIFIED",
+        "CONSISTENT",
+        "CONFIRMED",
+    ]
+    assert tracer.get_histograms(b"other") == {}
+
+
+def test_tracer_bounded(caplog):
+    tracer = BlockTracer(max_blocks=2)
+    for i in range(3):
+        tracer.start(b"chain", Dot((i, b"hash")), BlockStage.CREATED, now=0.0)
+    assert len(tracer.started) == 2
+    tracer.record(b"chain", Dot((0, b"hash")), BlockStage.VERIFIED, now=1.0)
+    assert BlockStage.VERIFIED not in tracer.get_histograms(b"chain")
+
+    with caplog.at_level(logging.INFO):
+        tracer.dump()
+    assert "CREATED: count 3" in caplog.text
@@ -2,16 +2,21 @@ from unittest.mock import Mock
 
 import pytest
 from bami.backbone.utils import (
+    decode_dot_key,
     decode_links,
     decode_raw,
+    Dot,
     EMPTY_PK,
     EMPTY_SIG,
+    encode_dot_key,
     encode_links,
     encode_raw,
     expand_ranges,
     GENESIS_HASH,
     KEY_LEN,
     Links,
+    deep_sizeof,
+    memory_usage,
     ranges,
     shorten,
 )
@@ -69,6 +74,35 @@ def test_encode_decode_links(keys_fixture):
     assert decode_links(raw_bytes) == links
 
 
+def test_encode_decode_dot_key(keys_fixture):
+    dot = Dot((300, shorten(keys_fixture)))
+    dot_key = encode_dot_key(EMPTY_PK, dot)
+    assert decode_dot_key(dot_key, len(EMPTY_PK)) == (EMPTY_PK, dot)
+
+
+def test_dot_keys_order_by_seq_num(keys_fixture):
+    dots = [
+        Dot((seq_num, shorten(keys_fixture)))
+        for seq_num in (1, 2, 127, 128, 256, 70000)
+    ]
+    keys = [encode_dot_key(EMPTY_PK, dot) for dot in dots]
+    assert sorted(keys) == keys
+
+
+def test_deep_sizeof():
+    key = b"k" * 1000
+    assert deep_sizeof(key) > 1000
+    assert deep_sizeof({1: {key}}) > deep_sizeof({1: set()}) + 1000
+    # An object held twice is counted once
+    assert deep_sizeof([key, key]) < 2 * deep_sizeof(key)
+    # Functions are not data
+    assert deep_sizeof([len]) == deep_sizeof([None]) - deep_sizeof(None)
+
+    usage = memory_usage(2, {b"a": key}, [key])
+    assert usage["entries"] == 2
+    assert deep_sizeof(key) < usage["bytes"] < 2 * deep_sizeof(key)
+
+
 from decimal import Decimal, getcontext
 
 
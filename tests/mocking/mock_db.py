@@ -1,4 +1,4 @@
-from typing import Optional, Iterable, Set
+from typing import Optional, Iterable, Set, Tuple
 
 from bami.backbone.block import BamiBlock
 from bami.backbone.datastore.block_store import BaseBlockStore
@@ -40,6 +40,11 @@ class MockBlockStore(BaseBlockStore):
     def get_tx_by_hash(self, block_hash: bytes) -> Optional[bytes]:
         pass
 
+    def get_dot_blocks_by_seq_range(
+        self, chain_id: bytes, start_seq: int, end_seq: int
+    ) -> Iterable[Tuple[bytes, bytes, bytes]]:
+        return []
+
 
 class MockDBManager(BaseDB):
     def get_last_reconcile_point(self, chain_id: bytes, peer_id: bytes) -> int:
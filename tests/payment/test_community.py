@@ -1,16 +1,24 @@
+from asyncio import get_event_loop, sleep
 from decimal import Decimal
+import os
+import time
 
+from bami.backbone.block import BamiBlock
 from bami.backbone.exceptions import InvalidTransactionFormatException
 from bami.backbone.payload import (
     BlockBroadcastPayload,
     RawBlockBroadcastPayload,
 )
+from bami.backbone.tracing import BlockStage
 from bami.backbone.sub_community import (
     IPv8SubCommunityFactory,
     RandomWalkDiscoveryStrategy,
 )
-from bami.backbone.utils import Dot, GENESIS_LINK
+from bami.backbone.utils import Dot, encode_raw, GENESIS_LINK
 from bami.payment.community import PaymentCommunity
+from bami.payment.database import PaymentState
+from bami.payment.settings import PaymentSettings
+from bami.payment.snapshot import SNAPSHOT_FILE
 from bami.payment.exceptions import (
     InsufficientBalanceException,
     InvalidMintRangeException,
@@ -23,7 +31,9 @@ import pytest
 
 from tests.conftest import FakeBlock
 from tests.mocking.base import (
+    connect_nodes,
     create_and_connect_nodes,
+    create_node,
     deliver_messages,
     SetupValues,
     unload_nodes,
@@ -84,6 +94,18 @@ class TestInitCommunity:
         assert nodes[1].overlay.is_subscribed(set_vals.community_id)
 
 
+class TestAmounts:
+    def test_minor_unit_decimals_independent_of_precision(self, set_vals):
+        overlay = set_vals.nodes[0].overlay
+        overlay.settings.asset_precision = 4
+        overlay.settings.minor_unit_decimals = 2
+        overlay.state_db = PaymentState(
+            overlay.settings.asset_precision, minor_units=True
+        )
+        assert overlay.to_amount(Decimal("123456.785")) == 12345678
+        assert overlay.to_amount(10 ** 7) == 10 ** 9
+
+
 class TestMint:
     def test_invalid_mint_tx_bad_format(self, set_vals):
         mint_tx = {}
@@ -219,6 +241,296 @@ class TestSpend:
             assert vals.nodes[i].overlay.state_db.get_balance(spender) == 0
             assert vals.nodes[i].overlay.state_db.was_balance_negative(spender)
 
+    @pytest.mark.asyncio
+    async def test_valid_multi_spend(self, set_vals):
+        vals = set_vals
+        n_nodes = len(set_vals.nodes)
+        spender = vals.nodes[0].overlay.my_pub_key_bin
+        receivers = [vals.nodes[i].overlay.my_pub_key_bin for i in (1, 2)]
+        vals.nodes[0].overlay.mint(value=Decimal(10, vals.context))
+        vals.nodes[0].overlay.multi_spend(
+            vals.community_id,
+            [
+                (receivers[0], Decimal(3, vals.context)),
+                (receivers[1], Decimal(4, vals.context)),
+            ],
+        )
+        assert vals.nodes[0].overlay.state_db.get_balance(spender) == 3
+
+        await deliver_messages(0.1 * n_nodes)
+        for i in range(n_nodes):
+            state_db = vals.nodes[i].overlay.state_db
+            assert state_db.get_balance(spender) == 3, "Peer number {}".format(i)
+            assert state_db.get_balance(receivers[0]) == 3
+            assert state_db.get_balance(receivers[1]) == 4
+
+    def test_multi_spend_repeated_counter_party(self, set_vals):
+        spender = set_vals.nodes[0].overlay.my_pub_key_bin
+        output = {
+            b"value": 1.0,
+            b"to_peer": set_vals.nodes[1].overlay.my_pub_key_bin,
+            b"prev_pairwise_link": GENESIS_LINK,
+        }
+        with pytest.raises(InvalidTransactionFormatException):
+            set_vals.nodes[0].overlay.verify_multi_spend(
+                spender, {b"outputs": [output, output]}
+            )
+
+    @pytest.mark.asyncio
+    async def test_spends_confirmed_in_batch(self, set_vals):
+        vals = set_vals
+        n_nodes = len(set_vals.nodes)
+        spender = vals.nodes[0].overlay.my_pub_key_bin
+        receiver = vals.nodes[1].overlay
+        # Receiver waits until both spends are known
+        receiver.settings.diversity_confirm = n_nodes + 1
+        batches = []
+        confirm_batch = receiver.confirm_batch
+
+        def spy_confirm_batch(blocks, extra_data=None):
+            batches.append(len(blocks))
+            confirm_batch(blocks, extra_data)
+
+        receiver.confirm_batch = spy_confirm_batch
+
+        vals.nodes[0].overlay.mint(value=Decimal(10, vals.context))
+        # Spend values are cumulative per counter-party
+        for value in (3, 7):
+            vals.nodes[0].overlay.spend(
+                chain_id=vals.community_id,
+                counter_party=receiver.my_pub_key_bin,
+                value=Decimal(value, vals.context),
+            )
+        await deliver_messages(0.1 * n_nodes)
+        assert len(receiver.tracked_blocks[vals.community_id]) == 2
+
+        receiver.settings.diversity_confirm = 0
+        receiver.schedule_block_evaluation(
+            (vals.community_id, dot) for dot in receiver.waiting_dots[vals.community_id]
+        )
+        await deliver_messages(0.1 * n_nodes)
+        assert batches == [2]
+        for i in range(n_nodes):
+            state_db = vals.nodes[i].overlay.state_db
+            assert state_db.get_balance(spender) == 3, "Peer number {}".format(i)
+            assert state_db.get_balance(receiver.my_pub_key_bin) == 7
+
+    @pytest.mark.asyncio
+    async def test_expired_block_waits_for_diversity(self, set_vals):
+        vals = set_vals
+        n_nodes = len(set_vals.nodes)
+        spender = vals.nodes[0].overlay.my_pub_key_bin
+        receiver = vals.nodes[1].overlay
+        receiver.settings.diversity_confirm = n_nodes + 1
+
+        vals.nodes[0].overlay.mint(value=Decimal(10, vals.context))
+        vals.nodes[0].overlay.spend(
+            chain_id=vals.community_id,
+            counter_party=receiver.my_pub_key_bin,
+            value=Decimal(4, vals.context),
+        )
+        await deliver_messages(0.1 * n_nodes)
+        waiting = list(receiver.waiting_dots[vals.community_id])
+        assert len(waiting) == 1
+
+        # The maximum wait time passes: the status is known, the block is not rejected
+        now = get_event_loop().time()
+        for dot in waiting:
+            receiver.wait_timers.schedule((vals.community_id, dot), 0, now)
+        await sleep(receiver.settings.block_sign_delta * 2)
+        assert receiver.waiting_dots[vals.community_id] == waiting
+
+        receiver.settings.diversity_confirm = 0
+        receiver.update_risk(vals.community_id, spender, waiting[0][0])
+        await deliver_messages(0.1 * n_nodes)
+        assert not receiver.waiting_dots[vals.community_id]
+        for i in range(n_nodes):
+            state_db = vals.nodes[i].overlay.state_db
+            assert state_db.get_balance(spender) == 6, "Peer number {}".format(i)
+            assert state_db.get_balance(receiver.my_pub_key_bin) == 4
+
+    @staticmethod
+    async def spend_between_two_nodes(tmpdir_factory, settings):
+        """Mint and spend from the first to the second node. Returns the nodes and the community id."""
+        nodes = [
+            create_node(
+                FakePaymentCommunity,
+                work_dir=str(tmpdir_factory.mktemp("settings", numbered=True)),
+                settings=settings,
+            )
+            for _ in range(2)
+        ]
+        connect_nodes(nodes, FakePaymentCommunity)
+        community_id = nodes[0].overlay.my_pub_key_bin
+        for node in nodes:
+            node.overlay.subscribe_to_subcom(community_id)
+        context = nodes[0].overlay.state_db.context
+        nodes[0].overlay.mint(value=Decimal(10, context))
+        nodes[0].overlay.spend(
+            chain_id=community_id,
+            counter_party=nodes[1].overlay.my_pub_key_bin,
+            value=Decimal(10, context),
+        )
+        await deliver_messages(0.5)
+        return nodes, community_id
+
+    @pytest.mark.asyncio
+    async def test_spend_traced(self, tmpdir_factory):
+        settings = PaymentSettings()
+        settings.block_tracing = True
+        nodes, community_id = await self.spend_between_two_nodes(
+            tmpdir_factory, settings
+        )
+
+        spender_hists = nodes[0].overlay.tracer.get_histograms(community_id)
+        assert spender_hists[BlockStage.CREATED].count == 2
+        assert spender_hists[BlockStage.CONFIRMED].count == 1
+        # Receiver got the mint and the spend, and created the confirm
+        receiver_hists = nodes[1].overlay.tracer.get_histograms(community_id)
+        assert receiver_hists[BlockStage.RECEIVED].count == 2
+        assert receiver_hists[BlockStage.CREATED].count == 1
+        for stage in (
+            BlockStage.VERIFIED,
+            BlockStage.PERSISTED,
+            BlockStage.CONSISTENT,
+            BlockStage.DELIVERED,
+        ):
+            assert receiver_hists[stage].count == 3, stage
+        # Confirmed spend is not traced anymore, the mint and the confirm are
+        assert len(nodes[0].overlay.tracer.started) == 2
+        await unload_nodes(nodes)
+
+    @pytest.mark.asyncio
+    async def test_spend_metrics(self, tmpdir_factory):
+        settings = PaymentSettings()
+        settings.metrics_enabled = True
+        nodes, _ = await self.spend_between_two_nodes(tmpdir_factory, settings)
+
+        # Mint, spend and confirm are stored by both nodes
+        for node in nodes:
+            snapshot = node.overlay.metrics.snapshot()
+            assert snapshot["blocks_added_total"] == 3
+            assert snapshot["blocks_validated_total"] == 3
+            assert snapshot["validate_persist_seconds"]["count"] == 3
+            assert snapshot["lmdb_write_txns_total"] >= 3
+            assert snapshot["frontier_queue_depth"] == 0
+            assert 0 <= snapshot["blob_cache_hit_rate"] <= 1
+        assert "bami_blocks_added_total 3" in nodes[1].overlay.metrics.to_prometheus()
+        await unload_nodes(nodes)
+
+    @pytest.mark.asyncio
+    async def test_spend_profiled(self, tmpdir_factory):
+        settings = PaymentSettings()
+        settings.handler_profiling = True
+        settings.profiling_top_handlers = 1
+        nodes, _ = await self.spend_between_two_nodes(tmpdir_factory, settings)
+
+        report = nodes[1].overlay.profiler.report()
+        # Handlers of the backbone, of the IPv8 community and the gossip task
+        assert report["received_block"]["calls"] > 0
+        assert "on_introduction_request" in report
+        assert report["gossip_sync_task"]["kind"] == "task"
+        assert report["gossip_sync_task"]["calls"] > 0
+        await unload_nodes(nodes)
+
+    @pytest.mark.asyncio
+    async def test_loop_lag_monitored(self, tmpdir_factory):
+        settings = PaymentSettings()
+        settings.loop_monitoring = True
+        settings.loop_monitor_interval = 0.05
+        nodes, _ = await self.spend_between_two_nodes(tmpdir_factory, settings)
+        monitor = nodes[1].overlay.loop_monitor
+        # Hold the loop
+        time.sleep(settings.loop_lag_threshold * 2)
+        await sleep(settings.loop_monitor_interval * 2)
+
+        assert monitor.num_spikes > 0
+        spike = monitor.spikes[-1]
+        assert spike.lag >= settings.loop_lag_threshold
+        # One gossip task and one frontier queue per synced chain
+        num_chains = len(nodes[1].overlay.periodic_sync_lc)
+        assert num_chains > 0
+        assert spike.tasks["gossip_sync"] == num_chains
+        assert spike.tasks["frontier_queue"] == num_chains
+        assert spike.tasks["monitor_loop"] == 1
+        assert spike.tasks["loop"] > 0
+        assert nodes[1].overlay.task_category("12345") == "witness"
+        await unload_nodes(nodes)
+
+    @pytest.mark.asyncio
+    async def test_recover_from_snapshot(self, set_vals):
+        vals = set_vals
+        n_nodes = len(set_vals.nodes)
+        spender = vals.nodes[0].overlay.my_pub_key_bin
+        overlay = vals.nodes[1].overlay
+        vals.nodes[0].overlay.mint(value=Decimal(10, vals.context))
+        vals.nodes[0].overlay.spend(
+            chain_id=vals.community_id,
+            counter_party=overlay.my_pub_key_bin,
+            value=Decimal(4, vals.context),
+        )
+        await deliver_messages(0.1 * n_nodes)
+        overlay.save_snapshot()
+
+        # Restart with the state from the snapshot and the chains from the block store
+        overlay.state_db = PaymentState(overlay.settings.asset_precision)
+        overlay.persistence.chains.clear()
+        overlay.snapshot_seq_nums = overlay.load_snapshot()
+        assert overlay.snapshot_seq_nums[vals.community_id] > 0
+        assert overlay.persistence.restore_chain(
+            vals.community_id, lambda blob: BamiBlock.unpack(blob, overlay.serializer)
+        )
+        assert overlay.state_db.get_balance(spender) == 6
+        assert overlay.state_db.get_balance(overlay.my_pub_key_bin) == 4
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize(
+        "corruption", ["extra_data", "truncated", "garbage", "not_a_map", "directory"]
+    )
+    async def test_recover_from_corrupt_snapshot(self, set_vals, corruption):
+        vals = set_vals
+        n_nodes = len(set_vals.nodes)
+        spender = vals.nodes[0].overlay.my_pub_key_bin
+        overlay = vals.nodes[1].overlay
+        vals.nodes[0].overlay.mint(value=Decimal(10, vals.context))
+        vals.nodes[0].overlay.spend(
+            chain_id=vals.community_id,
+            counter_party=overlay.my_pub_key_bin,
+            value=Decimal(4, vals.context),
+        )
+        await deliver_messages(0.1 * n_nodes)
+        overlay.save_snapshot()
+
+        path = os.path.join(overlay.work_dir, SNAPSHOT_FILE)
+        with open(path, "rb") as f:
+            snapshot = f.read()
+        if corruption == "directory":
+            os.remove(path)
+            os.mkdir(path)
+        else:
+            with open(path, "wb") as f:
+                f.write(
+                    {
+                        "extra_data": snapshot + b"\x00",
+                        "truncated": snapshot[: len(snapshot) // 2],
+                        "garbage": b"\xc1" * 16,
+                        "not_a_map": encode_raw([1, 2, 3]),
+                    }[corruption]
+                )
+
+        # Restart: the snapshot is discarded and all blocks are applied again
+        overlay.state_db = PaymentState(overlay.settings.asset_precision)
+        overlay.persistence.chains.clear()
+        overlay.snapshot_seq_nums = overlay.load_snapshot()
+        assert overlay.snapshot_seq_nums == {}
+        # Minters are known again when the community is joined
+        overlay.state_db.add_known_minters(vals.community_id, {vals.community_id})
+        assert overlay.persistence.restore_chain(
+            vals.community_id, lambda blob: BamiBlock.unpack(blob, overlay.serializer)
+        )
+        assert overlay.state_db.get_balance(spender) == 6
+        assert overlay.state_db.get_balance(overlay.my_pub_key_bin) == 4
+
 
 class TestWitness:
     # Test witness transaction
@@ -233,3 +545,51 @@ class TestWitness:
         tx = (i, {b"t": (True, True)})
         with pytest.raises(InvalidWitnessTransactionException):
             set_vals.nodes[0].overlay.apply_witness_tx(blk, tx)
+
+    def test_witnessed_state_compacted(self, set_vals):
+        overlay = set_vals.nodes[0].overlay
+        overlay.settings.compaction_witness_votes = 1
+        chain_id = set_vals.community_id
+        overlay.mint(value=Decimal(10, set_vals.context))
+        assert overlay.state_db.memory_report()["applied_dots"]["entries"] == 1
+
+        overlay.witness_delta = 1
+        seq_num = overlay.chain_seq_nums[chain_id]
+        state = overlay.state_db.get_last_peer_status(chain_id)
+        overlay.apply_witness_tx(FakeBlock(com_id=chain_id), (seq_num, state))
+        assert overlay.state_db.applied_dots.get_watermark(chain_id) == seq_num
+        assert overlay.state_db.memory_report()["applied_dots"]["entries"] == 0
+
+    def test_compaction_disabled_by_default(self, set_vals):
+        overlay = set_vals.nodes[0].overlay
+        chain_id = set_vals.community_id
+        overlay.mint(value=Decimal(10, set_vals.context))
+
+        overlay.witness_delta = 1
+        seq_num = overlay.chain_seq_nums[chain_id]
+        state = overlay.state_db.get_last_peer_status(chain_id)
+        overlay.apply_witness_tx(FakeBlock(com_id=chain_id), (seq_num, state))
+        assert overlay.state_db.applied_dots.get_watermark(chain_id) == 0
+
+    @pytest.mark.asyncio
+    async def test_concurrent_block_applied_after_compaction(self, set_vals):
+        minter = set_vals.nodes[0].overlay
+        overlay = set_vals.nodes[1].overlay
+        overlay.settings.compaction_witness_votes = 1
+        chain_id = set_vals.community_id
+        for node in set_vals.nodes:
+            node.overlay.state_db.add_known_minters(chain_id, {overlay.my_pub_key_bin})
+        # Both blocks are the first of the community chain
+        minter.mint(value=Decimal(10, set_vals.context))
+        overlay.mint(value=Decimal(5, set_vals.context), chain_id=chain_id)
+        seq_num = overlay.chain_seq_nums[chain_id]
+
+        overlay.witness_delta = 1
+        state = overlay.state_db.get_last_peer_status(chain_id)
+        overlay.apply_witness_tx(FakeBlock(com_id=chain_id), (seq_num, state))
+        assert overlay.state_db.applied_dots.get_watermark(chain_id) == seq_num
+
+        # The block of the minter arrives below the watermark
+        await deliver_messages(0.1 * len(set_vals.nodes))
+        assert overlay.state_db.get_balance(minter.my_pub_key_bin) == 10
+        assert overlay.state_db.get_balance(overlay.my_pub_key_bin) == 5
@@ -9,10 +9,16 @@ from bami.backbone.utils import (
     GENESIS_LINK,
     Links,
     shorten,
-    take_hash,
 )
-from bami.payment.database import ChainState, PaymentState
+from bami.payment.database import (
+    AppliedDots,
+    ChainState,
+    chain_state_hash,
+    PaymentState,
+    StatusCheckpoints,
+)
 from bami.payment.exceptions import (
+    InconsistentBlockException,
     InconsistentClaimException,
     InconsistentStateHashException,
     InvalidClaimException,
@@ -60,10 +66,23 @@ class TestPaymentState:
             spend_value,
         )
         assert float(self.state.get_balance(self.spender)) == 3
+        assert self.state.get_spend_value(self.spender, self.receiver) == spend_value
+        assert self.state.get_spend_value(self.receiver, self.spender) == 0
         assert not self.state.is_chain_forked(chain_id, self.spender)
         assert not self.state.was_chain_forked(chain_id, self.spender)
         return chain_id, spend_value, spend_dot
 
+    def test_memory_report(self):
+        empty = self.state.memory_report()
+        self.test_mint_and_spend()
+        report = self.state.memory_report()
+
+        assert report["last_spend_values"]["entries"] == 1
+        assert report["vals_cache"]["entries"] == 1
+        assert report["chain_peers"]["entries"] == 1
+        for structure in ("last_spend_values", "vals_cache", "chain_peers"):
+            assert report[structure]["bytes"] > empty[structure]["bytes"]
+
     def test_valid_spend_with_confirm(self):
         chain_id, value, spend_dot = self.test_mint_and_spend()
 
@@ -165,6 +184,22 @@ class TestPaymentState:
         assert float(self.state.get_balance(self.receiver)) == 0
         assert self.state.was_balance_negative(self.spender)
 
+    def test_running_totals(self):
+        self.test_risky_spend_with_confirm()
+
+        def recompute_spend(peer_id):
+            return sum(
+                max(val) if type(val) == tuple else val
+                for val_dict in self.state.last_spend_values[peer_id].values()
+                for val in val_dict.values()
+            )
+
+        for peer in (self.spender, self.receiver):
+            assert self.state.get_total_spend(peer) == recompute_spend(peer)
+            assert self.state.get_total_claims(peer) == sum(
+                self.state.claim_vals[peer].values()
+            )
+
     def test_mint_and_spend_fork(self):
         chain_id = self.minter
         value = Decimal(12.00, self.con)
@@ -187,6 +222,11 @@ class TestPaymentState:
         assert float(self.state.get_balance(self.spender)) == 0
         assert self.state.is_chain_forked(chain_id, self.spender)
 
+        # Compaction keeps the fork visible
+        self.state.compact(chain_id, 1)
+        assert self.state.is_chain_forked(chain_id, self.spender)
+        assert self.state.was_chain_forked(chain_id, self.spender)
+
     def test_add_claim(self):
         value = Decimal(12.11, self.con)
         dot = Dot((1, "123123"))
@@ -294,10 +334,12 @@ class TestPaymentState:
         chain_id = self.spender
         seq_num = 1
         state = ChainState({b"t1": (True, True)})
-        state_hash = take_hash(state)
+        state_hash = chain_state_hash(state)
         self.state.add_chain_state(chain_id, seq_num, state_hash, state)
-        self.state.prefered_statuses[chain_id][seq_num] = state_hash
-        assert self.state.peer_statuses[chain_id][seq_num][state_hash] == state
+        self.state.peer_statuses[chain_id].set_preferred(seq_num, state_hash)
+        assert (
+            self.state.peer_statuses[chain_id].get_state(seq_num, state_hash) == state
+        )
         assert self.state.get_closest_peers_status(chain_id, 1) == (1, state)
         assert not self.state.get_closest_peers_status(chain_id, 2)
 
@@ -307,7 +349,7 @@ class TestPaymentState:
         seq_num = 1
         state = ChainState({b"t1": (True, True)})
         state_hash = b"fake_hash"
-        real_hash = take_hash(state)
+        real_hash = chain_state_hash(state)
         with pytest.raises(InconsistentStateHashException):
             self.state.add_chain_state(chain_id, seq_num, state_hash, state)
         self.state.add_chain_state(chain_id, seq_num, real_hash, state)
@@ -427,6 +469,141 @@ class TestPaymentState:
         )
 
         assert v[1] == self.state.get_last_peer_status(chain_id)
+        assert self.state.get_last_state_hash(chain_id) == chain_state_hash(v[1])
+
+    def _spend_from_minters(self, chain_id, spenders):
+        spend_dots = []
+        for i, spender in enumerate(spenders):
+            mint_dot = Dot((2 * i + 1, b"m" + spender))
+            self.state.apply_mint(
+                chain_id, mint_dot, GENESIS_LINK, spender, Decimal(10, self.con)
+            )
+            spend_dot = Dot((2 * i + 2, b"s" + spender))
+            self.state.apply_spend(
+                chain_id,
+                GENESIS_LINK,
+                Links((mint_dot,)),
+                spend_dot,
+                spender,
+                self.receiver,
+                Decimal(i + 1, self.con),
+            )
+            spend_dots.append(spend_dot)
+        return spend_dots
+
+    def test_confirm_batch(self):
+        chain_id = self.minter
+        spenders = [b"spender1", b"spender2"]
+        spend_dots = self._spend_from_minters(chain_id, spenders)
+
+        self.state.apply_confirm_batch(
+            chain_id,
+            self.receiver,
+            Links((spend_dots[-1],)),
+            Dot((5, b"claim")),
+            [
+                (spenders[0], spend_dots[0], Decimal(1, self.con)),
+                (spenders[1], spend_dots[1], Decimal(2, self.con)),
+            ],
+            store_update=True,
+        )
+        assert self.state.get_balance(self.receiver) == 3
+        assert self.state.get_balance(spenders[0]) == 9
+        assert self.state.get_balance(spenders[1]) == 8
+        assert not self.state.is_chain_forked(chain_id, self.receiver)
+        status = self.state.get_closest_peers_status(chain_id, 5)[1]
+        assert status[shorten(self.receiver)] == (True, True)
+
+    def test_confirm_batch_is_atomic(self):
+        chain_id = self.minter
+        spenders = [b"spender1", b"spender2"]
+        spend_dots = self._spend_from_minters(chain_id, spenders)
+
+        with pytest.raises(InconsistentClaimException):
+            self.state.apply_confirm_batch(
+                chain_id,
+                self.receiver,
+                Links((spend_dots[-1],)),
+                Dot((5, b"claim")),
+                [
+                    (spenders[0], spend_dots[0], Decimal(1, self.con)),
+                    (spenders[1], spend_dots[1], Decimal(5, self.con)),
+                ],
+            )
+        assert self.state.get_balance(self.receiver) == 0
+        assert self.state.get_balance(spenders[0]) == 9
+
+    def test_multi_spend(self):
+        chain_id = self.minter
+        mint_dot = Dot((1, b"1"))
+        self.state.apply_mint(
+            chain_id, mint_dot, GENESIS_LINK, self.minter, Decimal(10, self.con)
+        )
+        spend_dot = Dot((2, b"2"))
+        self.state.apply_multi_spend(
+            chain_id,
+            Links((mint_dot,)),
+            spend_dot,
+            self.spender,
+            [
+                (b"receiver1", GENESIS_LINK, Decimal(3, self.con)),
+                (b"receiver2", GENESIS_LINK, Decimal(4, self.con)),
+            ],
+        )
+        assert self.state.get_balance(self.spender) == 3
+        assert self.state.get_last_pairwise_links(self.spender, b"receiver2") == (
+            spend_dot,
+        )
+        # Every receiver confirms own output
+        self.state.apply_confirm(
+            chain_id,
+            b"receiver1",
+            Links((spend_dot,)),
+            Dot((3, b"3")),
+            self.spender,
+            spend_dot,
+            Decimal(3, self.con),
+        )
+        assert self.state.get_balance(b"receiver1") == 3
+
+        with pytest.raises(InconsistentBlockException):
+            self.state.apply_multi_spend(
+                chain_id,
+                Links((spend_dot,)),
+                Dot((4, b"4")),
+                self.spender,
+                [
+                    (b"receiver1", Links((spend_dot,)), Decimal(4, self.con)),
+                    (b"receiver1", Links((spend_dot,)), Decimal(5, self.con)),
+                ],
+            )
+        assert self.state.get_balance(self.spender) == 3
+
+    def test_status_snapshots_not_changed(self):
+        chain_id = self.minter
+        value = Decimal(12.00, self.con)
+        self.state.apply_mint(
+            chain_id, Dot((1, b"1")), GENESIS_LINK, self.minter, value, True
+        )
+        snapshot = dict(self.state.get_last_peer_status(chain_id))
+        snapshot_hash = self.state.get_last_state_hash(chain_id)
+
+        self.state.apply_spend(
+            chain_id,
+            GENESIS_LINK,
+            Links((Dot((1, b"1")),)),
+            Dot((2, b"2")),
+            self.spender,
+            self.receiver,
+            Decimal(20.00, self.con),
+            store_status_update=True,
+        )
+        # Balance became negative: the stored snapshot is copied, not changed
+        assert self.state.get_closest_peers_status(chain_id, 1) == (1, snapshot)
+        assert self.state.peer_statuses[chain_id].get_preferred(1) == snapshot_hash
+        last_status = self.state.get_last_peer_status(chain_id)
+        assert last_status[shorten(self.spender)] == (False, True)
+        assert self.state.get_last_state_hash(chain_id) == chain_state_hash(last_status)
 
     def test_minter_update(self):
         chain_id = b"chain"
@@ -451,3 +628,115 @@ class TestPaymentState:
                 pass
         except ValueError:
             print("No data for the chain")
+
+
+def test_checkpoints_closest():
+    checkpoints = StatusCheckpoints(10)
+    for seq_num in (5, 1, 3):
+        state = ChainState({b"t1": (True, seq_num > 2)})
+        checkpoints.add_state(seq_num, chain_state_hash(state), state)
+        checkpoints.set_preferred(seq_num, chain_state_hash(state))
+    assert checkpoints.seq_nums == [1, 3, 5]
+    assert checkpoints.closest(2)[0] == 3
+    assert checkpoints.closest(5)[0] == 5
+    assert checkpoints.closest(6) is None
+
+
+def test_checkpoints_retention_and_pins():
+    checkpoints = StatusCheckpoints(3)
+    checkpoints.pin(2)
+    for seq_num in range(1, 7):
+        checkpoints.add_state(seq_num, b"hash", ChainState({}))
+    # Checkpoints at or after the pinned one are retained
+    assert checkpoints.seq_nums == [2, 3, 4, 5, 6]
+    checkpoints.unpin(2)
+    assert checkpoints.seq_nums == [4, 5, 6]
+    # Older checkpoints than the retained are dropped at once
+    checkpoints.add_state(1, b"hash", ChainState({}))
+    checkpoints.add_vote(1, b"hash", b"witness")
+    assert checkpoints.seq_nums == [4, 5, 6]
+    assert not checkpoints.votes
+
+
+def test_checkpoints_pins_capped():
+    checkpoints = StatusCheckpoints(3, max_pinned=2)
+    checkpoints.pin(1)
+    for seq_num in range(1, 9):
+        checkpoints.add_state(seq_num, b"hash", ChainState({}))
+        checkpoints.set_preferred(seq_num, b"hash")
+    # The pin keeps at most two more checkpoints, it falls back to the closest one left
+    assert checkpoints.seq_nums == [4, 5, 6, 7, 8]
+    assert checkpoints.closest(1)[0] == 4
+    checkpoints.unpin(1)
+    assert checkpoints.seq_nums == [6, 7, 8]
+    assert not checkpoints.pinned_seq_nums
+
+
+def test_checkpoints_votes():
+    checkpoints = StatusCheckpoints(3)
+    checkpoints.add_vote(1, b"hash1", b"w1")
+    checkpoints.add_vote(1, b"hash2", b"w2")
+    checkpoints.add_vote(1, b"hash2", b"w3")
+    assert checkpoints.get_preferred(1) == b"hash2"
+    assert checkpoints.num_votes(1) == 2
+    assert checkpoints.num_votes(2) == 0
+
+
+def test_applied_dots_compaction():
+    applied = AppliedDots()
+    for seq_num in range(1, 11):
+        applied.add(b"chain", Dot((seq_num, b"h")))
+    applied.add(b"other", Dot((1, b"h")))
+    assert applied.compact(b"chain", 8) == 8
+    assert len(applied) == 3
+    # Blocks at or below the watermark count as applied
+    assert applied.contains(b"chain", Dot((5, b"other")))
+    assert applied.contains(b"chain", Dot((9, b"h")))
+    assert not applied.contains(b"chain", Dot((9, b"other")))
+    assert applied.contains(b"other", Dot((1, b"h")))
+    assert not applied.contains(b"other", Dot((2, b"h")))
+    # Watermark never moves back
+    assert applied.compact(b"chain", 3) == 0
+    assert applied.get_watermark(b"chain") == 8
+    assert applied.is_retired(b"chain", Dot((5, b"other")))
+    assert not applied.is_retired(b"chain", Dot((9, b"h")))
+    # Concurrent block applied below the watermark after the compaction
+    applied.add(b"chain", Dot((7, b"late")))
+    assert len(applied) == 4
+    assert applied.contains(b"chain", Dot((7, b"late")))
+    assert not applied.is_retired(b"chain", Dot((7, b"late")))
+
+
+def test_reads_do_not_grow_state():
+    state = PaymentState(10)
+    report = state.memory_report()
+    state.get_last_pairwise_links(b"spender", b"receiver")
+    state.get_last_claim_dot(b"receiver", b"spender")
+    state.is_chain_forked(b"chain", b"peer")
+    state.was_chain_forked(b"chain", b"peer")
+    state.was_balance_negative(b"peer")
+    assert not any(usage["entries"] for usage in report.values())
+    assert state.memory_report() == report
+
+
+def test_minor_unit_amounts():
+    state = PaymentState(2, minor_units=True)
+    minter, receiver = b"minter", b"receiver"
+    state.apply_mint(minter, Dot((1, b"1")), GENESIS_LINK, minter, 1000)
+    spend_dot = Dot((2, b"2"))
+    state.apply_spend(
+        minter,
+        GENESIS_LINK,
+        Links((Dot((1, b"1")),)),
+        spend_dot,
+        minter,
+        receiver,
+        350,
+    )
+    state.apply_confirm(
+        minter, receiver, Links((spend_dot,)), Dot((3, b"3")), minter, spend_dot, 350
+    )
+    assert state.get_balance(minter) == 650
+    assert state.get_balance(receiver) == 350
+    assert type(state.get_balance(receiver)) == int
+    assert state.get_balance(b"unknown") == 0
@@ -0,0 +1,96 @@
+from decimal import Decimal
+
+import pytest
+from bami.backbone.utils import Dot, GENESIS_LINK, Links
+from bami.payment.database import PaymentState
+from bami.payment.exceptions import InconsistentStateHashException
+from bami.payment.snapshot import (
+    decode_snapshot,
+    encode_snapshot,
+    read_snapshot,
+    write_snapshot,
+)
+
+CHAIN_ID = b"chain"
+MINTER = b"minter"
+RECEIVER = b"receiver"
+
+
+def apply_payments(state: PaymentState, value_type=Decimal) -> None:
+    mint_dot = Dot((1, b"1"))
+    spend_dot = Dot((2, b"2"))
+    state.apply_mint(CHAIN_ID, mint_dot, GENESIS_LINK, MINTER, value_type(10))
+    state.apply_spend(
+        CHAIN_ID,
+        GENESIS_LINK,
+        Links((mint_dot,)),
+        spend_dot,
+        MINTER,
+        RECEIVER,
+        value_type(4),
+    )
+    state.apply_confirm(
+        CHAIN_ID,
+        RECEIVER,
+        Links((spend_dot,)),
+        Dot((3, b"3")),
+        MINTER,
+        spend_dot,
+        value_type(4),
+    )
+    # Inconsistent spend value is kept as a tuple
+    state.apply_spend(
+        CHAIN_ID,
+        GENESIS_LINK,
+        Links((spend_dot,)),
+        Dot((4, b"4")),
+        MINTER,
+        RECEIVER,
+        value_type(3),
+    )
+    state.applied_dots.add(CHAIN_ID, mint_dot)
+    state.applied_dots.add(CHAIN_ID, spend_dot)
+    state.compact(CHAIN_ID, 1)
+
+
+@pytest.mark.parametrize("minor_units", [False, True])
+def test_snapshot_round_trip(minor_units):
+    state = PaymentState(10, minor_units=minor_units)
+    apply_payments(state, int if minor_units else Decimal)
+    snapshot = encode_snapshot(state, {CHAIN_ID: 4})
+
+    restored = PaymentState(10, minor_units=minor_units)
+    assert decode_snapshot(snapshot, restored) == {CHAIN_ID: 4}
+    for peer in (MINTER, RECEIVER):
+        assert restored.get_balance(peer) == state.get_balance(peer)
+    assert restored.get_last_state_hash(CHAIN_ID) == state.get_last_state_hash(CHAIN_ID)
+    assert restored.last_spend_values == state.last_spend_values
+    assert restored.applied_dots.watermarks == state.applied_dots.watermarks
+    assert restored.applied_dots.dots == state.applied_dots.dots
+    assert restored.claim_dict[RECEIVER][MINTER] == Dot((2, b"2"))
+
+
+def test_snapshot_of_other_mode_ignored():
+    state = PaymentState(10)
+    apply_payments(state)
+    snapshot = encode_snapshot(state, {CHAIN_ID: 4})
+    assert decode_snapshot(snapshot, PaymentState(10, minor_units=True)) is None
+
+
+def test_snapshot_hash_verified(tmpdir):
+    state = PaymentState(10)
+    apply_payments(state)
+    write_snapshot(str(tmpdir), state, {CHAIN_ID: 4})
+    assert read_snapshot(str(tmpdir), PaymentState(10))[0]
+
+    state.peer_mints[MINTER] += 100
+    write_snapshot(str(tmpdir), state, {CHAIN_ID: 4})
+    # Stored hash is of the state before the change
+    state.touched_peers.clear()
+    state.chain_status_hash[CHAIN_ID] = 0
+    with pytest.raises(InconsistentStateHashException):
+        decode_snapshot(encode_snapshot(state, {CHAIN_ID: 4}), PaymentState(10))
+
+
+def test_no_snapshot(tmpdir):
+    assert read_snapshot(str(tmpdir), PaymentState(10)) == (False, {})
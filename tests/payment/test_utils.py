@@ -0,0 +1,33 @@
+from decimal import Decimal, localcontext
+
+import pytest
+
+from bami.payment.utils import from_minor_units, to_minor_units
+
+
+def test_minor_units_round_trip():
+    assert to_minor_units(Decimal("12.34"), 2) == 1234
+    assert to_minor_units(0.1, 10) == 1_000_000_000
+    assert to_minor_units(7, 3) == 7000
+    assert from_minor_units(1234, 2) == Decimal("12.34")
+
+
+def test_minor_units_rounding():
+    assert to_minor_units(Decimal("0.125"), 2) == 12
+    assert to_minor_units(Decimal("0.135"), 2) == 14
+
+
+def test_minor_units_keep_integer_part():
+    # Decimal amounts of 10 significant digits would round the integer part
+    with localcontext() as context:
+        context.prec = 10
+        assert to_minor_units(Decimal("123456789012.345"), 2) == 12345678901234
+        assert from_minor_units(12345678901234, 2) == Decimal("123456789012.34")
+
+
+@pytest.mark.parametrize("decimals", [-1, 2.5, "2"])
+def test_minor_units_invalid_decimals(decimals):
+    with pytest.raises(ValueError):
+        to_minor_units(1, decimals)
+    with pytest.raises(ValueError):
+        from_minor_units(1, decimals)
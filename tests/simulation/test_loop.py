@@ -0,0 +1,24 @@
+from asyncio import sleep
+import time
+
+from bami.simulation.loop import VirtualTimeEventLoop
+
+
+def test_sleep_advances_virtual_time():
+    loop = VirtualTimeEventLoop()
+    start = time.time()
+    loop.run_until_complete(sleep(3600))
+    assert loop.time() >= 3600
+    assert time.time() - start < 1
+    loop.close()
+
+
+def test_callbacks_in_time_order():
+    loop = VirtualTimeEventLoop(start_time=10)
+    calls = []
+    for delay in (3, 1, 2):
+        loop.call_later(delay, lambda d=delay: calls.append((d, loop.time())))
+    loop.run_until_complete(sleep(5))
+    assert [d for d, _ in calls] == [1, 2, 3]
+    assert [round(t) for _, t in calls] == [11, 12, 13]
+    loop.close()
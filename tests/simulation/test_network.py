@@ -0,0 +1,55 @@
+from asyncio import get_event_loop, sleep
+
+from bami.simulation.loop import VirtualTimeEventLoop
+from bami.simulation.network import NetworkModel, SimulatedNetwork
+from ipv8.messaging.interfaces.endpoint import EndpointListener
+
+
+class Receiver(EndpointListener):
+    def __init__(self, endpoint) -> None:
+        super().__init__(endpoint, main_thread=False)
+        self.received = []
+
+    def on_packet(self, packet) -> None:
+        self.received.append((packet[1], get_event_loop().time()))
+
+
+def send_packets(model, packets):
+    loop = VirtualTimeEventLoop()
+    network = SimulatedNetwork(model)
+    sender, endpoint = network.create_endpoint(), network.create_endpoint()
+    sender.open()
+    endpoint.open()
+    receiver = Receiver(endpoint)
+    endpoint.add_listener(receiver)
+
+    async def send():
+        for packet in packets:
+            sender.send(endpoint.wan_address, packet)
+        await sleep(10)
+
+    loop.run_until_complete(send())
+    loop.close()
+    return network.stats, receiver.received
+
+
+def test_latency():
+    stats, received = send_packets(NetworkModel(latency=0.5), [b"a", b"b"])
+    assert [p for p, _ in received] == [b"a", b"b"]
+    assert all(abs(t - 0.5) < 1e-9 for _, t in received)
+    assert stats.messages_delivered == 2
+    assert stats.bytes_sent == 2
+
+
+def test_bandwidth_queues_packets():
+    packet = b"x" * 1000
+    _, received = send_packets(NetworkModel(latency=0.1, bandwidth=10000), [packet] * 3)
+    # Every packet takes 0.1s to transmit on the uplink
+    assert [round(t, 6) for _, t in received] == [0.2, 0.3, 0.4]
+
+
+def test_loss():
+    stats, received = send_packets(NetworkModel(loss=0.5, seed=1), [b"a"] * 1000)
+    assert stats.messages_sent == 1000
+    assert stats.messages_lost + len(received) == 1000
+    assert 400 < stats.messages_lost < 600
@@ -0,0 +1,75 @@
+from decimal import Decimal
+
+import pytest
+from bami.backbone.recorder import PACKET, read_records, SUBSCRIPTION
+from bami.payment.settings import PaymentSettings
+from bami.simulation.replay import create_replay_node, replay
+from bami.simulation.simulation import default_settings, SimulatedPaymentCommunity
+
+from tests.mocking.base import (
+    connect_nodes,
+    create_node,
+    deliver_messages,
+    unload_nodes,
+)
+
+
+@pytest.mark.asyncio
+async def test_record_and_replay(tmpdir):
+    log_file = str(tmpdir.join("receiver.rec"))
+    settings = PaymentSettings()
+    settings.record_file = log_file
+    nodes = [
+        create_node(SimulatedPaymentCommunity, work_dir=str(tmpdir.mkdir("spender"))),
+        create_node(
+            SimulatedPaymentCommunity,
+            work_dir=str(tmpdir.mkdir("receiver")),
+            settings=settings,
+        ),
+    ]
+    connect_nodes(nodes, SimulatedPaymentCommunity)
+    community_id = nodes[0].overlay.my_pub_key_bin
+    for node in nodes:
+        node.overlay.subscribe_to_subcom(community_id)
+    context = nodes[0].overlay.state_db.context
+    nodes[0].overlay.mint(value=Decimal(10, context))
+    nodes[0].overlay.spend(
+        chain_id=community_id,
+        counter_party=nodes[1].overlay.my_pub_key_bin,
+        value=Decimal(10, context),
+    )
+    await deliver_messages(0.5)
+    receiver_key = nodes[1].my_peer.key
+    spender_key = nodes[0].overlay.my_pub_key_bin
+    # Mint and spend of the spender. The confirm of the receiver links to the same chain,
+    # but it is not inbound and the replayed node creates it again with another hash.
+    spender_chain = nodes[1].overlay.persistence.get_chain(spender_key)
+    spender_dots = {seq_num: spender_chain.versions[seq_num] for seq_num in (1, 2)}
+    balance = nodes[1].overlay.state_db.get_balance(receiver_key.pub().key_to_bin())
+    num_records = nodes[1].overlay.recorder.num_records
+    await unload_nodes(nodes)
+
+    records = list(read_records(log_file))
+    assert len(records) == num_records
+    assert records[0].kind == SUBSCRIPTION
+    assert records[0].data == community_id
+    packets = [record for record in records if record.kind == PACKET]
+    assert packets
+
+    node = create_replay_node(
+        SimulatedPaymentCommunity,
+        str(tmpdir.mkdir("replay")),
+        key=receiver_key,
+        settings=default_settings(),
+    )
+    report = await replay(node.overlay, log_file, speed=0)
+    await deliver_messages(0.5)
+    assert report.subscriptions == 1
+    assert report.packets == len(packets)
+    assert report.packets_per_second > 0
+    replayed_chain = node.overlay.persistence.get_chain(spender_key)
+    for seq_num, hashes in spender_dots.items():
+        assert replayed_chain.versions[seq_num] == hashes
+    assert balance > 0
+    assert node.overlay.state_db.get_balance(node.overlay.my_pub_key_bin) == balance
+    await node.unload()
@@ -0,0 +1,21 @@
+import pytest
+from bami.simulation.network import NetworkModel
+from bami.simulation.simulation import run_simulation, Simulation
+
+
+@pytest.mark.parametrize("degree", [None, 3])
+def test_blocks_converge(degree):
+    sim = Simulation(8, model=NetworkModel(latency=0.05, jitter=0.01), degree=degree)
+    report = run_simulation(sim.measure_convergence(3, timeout=30))
+    assert report.converged
+    assert report.num_blocks == 3
+    assert 0 < report.convergence_time < 30
+    assert report.messages_per_block > 0
+    assert report.bytes_per_block > report.messages_per_block
+
+
+def test_lossy_network_converges():
+    sim = Simulation(8, model=NetworkModel(loss=0.2, seed=3))
+    report = run_simulation(sim.measure_convergence(2, timeout=60))
+    assert report.converged
+    assert sim.stats.messages_lost > 0
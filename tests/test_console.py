@@ -0,0 +1,88 @@
+from bami import __version__
+from bami.backbone.datastore.block_store import LMDBLockStore, MemoryBlockStore
+from bami.console import (
+    LoadGenerator,
+    LoadPaymentCommunity,
+    main,
+    parse_address,
+    percentiles,
+    store_stats,
+)
+import click
+from click.testing import CliRunner
+import pytest
+
+from tests.mocking.base import create_and_connect_nodes, deliver_messages, unload_nodes
+
+
+def test_percentiles():
+    values = [i / 100 for i in range(1, 101)]
+    assert percentiles(values) == {50: 0.5, 90: 0.9, 99: 0.99}
+    assert percentiles([0.3]) == {50: 0.3, 90: 0.3, 99: 0.3}
+    assert percentiles([]) == {50: 0.0, 90: 0.0, 99: 0.0}
+
+
+def test_parse_address():
+    assert parse_address("127.0.0.1:8090") == ("127.0.0.1", 8090)
+    with pytest.raises(click.BadParameter):
+        parse_address("127.0.0.1")
+    with pytest.raises(click.BadParameter):
+        parse_address(":8090")
+
+
+def test_store_stats(tmpdir):
+    store = LMDBLockStore(str(tmpdir))
+    store.add_block(b"hash", b"blob")
+    stats = store_stats(store)
+    assert stats["entries"] >= 1
+    assert 0 < stats["used_bytes"] <= stats["map_size"]
+    store.close()
+    assert store_stats(MemoryBlockStore()) == {}
+
+
+def test_cli():
+    runner = CliRunner()
+    result = runner.invoke(main, ["--version"])
+    assert result.exit_code == 0
+    assert __version__ in result.output
+    result = runner.invoke(main, ["node", "--help"])
+    assert result.exit_code == 0
+    assert "--tps" in result.output
+    result = runner.invoke(main, ["node", "--spend-value", "10", "--mint-value", "5"])
+    assert result.exit_code == 2
+    result = runner.invoke(main, ["replay", "--help"])
+    assert result.exit_code == 0
+    assert "--speed" in result.output
+    assert "--profile" in result.output
+    assert "--monitor-loop" in result.output
+    result = runner.invoke(main, ["replay", "missing.rec"])
+    assert result.exit_code == 2
+
+
+@pytest.mark.asyncio
+async def test_load_generator_confirmations(tmpdir_factory):
+    dirs = [tmpdir_factory.mktemp("load", numbered=True) for _ in range(3)]
+    nodes = create_and_connect_nodes(3, work_dirs=dirs, ov_class=LoadPaymentCommunity)
+    community_id = nodes[0].overlay.my_pub_key_bin
+    for node in nodes:
+        node.overlay.subscribe_to_subcom(community_id)
+    await deliver_messages()
+
+    minter = LoadGenerator(nodes[0].overlay, community_id, 1, 50)
+    other = LoadGenerator(nodes[1].overlay, community_id, 1, 50)
+    # Only the creator of the community can mint
+    assert minter.can_mint and not other.can_mint
+    assert not other.step()
+    for _ in range(5):
+        assert minter.step()
+    await deliver_messages(0.5)
+
+    assert minter.created == minter.confirmed == 5
+    assert not minter.pending
+    assert len(minter.all_latencies) == 5
+    assert "confirmed 5" in minter.report(1.0, 1.0, 0)
+    assert not minter.latencies
+    # Every spend transfers the spend value, the spend values are cumulative
+    balance = nodes[0].overlay.state_db.get_balance(community_id)
+    assert balance == nodes[0].overlay.to_amount(45)
+    await unload_nodes(nodes)